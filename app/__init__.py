@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 
@@ -16,5 +17,43 @@ settings_config = {
     "smtp_server": os.getenv("SMTP_SERVER"),
     "company_product_data_fp": os.getenv("COMPANY_PRODUCT_DATA_FP"),
     "previous_sales_data_fp": os.getenv("PREVIOUS_SALES_DATA_FP"),
+    "imap_checkpoint_fp": os.getenv("IMAP_CHECKPOINT_FP", "imap_checkpoint.json"),
+    "max_concurrent_pipelines": int(os.getenv("MAX_CONCURRENT_PIPELINES", 10)),
+    "pipeline_worker_threads": int(os.getenv("PIPELINE_WORKER_THREADS", 16)),
+    "ddg_timeout": float(os.getenv("DDG_TIMEOUT", 10)),
+    "perplexity_timeout": float(os.getenv("PERPLEXITY_TIMEOUT", 60)),
+    "research_cache_ttl": float(os.getenv("RESEARCH_CACHE_TTL", 24 * 3600)),
+    "research_cache_size": int(os.getenv("RESEARCH_CACHE_SIZE", 1000)),
+    "research_cache_fp": os.getenv("RESEARCH_CACHE_FP"),
+    "job_store_url": os.getenv("JOB_STORE_URL", "sqlite:///jazon.db"),
+    "smtp_max_sessions": int(os.getenv("SMTP_MAX_SESSIONS", 4)),
+    "send_mode": os.getenv("SEND_MODE", "direct"),
+    "compose_mode": os.getenv("COMPOSE_MODE", "two_stage"),
+    "llm_cache_enabled": os.getenv("LLM_CACHE_ENABLED", "false").lower() == "true",
+    "llm_cache_fp": os.getenv("LLM_CACHE_FP", "llm_cache.db"),
+    "llm_cache_ttl": float(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600)),
+    "llm_cache_max_bytes": int(os.getenv("LLM_CACHE_MAX_MB", 100)) * 1024 * 1024,
+    "llm_cache_tasks": [
+        task.strip()
+        for task in os.getenv("LLM_CACHE_TASKS", "Research Task,task compiler").split(",")
+        if task.strip()
+    ],
+    "log_buffer_size": int(os.getenv("LOG_BUFFER_SIZE", 500)),
+    "max_live_workers": int(os.getenv("MAX_LIVE_WORKERS", 1000)),
+    "worker_idle_ttl": float(os.getenv("WORKER_IDLE_TTL", 1800)),
+    "max_worker_summaries": int(os.getenv("MAX_WORKER_SUMMARIES", 100000)),
+    "reply_context_tokens": int(os.getenv("REPLY_CONTEXT_TOKENS", 2000)),
+    "otel_endpoint": os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"),
+    # JSON, e.g. {"openai:gpt-4-turbo-preview": {"requests_per_minute": 500,
+    # "tokens_per_minute": 30000, "max_concurrency": 16}}
+    "rate_limits": json.loads(os.getenv("RATE_LIMITS") or "{}"),
+    "llm_max_retries": int(os.getenv("LLM_MAX_RETRIES", 4)),
+    "work_queue_url": os.getenv("WORK_QUEUE_URL"),
+    "work_queue_lease_seconds": float(os.getenv("WORK_QUEUE_LEASE_SECONDS", 300)),
+    "work_queue_max_attempts": int(os.getenv("WORK_QUEUE_MAX_ATTEMPTS", 3)),
+    "sales_examples": int(os.getenv("SALES_EXAMPLES", 3)),
+    # JSON, e.g. {"reply": 10, "follow_up": 10, "first_touch": 8}
+    "scheduler_class_limits": json.loads(os.getenv("SCHEDULER_CLASS_LIMITS") or "{}"),
+    "scheduler_aging_seconds": float(os.getenv("SCHEDULER_AGING_SECONDS", 30)),
 }
 settings = Settings(**settings_config)
@@ -1,15 +1,51 @@
 from lyzr_automata.agents.agent_base import Agent
 from lyzr_automata.ai_models.openai import OpenAIModel
-from lyzr_automata.ai_models.perplexity import PerplexityModel
-from lyzr_automata.memory.open_ai import OpenAIMemory
+import asyncio
 import email
 import time
+from contextlib import nullcontext
+from threading import Event
 
 from lyzr_automata.tasks.task_base import Task
 from lyzr_automata.tasks.task_literals import InputType, OutputType
-from lyzr_automata.tools.prebuilt_tools import send_email_by_smtp_tool
 from duckduckgo_search import AsyncDDGS
 
+from app.job_store import JobStore
+from app.llm_cache import response_cache
+from app import metrics
+from app.mail_tools import (
+    parse_composed_email,
+    reply_references,
+    reply_subject,
+    send_email,
+    send_email_by_smtp_pool_tool,
+)
+from app.log_buffer import LogBuffer, log_hub
+from app.memory_registry import memory_registry
+from app.rate_limiter import rate_limiter
+from app.reply_context import build_reply_context, clean_text, count_tokens
+from app.research_cache import research_cache
+from app.sales_index import sales_indexes
+from app.scheduler import pipeline_scheduler, run_blocking
+from app.smtp_pool import get_smtp_pool
+from app.thread_index import reply_key
+
+# A routed reply whose answer fails is tried this many times in all, with
+# doubling delays; after that it waits in the job store for a restart.
+REPLY_ATTEMPTS = 3
+REPLY_RETRY_DELAY = 30
+
+REWRITE_RULES = "[IMPORTANT!] use html make it looks humanly written dont use css and make sure you send only the email no extra text as output. Start the output with a line 'Subject: <subject line>' followed by the html email"
+
+
+def perplexity_text(response):
+    """Returns the answer text of a Perplexity response, which arrives as the
+    whole chat completion dict."""
+    if isinstance(response, dict):
+        choices = response.get("choices") or [{}]
+        return choices[0].get("message", {}).get("content") or ""
+    return response or ""
+
 
 class JaWorker:
     def __init__(
@@ -23,17 +59,41 @@ class JaWorker:
         sales_agent_prompt,
         first_email_task_prompt,
         reply_email_task_prompt,
+        ddg_timeout=10,
+        perplexity_timeout=60,
+        job_store=None,
+        send_mode="direct",
+        compose_mode="two_stage",
+        log_buffer_size=500,
+        reply_context_tokens=2000,
+        sales_examples=3,
     ):
         self.open_ai_key = open_ai_key
         self.perplexity_api_key = perplexity_api_key
         self.company_product_data_fp = company_product_data_fp
         self.previous_sales_data_fp = previous_sales_data_fp
-        self.logs = []
+        self.logs = LogBuffer(maxlen=log_buffer_size)
+        self.stage = "queued"
+        self.last_active = time.monotonic()
+        self.pending_messages = []
+        self.replying = set()
+        self.active_replies = 0
+        self.stopped = False
         self.mailer = mailer
         self.draft_mail_agent_prompt = draft_mail_agent_prompt
         self.sales_expert_agent_prompt = sales_agent_prompt
         self.first_email_task_prompt = first_email_task_prompt
         self.reply_email_task_prompt = reply_email_task_prompt
+        self.ddg_timeout = ddg_timeout
+        self.perplexity_timeout = perplexity_timeout
+        self.job_store = job_store or JobStore()
+        self.send_mode = send_mode
+        self.compose_mode = compose_mode
+        self.reply_context_tokens = reply_context_tokens
+        self.sales_examples = sales_examples
+        self.prospect_email = None
+        self.sent_message_ids = []
+        self.queued_at = time.monotonic()
 
     def init(self):
 
@@ -43,6 +103,10 @@ class JaWorker:
 
         self.create_agents()
 
+        # Builds (or finds) the shared retrieval model here, off the event
+        # loop, rather than in the first Task that uses the composer agent.
+        self.company_product_memory.generate_memory_model(self.open_ai_model_text)
+
         self.create_tools()
 
     def configure_mail_service(
@@ -53,6 +117,7 @@ class JaWorker:
         sender_email,
         imap_server,
         smtp_server,
+        smtp_max_sessions=4,
     ):
         self.mail_sender_config = {
             "username": username,
@@ -60,6 +125,7 @@ class JaWorker:
             "host": smtp_server,
             "port": port,
             "sender_email": sender_email,
+            "max_sessions": smtp_max_sessions,
         }
         self.mail_receiver_config = {
             "username": username,
@@ -69,7 +135,17 @@ class JaWorker:
         }
 
     def create_tools(self):
-        self.email_sender_tool = send_email_by_smtp_tool(**self.mail_sender_config)
+        config = self.mail_sender_config
+        self.smtp_pool = get_smtp_pool(
+            config["host"],
+            config["port"],
+            config["username"],
+            config["password"],
+            max_sessions=config["max_sessions"],
+        )
+        self.email_sender_tool = send_email_by_smtp_pool_tool(
+            self.smtp_pool, config["sender_email"]
+        )
 
     async def search_website(self, query):
         results = await AsyncDDGS().text(query, max_results=3)
@@ -77,25 +153,117 @@ class JaWorker:
 
     async def run_pipeline(self, prospect_email):
         self.prospect_email = prospect_email
-        research = await self.research_task(email=prospect_email)
-        self.first_email = self.email_composer(
-            input=f" PROSPECT_INFO : {research}",
-            instructions=self.first_email_task_prompt,
+        # Resume from the last completed stage if this pipeline ran before a restart.
+        state = self.job_store.get_pipeline(prospect_email) or {}
+        self.sent_message_ids = state.get("sent_message_ids") or []
+        research = state.get("research")
+        if research is None:
+            research = await self.research_task(email=prospect_email)
+            self.job_store.save_pipeline(
+                prospect_email, stage="researched", research=research
+            )
+        self.first_email = state.get("first_email")
+        if self.first_email is None:
+            self.stage = "compose"
+            self.first_email = await self.email_composer(
+                input=f" PROSPECT_INFO : {research}",
+                instructions=self.first_email_task_prompt,
+            )
+            self.job_store.save_pipeline(
+                prospect_email, stage="drafted", first_email=self.first_email
+            )
+        self.subject = state.get("subject")
+        if self.subject is None:
+            first_email_rp = await self.send_mail_task(input=self.first_email)
+            self.subject = first_email_rp["subject"]
+            self.job_store.save_pipeline(
+                prospect_email, stage="sent", subject=self.subject
+            )
+        self.auto_reply(
+            subject=self.subject, previous_message=state.get("previous_message")
+        )
+
+    def log(self, message, level="info"):
+        entry = self.logs.append(
+            message, email=self.prospect_email, stage=self.stage, level=level
+        )
+        log_hub.add(entry)
+        self.last_active = time.monotonic()
+        if self.prospect_email is not None:
+            self.job_store.append_log(self.prospect_email, message)
+
+    async def run_task(self, **task_kwargs):
+        cache_key = None
+        if response_cache.should_cache(task_kwargs):
+            cache_key = response_cache.key_for(task_kwargs)
+            cached = await run_blocking(response_cache.get, cache_key)
+            if cached is not None:
+                return cached
+        task_name = task_kwargs.get("name")
+        model = task_kwargs.get("model")
+        model_name = metrics.model_name(model)
+        agent = task_kwargs.get("agent")
+        prompt_text = " ".join(
+            str(part)
+            for part in (
+                getattr(agent, "prompt_persona", ""),
+                task_kwargs.get("instructions", ""),
+                task_kwargs.get("previous_output") or "",
+                task_kwargs.get("default_input", ""),
+            )
         )
-        first_email_rp = self.send_mail_task(input=self.first_email)
-        self.subject = first_email_rp["subject"]
-        self.auto_reply(subject=self.subject)
+        limiter = rate_limiter.for_model(model)
+        # Tokenizing a long prompt is CPU-bound, so it stays off the loop.
+        prompt_tokens = await run_blocking(count_tokens, prompt_text)
+        estimate = rate_limiter.estimate_tokens(model, prompt_tokens)
+        for attempt in range(rate_limiter.max_retries + 1):
+            await limiter.acquire(self.prospect_email, estimate)
+            try:
+                with metrics.span(
+                    "llm", task=task_name, model=model_name, attempt=attempt
+                ) as current:
+                    response = await run_blocking(Task(**task_kwargs).execute)
+                    completion_tokens = await run_blocking(count_tokens, str(response))
+                    metrics.record_llm_usage(
+                        current,
+                        task_name,
+                        model_name,
+                        prompt_text,
+                        response,
+                        prompt_tokens=prompt_tokens,
+                        completion_tokens=completion_tokens,
+                    )
+            except asyncio.CancelledError:
+                limiter.release()
+                raise
+            except Exception as e:
+                delay = limiter.failed(e, attempt)
+                if delay is None or attempt == rate_limiter.max_retries:
+                    raise
+                self.log(
+                    f"{task_name} failed on {limiter.name} ({e}), retrying in {delay:.1f}s",
+                    level="warning",
+                )
+                await asyncio.sleep(delay)
+                continue
+            limiter.succeeded(estimate, prompt_tokens + completion_tokens)
+            break
+        if cache_key is not None:
+            await run_blocking(response_cache.set, cache_key, response)
+        return response
 
     def create_models(self, open_ai_key, perplexity_api_key):
-        self.open_ai_model_text = OpenAIModel(
-            api_key=open_ai_key,
-            parameters={
-                "model": "gpt-4-turbo-preview",
-                "temperature": 1,
-                "max_tokens": 1500,
-            },
+        self.open_ai_model_text = rate_limiter.instrument_openai(
+            OpenAIModel(
+                api_key=open_ai_key,
+                parameters={
+                    "model": "gpt-4-turbo-preview",
+                    "temperature": 1,
+                    "max_tokens": 1500,
+                },
+            )
         )
-        self.perplexity_model_text = PerplexityModel(
+        self.perplexity_model_text = rate_limiter.perplexity_model(
             api_key=perplexity_api_key,
             parameters={
                 "model": "pplx-7b-online",
@@ -113,149 +281,544 @@ class JaWorker:
         self.sales_expert_agent = Agent(
             prompt_persona=self.sales_expert_agent_prompt,
             role="Sales Head Manager",
-            memory=self.previous_sales_conversation_memory,
         )
 
     def create_memories(self, company_product_data_fp, previous_sales_data_fp):
-        self.company_product_memory = OpenAIMemory(file_path=company_product_data_fp)
-        self.previous_sales_conversation_memory = OpenAIMemory(
-            file_path=previous_sales_data_fp
+        self.company_product_memory = memory_registry.get(company_product_data_fp)
+        # Composers get the few previous sales emails closest to the prospect
+        # inline, instead of a remote memory over the whole history.
+        self.sales_index = sales_indexes.get(previous_sales_data_fp)
+
+    async def sales_examples_for(self, query):
+        examples = await run_blocking(
+            self.sales_index.examples_for, str(query), self.sales_examples
         )
+        tokens = await run_blocking(count_tokens, examples)
+        self.log(f"Using {tokens} tokens of previous sales emails as examples")
+        return examples
 
+    @metrics.traced("research")
     async def research_task(self, email):
-        self.logs.append(f"Researching about our prospect {self.prospect_email}")
+        self.stage = "research"
+        self.log(f"Researching about our prospect {self.prospect_email}")
         info = email.split("@")
         name = info[0]
         domain = info[1]
+        self.log("I am searching about our prospect on internet")
+        # Company research, the only Perplexity call, is shared by every
+        # prospect on the domain; the person lookup is a web search, so an
+        # account's prospects cost one call against the Perplexity quota.
+        domain_research, person_results = await asyncio.gather(
+            research_cache.get_or_compute(
+                domain,
+                lambda: self.research_domain(domain),
+                # Retry the summary next time rather than cache a degraded one.
+                cacheable=lambda research: bool(research) and not research.get("partial"),
+            ),
+            self.research_step(
+                "DuckDuckGo person search",
+                self.search_website(f"{name} {domain}"),
+                self.ddg_timeout,
+            ),
+        )
+        # Summaries cached before answers were unwrapped may still be dicts.
+        company_summary = (
+            perplexity_text(domain_research["summary"]) if domain_research else ""
+        )
+        person_research = " ".join(
+            result.get("body", "") for result in person_results or []
+        )
+        self.log("I have completed the research")
+        return f"COMPANY: {company_summary} PERSON: {person_research}"
+
+    async def research_domain(self, domain):
+        # Both lookups only need the domain, so run them side by side.
+        ddg_results, pp_search = await asyncio.gather(
+            self.research_step(
+                "DuckDuckGo search", self.search_website(domain), self.ddg_timeout
+            ),
+            self.research_step(
+                "Perplexity search",
+                self.run_task(
+                    name="Research Task",
+                    output_type=OutputType.TEXT,
+                    input_type=InputType.TEXT,
+                    model=self.perplexity_model_text,
+                    instructions=f"search information online in points about {domain}, what does {domain} website do provide a big summary",
+                    log_output=True,
+                ),
+                self.perplexity_timeout,
+            ),
+        )
+        pp_search = perplexity_text(pp_search)
+        if not ddg_results and not pp_search:
+            return None
+        summary = await self.research_step(
+            "Research summary",
+            self.run_task(
+                name="task compiler",
+                output_type=OutputType.TEXT,
+                input_type=InputType.TEXT,
+                model=self.open_ai_model_text,
+                instructions=f" {pp_search} {ddg_results} - compile this information into a small paragraph",
+                log_output=True,
+            ),
+            None,
+        )
+        partial = not summary
+        if partial:
+            # Fall back to the raw findings rather than losing the research.
+            summary = pp_search or " ".join(
+                result.get("body", "") for result in ddg_results or []
+            )
+        return {
+            "ddg": ddg_results,
+            "perplexity": pp_search,
+            "summary": summary,
+            "partial": partial,
+        }
+
+    async def research_step(self, name, coro, timeout):
+        """Awaits one research lookup, returning "" if it fails or times out."""
         try:
-            ddg_results = await self.search_website(domain)
-        except:
-            ddg_results = ""
-        self.logs.append("I am searching about our prospect on internet")
+            return await asyncio.wait_for(coro, timeout)
+        except asyncio.TimeoutError:
+            self.log(
+                f"{name} timed out, continuing with partial research", level="warning"
+            )
+        except Exception as e:
+            self.log(
+                f"{name} failed ({e}), continuing with partial research", level="error"
+            )
+        return ""
 
-        pp_search = Task(
-            name="Research Task",
-            output_type=OutputType.TEXT,
-            input_type=InputType.TEXT,
-            model=self.perplexity_model_text,
-            instructions=f"search information online in points about {domain}   1. who is {name} with respect to {domain} website,  2. what does {domain} website do provide a big summary 3. {email}",
-            log_output=True,
-        ).execute()
-        response = Task(
-            name="task compiler",
-            output_type=OutputType.TEXT,
-            input_type=InputType.TEXT,
-            model=self.open_ai_model_text,
-            instructions=f" {pp_search} {ddg_results} - compile this information into a small paragraph",
-            log_output=True,
-        ).execute()
-        self.logs.append("I have completed the research")
-        return response
+    async def composer_prompt(self, stage, input, instructions, draft=None):
+        """Returns the agent, instructions and input for one composer call.
 
-    def email_composer(self, input, instructions):
-        self.logs.append("I am drafting an email based on our prospectus")
-        email_draft_task = Task(
-            name="email composer",
-            output_type=OutputType.TEXT,
-            input_type=InputType.TEXT,
-            model=self.open_ai_model_text,
-            agent=self.email_composer_agent,
-            instructions=instructions,
-            log_output=True,
-            default_input=input,
-        ).execute()
-        self.logs.append("Refining email based on our previous sales calls")
-        email_composer_task = Task(
+        ``stage`` is "draft" and then "rewrite" in two_stage mode, or "compose"
+        in single_pass mode.
+        """
+        if stage == "draft":
+            return self.email_composer_agent, instructions, input
+        examples = await self.sales_examples_for(input)
+        if stage == "rewrite":
+            return (
+                self.sales_expert_agent,
+                f"re write this MAIL the way these previous sales emails are written: {examples} {REWRITE_RULES}",
+                f"MAIL : ${draft}",
+            )
+        return (
+            self.email_composer_agent,
+            f"{instructions} Write it the way these previous sales emails are written: {examples} {REWRITE_RULES}",
+            input,
+        )
+
+    def composer_stages(self):
+        return ["compose"] if self.compose_mode == "single_pass" else ["draft", "rewrite"]
+
+    async def email_composer(self, input, instructions):
+        if self.compose_mode == "single_pass":
+            return await self.single_pass_composer(input, instructions)
+        self.log("I am drafting an email based on our prospectus")
+        agent, draft_instructions, default_input = await self.composer_prompt(
+            "draft", input, instructions
+        )
+        with metrics.span("compose_draft", prospect=self.prospect_email or ""):
+            email_draft_task = await self.run_task(
+                name="email composer",
+                output_type=OutputType.TEXT,
+                input_type=InputType.TEXT,
+                model=self.open_ai_model_text,
+                agent=agent,
+                instructions=draft_instructions,
+                log_output=True,
+                default_input=default_input,
+            )
+        self.log("Refining email based on our previous sales calls")
+        agent, rewrite_instructions, default_input = await self.composer_prompt(
+            "rewrite", input, instructions, draft=email_draft_task
+        )
+        with metrics.span("compose_rewrite", prospect=self.prospect_email or ""):
+            email_composer_task = await self.run_task(
+                name="email composer",
+                output_type=OutputType.TEXT,
+                input_type=InputType.TEXT,
+                model=self.open_ai_model_text,
+                instructions=rewrite_instructions,
+                agent=agent,
+                log_output=True,
+                default_input=default_input,
+            )
+        return email_composer_task
+
+    @metrics.traced("compose_single_pass")
+    async def single_pass_composer(self, input, instructions):
+        self.log(
+            "I am drafting an email based on our prospectus and previous sales calls"
+        )
+        agent, compose_instructions, default_input = await self.composer_prompt(
+            "compose", input, instructions
+        )
+        return await self.run_task(
             name="email composer",
             output_type=OutputType.TEXT,
             input_type=InputType.TEXT,
             model=self.open_ai_model_text,
-            instructions="re write this MAIL according to pervious conversions given in the pdf file [IMPORTANT!] use html make it looks humanly written dont use css and make sure you send only the email no extra text as output",
-            agent=self.sales_expert_agent,
+            agent=agent,
+            instructions=compose_instructions,
             log_output=True,
-            default_input=f"MAIL : ${email_draft_task}",
-        ).execute()
-        return email_composer_task
+            default_input=default_input,
+        )
 
-    def send_mail_task(self, input):
-        self.logs.append("Sending first email to our prospect")
-        response = Task(
-            name="Send Email Task",
-            tool=self.email_sender_tool,
-            instructions="Send Email",
-            model=self.open_ai_model_text,
-            previous_output=input,
-            default_input=f"email:{self.prospect_email}",
-        ).execute()
-        self.logs.append("First email sent")
+    async def stream_draft(self, prospect_email, research=None):
+        """Composes a first email for ``prospect_email`` like email_composer, streaming it.
+
+        Yields ``(event, data)`` pairs: ``stage`` when a composer call starts,
+        ``token`` for every piece of text it streams and finally ``draft``
+        with the parsed subject and HTML. Nothing is sent or stored.
+
+        The draft is an approximation of what the pipeline would send: the
+        pipeline's draft call answers through the product-document retrieval
+        memory, which cannot stream, so this one is written without it.
+        """
+        self.prospect_email = prospect_email
+        if research is None:
+            yield "stage", {"stage": "research"}
+            research = await self.research_task(prospect_email)
+        input = f" PROSPECT_INFO : {research}"
+        output = None
+        for stage in self.composer_stages():
+            agent, instructions, default_input = await self.composer_prompt(
+                stage, input, self.first_email_task_prompt, draft=output
+            )
+            yield "stage", {"stage": stage}
+            output = ""
+            async for text in self.stream_task(stage, agent, instructions, default_input):
+                output += text
+                yield "token", {"stage": stage, "text": text}
+        composed = parse_composed_email(output)
+        yield "draft", {"subject": composed.subject, "html": composed.html, "approximate": True}
+
+    async def stream_task(self, stage, agent, instructions, default_input):
+        """Runs one composer call as a chat completion stream, yielding text as it arrives.
+
+        Closing the generator closes the provider's HTTP response, which stops
+        generation, so an abandoned draft stops costing tokens. Streams skip
+        the agent's retrieval memory, which only answers whole responses.
+        Models without an OpenAI client yield their whole response at once.
+        """
+        model = self.open_ai_model_text
+        model_name = metrics.model_name(model)
+        system_persona = f"In your role as {agent.role}, you embody a persona defined by {agent.prompt_persona}."
+        prompt = f"Now execute these instructions: {instructions}.  Input: {default_input}"
+        prompt_text = f"{system_persona} {prompt}"
+        limiter = rate_limiter.for_model(model)
+        prompt_tokens = await run_blocking(count_tokens, prompt_text)
+        estimate = rate_limiter.estimate_tokens(model, prompt_tokens)
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        stopped = Event()
+        streams = []
+
+        def put(item):
+            loop.call_soon_threadsafe(chunks.put_nowait, item)
+
+        def produce():
+            try:
+                if getattr(model, "client", None) is None:
+                    put(model.generate_text(system_persona=system_persona, prompt=prompt))
+                    return
+                stream = model.client.chat.completions.create(
+                    **model.parameters,
+                    messages=[
+                        {"role": "system", "content": system_persona},
+                        {"role": "user", "content": prompt},
+                    ],
+                    stream=True,
+                )
+                streams.append(stream)
+                for chunk in stream:
+                    if stopped.is_set():
+                        break
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                    if text:
+                        put(text)
+            except Exception as e:
+                put(e)
+            finally:
+                put(None)
+                close_streams()
+
+        def close_streams():
+            for stream in streams:
+                stream.response.close()
+
+        await limiter.acquire(self.prospect_email, estimate)
+        started = time.monotonic()
+        output = []
+        completion_tokens = None
+        try:
+            with metrics.span("llm", task="email composer", model=model_name, attempt=0) as current:
+                try:
+                    loop.run_in_executor(None, produce)
+                    while True:
+                        text = await chunks.get()
+                        if text is None:
+                            break
+                        if isinstance(text, Exception):
+                            raise text
+                        if not output:
+                            metrics.TIME_TO_FIRST_TOKEN.labels(stage).observe(
+                                time.monotonic() - started
+                            )
+                        output.append(text)
+                        yield text
+                    completion_tokens = await run_blocking(count_tokens, "".join(output))
+                finally:
+                    # Also unblocks a producer still waiting on the next chunk.
+                    stopped.set()
+                    close_streams()
+                    # An abandoned stream is counted here, on the loop; it
+                    # cannot await once it is being closed.
+                    metrics.record_llm_usage(
+                        current,
+                        "email composer",
+                        model_name,
+                        prompt_text,
+                        "".join(output),
+                        prompt_tokens=prompt_tokens,
+                        completion_tokens=completion_tokens,
+                    )
+        except Exception as e:
+            limiter.failed(e, 0)
+            raise
+        except BaseException:
+            metrics.STREAMS_CANCELLED.labels("email composer").inc()
+            limiter.release()
+            raise
+        limiter.succeeded(estimate, prompt_tokens + completion_tokens)
+
+    @metrics.traced("send")
+    async def send_mail_task(self, input):
+        self.stage = "send"
+        self.log("Sending first email to our prospect")
+        composed = parse_composed_email(input)
+        if self.send_mode == "direct" and composed.subject:
+            response = await self.deliver_email(
+                self.prospect_email, composed.subject, composed.html
+            )
+        else:
+            # No structured subject to send with; let the model extract one.
+            response = await self.run_task(
+                name="Send Email Task",
+                tool=self.email_sender_tool,
+                instructions="Send Email",
+                model=self.open_ai_model_text,
+                previous_output=input,
+                default_input=f"email:{self.prospect_email}",
+            )
+        self.record_sent_message(response)
+        metrics.TIME_TO_FIRST_EMAIL.observe(time.monotonic() - self.queued_at)
+        self.log("First email sent")
         return response
 
-    def auto_reply(self, subject):
-        SUBJECT = subject
-        CHECK_INTERVAL = 60
-        MAX_TIMES = 5
-        mail = self.mailer
-
-        self.previous_message = self.first_email
-
-        def search_emails(subject):
-            mail.select("inbox")
-            result, data = mail.search(None, '(SUBJECT "{}")'.format(subject))
-            if result == "OK":
-                return data[0].split()
-            return []
-
-        def reply_email(to_addr, subject, message_id, current_message):
-            self.logs.append("Received email from the prospect")
-            self.logs.append("Crafting a email based on our sales call history")
-            response_email = self.email_composer(
-                input=f"previous_email:{self.previous_message} current_email:{current_message}",
-                instructions=self.reply_email_task_prompt,
+    async def deliver_email(
+        self, to_addr, subject, html, in_reply_to=None, references=None
+    ):
+        return await run_blocking(
+            send_email,
+            self.smtp_pool,
+            self.mail_sender_config["sender_email"],
+            to_addr,
+            subject,
+            html,
+            in_reply_to=in_reply_to,
+            references=references,
+        )
+
+    def record_sent_message(self, response):
+        message_id = response.get("message_id") if isinstance(response, dict) else None
+        if message_id:
+            self.sent_message_ids.append(message_id)
+            if self.mailer is not None:
+                self.mailer.threads.add_message_id(self.prospect_email, message_id)
+            self.job_store.save_pipeline(
+                self.prospect_email, sent_message_ids=self.sent_message_ids
+            )
+
+    def auto_reply(self, subject, previous_message=None):
+        self.previous_message = previous_message or self.first_email
+        self.replied_ids = self.job_store.replied_ids(self.prospect_email)
+        self.reply_lock = asyncio.Lock()
+        self.reply_count = len(self.replied_ids)
+        # Under the dispatch lock, so the worker is never seen idle (and
+        # compacted) between subscribing and taking its pending replies.
+        with self.dispatch_lock():
+            self.stage = "listening"
+            self.job_store.save_pipeline(self.prospect_email, stage="listening")
+            self.log(
+                f"I am listening to incoming mails from prospect (${self.reply_count + 1})"
+            )
+            if self.mailer is None:
+                # Queue workers: the API process routes replies and enqueues them.
+                return
+            self.mailer.subscribe(
+                self.prospect_email,
+                self,
+                self.mail_sender_config["sender_email"],
+                subject=subject,
+                sent_ids=self.sent_message_ids,
             )
-            self.logs.append("Sending an reply to the prospect")
-            Task(
+            # Replies that arrived while this worker was compacted or restarting.
+            for email_message in self.pending_messages:
+                self.process_email(email_message)
+            self.pending_messages = []
+
+    def dispatch_lock(self):
+        return self.mailer.dispatch_lock if self.mailer is not None else nullcontext()
+
+    def process_email(self, email_message):
+        key = reply_key(email_message)
+        if key in self.replied_ids or key in self.replying:
+            return
+        self.replying.add(key)
+        self.active_replies += 1
+        self.job_store.save_pending_reply(
+            self.prospect_email, key, email_message.as_bytes().decode("latin-1")
+        )
+        self.submit_reply(email_message, time.monotonic())
+
+    def submit_reply(self, email_message, received_at, attempt=0):
+        pipeline_scheduler.submit(
+            f"reply:{reply_key(email_message)}",
+            lambda: self.answer_reply(email_message, received_at, attempt),
+            priority="reply",
+        )
+
+    async def answer_reply(self, email_message, received_at, attempt):
+        """Runs handle_reply for a routed reply, retrying it later if it fails."""
+        try:
+            await self.handle_reply(email_message, received_at)
+        except Exception as e:
+            if attempt + 1 < REPLY_ATTEMPTS:
+                delay = REPLY_RETRY_DELAY * 2**attempt
+                self.log(f"Reply failed ({e}), retrying in {delay}s", level="warning")
+                # Still counted as active, so the worker is not compacted meanwhile.
+                asyncio.get_running_loop().call_later(
+                    delay, self.retry_reply, email_message, received_at, attempt + 1
+                )
+                return
+            self.log(
+                f"Reply failed ({e}), giving up until the next restart", level="error"
+            )
+        self.reply_finished(email_message)
+
+    def retry_reply(self, email_message, received_at, attempt):
+        if self.stopped:
+            self.reply_finished(email_message)
+            return
+        self.submit_reply(email_message, received_at, attempt)
+
+    def reply_finished(self, email_message):
+        with self.dispatch_lock():
+            self.replying.discard(reply_key(email_message))
+            self.active_replies -= 1
+
+    async def handle_reply(self, email_message, received_at=None):
+        from_addr = email.utils.parseaddr(email_message["From"])[1]
+        message_id = email_message["Message-ID"]
+        try:
+            async with self.reply_lock:
+                await self.reply_email(
+                    from_addr, self.subject, message_id, email_message
+                )
+                # Only now, so a failed reply is tried again rather than skipped.
+                self.replied_ids.add(reply_key(email_message))
+                self.previous_message = clean_text(email_message)
+                self.job_store.add_replied_id(
+                    self.prospect_email, reply_key(email_message)
+                )
+                self.job_store.save_pipeline(
+                    self.prospect_email, previous_message=self.previous_message
+                )
+                if received_at is not None:
+                    metrics.TIME_TO_REPLY.observe(time.monotonic() - received_at)
+                self.reply_count += 1
+                self.stage = "listening"
+                self.log(
+                    f"I am listening to incoming mails from prospect (${self.reply_count + 1})"
+                )
+        except Exception:
+            # Back to listening, so the worker can still go idle and be compacted.
+            self.stage = "listening"
+            raise
+
+    @metrics.traced("reply")
+    async def reply_email(self, to_addr, subject, message_id, current_message):
+        self.stage = "reply"
+        self.log("Received email from the prospect")
+        self.log("Crafting a email based on our sales call history")
+        context = await run_blocking(
+            build_reply_context,
+            self.previous_message, current_message, self.reply_context_tokens
+        )
+        self.log(
+            f"Reply context is {context.tokens} tokens ({context.raw_tokens - context.tokens} trimmed)"
+        )
+        response_email = await self.email_composer(
+            input=f"previous_email:{context.previous} current_email:{context.current}",
+            instructions=self.reply_email_task_prompt,
+        )
+        self.log("Sending an reply to the prospect")
+        if self.send_mode == "direct":
+            response = await self.deliver_email(
+                to_addr,
+                reply_subject(subject),
+                parse_composed_email(response_email).html,
+                in_reply_to=message_id,
+                references=reply_references(current_message),
+            )
+        else:
+            response = await self.run_task(
                 name="Send Email Task",
                 tool=self.email_sender_tool,
                 instructions="Send Email",
                 model=self.open_ai_model_text,
                 previous_output=response_email,
                 default_input=f"$ email: {to_addr}, thread_id:${message_id} ,subject: {subject}",
-            ).execute()
-            self.logs.append("Reply sent")
-
-        def get_email_details(email_id):
-            _, data = mail.fetch(email_id, "(RFC822)")
-            raw_email = data[0][1]
-            email_message = email.message_from_bytes(raw_email)
-            from_addr = email.utils.parseaddr(email_message["From"])[1]
-            message_id = email_message["Message-ID"]
-            return from_addr, message_id, email_message
-
-        replied_ids = set()
-        auto_log_sent = True
-        i = 1
-        runs = 1
-        while runs < MAX_TIMES:
-            if runs == MAX_TIMES:
-                self.mailer.logout()
-                break
-            runs = runs + 1
-            if auto_log_sent:
-                self.logs.append(
-                    f"I am listening to incoming mails from prospect (${i})"
-                )
-                auto_log_sent = False
-            try:
-                email_ids = search_emails(SUBJECT)
-                for email_id in email_ids:
-                    if email_id in replied_ids:
-                        continue
-                    from_addr, message_id, email_message = get_email_details(email_id)
-                    reply_email(from_addr, SUBJECT, message_id, email_message)
-                    self.previous_message = email_message
-                    replied_ids.add(email_id)
-                    auto_log_sent = True
-                    i = i + 1
-            except Exception as e:
-                print(f"Error: {e}")
-            time.sleep(CHECK_INTERVAL)
+            )
+        self.record_sent_message(response)
+        self.log("Reply sent")
+
+    async def resume_reply(self, prospect_email, email_message):
+        """Answers one reply from a prospect whose pipeline ran in another process."""
+        self.prospect_email = prospect_email
+        state = self.job_store.get_pipeline(prospect_email) or {}
+        self.sent_message_ids = state.get("sent_message_ids") or []
+        self.first_email = state.get("first_email")
+        self.subject = state.get("subject")
+        self.auto_reply(self.subject, previous_message=state.get("previous_message"))
+        if reply_key(email_message) in self.replied_ids:
+            return
+        # A failure propagates, so the work queue retries the job.
+        self.active_replies += 1
+        try:
+            await self.handle_reply(email_message, time.monotonic())
+        finally:
+            self.active_replies -= 1
+
+    def stop_listening(self):
+        # Also drops replies waiting to be retried.
+        self.stopped = True
+        if self.mailer is not None:
+            self.mailer.unsubscribe(self.prospect_email, self)
+
+    def is_idle(self):
+        return (
+            self.stage in ("listening", "done", "failed")
+            and not self.active_replies
+            and not self.pending_messages
+        )
+
+    def close(self):
+        self.stop_listening()
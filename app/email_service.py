@@ -1,43 +1,258 @@
 import email
 import imaplib
+import json
+import os
+import re
+import select
 import time
-from threading import Thread
+from threading import Event, RLock, Thread
+
+from app import metrics
+from app.thread_index import ThreadIndex
+
 
 class EmailMonitoringService:
-    def __init__(self, imap_server, username, password):
-        self.mail = imaplib.IMAP4_SSL(imap_server)
-        self.mail.login(username, password)
+    """Single shared inbox connection that fans new mail out to subscribed workers.
+
+    Uses IMAP IDLE when the server supports it so replies are picked up within
+    seconds, and falls back to polling every ``poll_interval`` seconds otherwise.
+    Routing and delivering a message hold ``dispatch_lock``, so whoever swaps
+    subscribers (worker compaction) can share it and never race a delivery.
+    """
+
+    def __init__(
+        self,
+        imap_server,
+        username,
+        password,
+        poll_interval=60,
+        idle_timeout=25 * 60,
+        checkpoint_fp=None,
+        fetch_batch_size=50,
+        before_dispatch=None,
+        dispatch_lock=None,
+    ):
+        self.imap_server = imap_server
+        self.username = username
+        self.password = password
+        self.poll_interval = poll_interval
+        # Servers drop IDLE sessions after ~30 minutes, so re-issue it before that.
+        self.idle_timeout = idle_timeout
+        self.checkpoint_fp = checkpoint_fp
+        self.fetch_batch_size = fetch_batch_size
+        self.before_dispatch = before_dispatch
+        self.dispatch_lock = dispatch_lock or RLock()
+        self.checkpoint = self.load_checkpoint()
+        self.threads = ThreadIndex()
+        self.stopped = Event()
+        self.connect()
+
+    def connect(self):
+        self.mail = imaplib.IMAP4_SSL(self.imap_server)
+        self.mail.login(self.username, self.password)
         self.mail.select('inbox')
-        self.subscribers = []
+        self.supports_idle = 'IDLE' in self.mail.capabilities
+        self.sync_state()
+
+    def load_checkpoint(self):
+        if self.checkpoint_fp and os.path.exists(self.checkpoint_fp):
+            try:
+                with open(self.checkpoint_fp) as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable IMAP checkpoint: {e}")
+        return {}
+
+    def save_checkpoint(self):
+        if not self.checkpoint_fp:
+            return
+        tmp_fp = self.checkpoint_fp + ".tmp"
+        with open(tmp_fp, "w") as f:
+            json.dump(self.checkpoint, f)
+        os.replace(tmp_fp, self.checkpoint_fp)
+
+    def sync_state(self):
+        """Validates the checkpoint against the mailbox's UIDVALIDITY after SELECT.
+
+        On first run, or when the server has renumbered the mailbox, sync starts
+        after the newest existing message instead of replaying the whole inbox.
+        """
+        _, data = self.mail.response('UIDVALIDITY')
+        uidvalidity = int(data[0]) if data and data[0] else None
+        if uidvalidity is not None and self.checkpoint.get("uidvalidity") == uidvalidity:
+            return
+        self.checkpoint = {"uidvalidity": uidvalidity, "last_uid": self.highest_uid()}
+        self.save_checkpoint()
+
+    def highest_uid(self):
+        result, data = self.mail.uid('SEARCH', None, 'UID', '*')
+        if result != 'OK' or not data or not data[0]:
+            return 0
+        return max(int(uid) for uid in data[0].split())
+
+    def subscribe(self, prospect, worker, sender_email, subject=None, sent_ids=()):
+        self.threads.subscribe(prospect, worker, sender_email, subject, sent_ids)
 
-    def subscribe(self, worker, filter_function):
-        self.subscribers.append((worker, filter_function))
+    def unsubscribe(self, prospect, worker):
+        self.threads.unsubscribe(prospect, worker)
 
     def fetch_emails(self):
-        result, data = self.mail.search(None, 'ALL')
+        """Fetches messages with a UID above the checkpoint, in batched UID ranges.
+
+        Stops at the first batch that fails, so the messages returned are
+        always a contiguous run from the checkpoint.
+        """
+        last_uid = self.checkpoint.get("last_uid", 0)
+        with metrics.span("imap_search"):
+            result, data = self.mail.uid('SEARCH', None, 'UID', f'{last_uid + 1}:*')
         if result != 'OK':
             print("No messages found!")
             return []
 
+        # "n:*" always matches the newest message, even when its UID is below n.
+        uids = sorted(int(uid) for uid in data[0].split() if int(uid) > last_uid)
         messages = []
-        for num in data[0].split():
-            result, data = self.mail.fetch(num, '(RFC822)')
+        for start in range(0, len(uids), self.fetch_batch_size):
+            batch = uids[start:start + self.fetch_batch_size]
+            with metrics.span("imap_fetch", messages=len(batch)):
+                result, data = self.mail.uid('FETCH', uid_set(batch), '(UID RFC822)')
             if result != 'OK':
-                print("ERROR getting message", num)
-                continue
+                # Stop here so the checkpoint only moves past UIDs we actually
+                # fetched; this batch and the rest are retried next time.
+                print("ERROR getting messages", batch)
+                break
+
+            for item in data:
+                if not isinstance(item, tuple):
+                    continue
+                match = re.search(rb'UID (\d+)', item[0])
+                if match is None:
+                    continue
+                email_msg = email.message_from_bytes(item[1])
+                messages.append((int(match.group(1)), email_msg))
+        return sorted(messages, key=lambda message: message[0])
+
+    def advance_checkpoint(self, messages):
+        if not messages:
+            return
+        self.checkpoint["last_uid"] = max(
+            self.checkpoint.get("last_uid", 0), messages[-1][0]
+        )
+        self.save_checkpoint()
+
+    def dispatch(self, emails):
+        for _, email_msg in emails:
+            with self.dispatch_lock:
+                subscriber = self.threads.route(email_msg)
+                if subscriber is not None:
+                    self.deliver(subscriber, email_msg)
+
+    def deliver(self, subscriber, email_msg):
+        # Subscribers hand the actual work to the pipeline scheduler, so
+        # delivering inline keeps the dispatcher to a single thread.
+        try:
+            subscriber.process_email(email_msg)
+        except Exception as e:
+            print(f"Error delivering email to subscriber: {e}")
+
+    def idle(self, timeout):
+        """Blocks in IMAP IDLE until the server reports new mail or ``timeout`` expires."""
+        tag = self.mail._new_tag()
+        self.mail.send(tag + b" IDLE\r\n")
+        response = self.mail.readline()
+        if not response.startswith(b"+"):
+            raise imaplib.IMAP4.error(f"IDLE rejected: {response!r}")
 
-            email_msg = email.message_from_bytes(data[0][1])
-            messages.append(email_msg)
-        return messages
+        deadline = time.monotonic() + timeout
+        try:
+            while not self.stopped.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # Only SSL sockets buffer decrypted bytes that select() cannot see.
+                pending = getattr(self.mail.sock, "pending", None)
+                if not (pending and pending()):
+                    # Wake up periodically so stop() is honoured promptly.
+                    readable, _, _ = select.select(
+                        [self.mail.sock], [], [], min(remaining, 5)
+                    )
+                    if not readable:
+                        continue
+                line = self.mail.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("connection closed during IDLE")
+                if b"EXISTS" in line:
+                    break
+        finally:
+            self.mail.send(b"DONE\r\n")
+            while True:
+                line = self.mail.readline()
+                if not line or line.startswith(tag):
+                    break
+
+    def wait_for_mail(self):
+        if self.supports_idle:
+            try:
+                self.idle(self.idle_timeout)
+                return
+            except imaplib.IMAP4.abort:
+                raise
+            except imaplib.IMAP4.error as e:
+                print(f"IDLE not usable, falling back to polling: {e}")
+                self.supports_idle = False
+        self.stopped.wait(self.poll_interval)
 
     def distribute_emails(self):
-        while True:
-            emails = self.fetch_emails()
-            for email_msg in emails:
-                for subscriber, filter_func in self.subscribers:
-                    if filter_func(email_msg):
-                        subscriber.process_email(email_msg)
-            time.sleep(60)  # check every minute
+        while not self.stopped.is_set():
+            try:
+                self.wait_for_mail()
+                emails = self.fetch_emails()
+                if emails and self.before_dispatch is not None:
+                    self.before_dispatch(self)
+                self.dispatch(emails)
+                self.advance_checkpoint(emails)
+            except (imaplib.IMAP4.abort, OSError) as e:
+                print(f"IMAP connection lost, reconnecting: {e}")
+                self.reconnect()
+            except Exception as e:
+                # This is the only thread watching the inbox, so a BAD response
+                # or a failing before_dispatch must not end it.
+                print(f"Error checking the inbox, reconnecting: {e}")
+                self.reconnect()
+
+    def reconnect(self):
+        self.stopped.wait(5)
+        if self.stopped.is_set():
+            return
+        try:
+            self.mail.logout()
+        except Exception:
+            pass
+        try:
+            self.connect()
+        except Exception as e:
+            print(f"Error reconnecting to IMAP: {e}")
 
     def start(self):
-        Thread(target=self.distribute_emails).start()
+        Thread(target=self.distribute_emails, daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+        try:
+            self.mail.logout()
+        except Exception:
+            pass
+
+
+def uid_set(uids):
+    """Compresses sorted UIDs into an IMAP sequence set such as ``"3:5,9"``."""
+    ranges = []
+    start = prev = uids[0]
+    for uid in uids[1:]:
+        if uid == prev + 1:
+            prev = uid
+            continue
+        ranges.append(f"{start}:{prev}" if start != prev else str(start))
+        start = prev = uid
+    ranges.append(f"{start}:{prev}" if start != prev else str(start))
+    return ",".join(ranges)
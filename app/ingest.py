@@ -0,0 +1,64 @@
+import codecs
+import csv
+import json
+import re
+
+EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+
+def is_valid_email(email):
+    return bool(email) and EMAIL_PATTERN.match(email) is not None
+
+
+def normalize_email(email):
+    """The form prospects are keyed by everywhere, so duplicates match.
+
+    Anything but a string (e.g. ``{"email": 5}`` in NDJSON) normalizes to ``""``,
+    which ``is_valid_email`` rejects.
+    """
+    if not isinstance(email, str):
+        return ""
+    return email.strip().lower()
+
+
+async def iter_lines(chunks):
+    """Yields decoded text lines from an async stream of byte chunks."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+async def iter_prospect_emails(lines, upload_format="csv"):
+    """Yields the raw email of every row in a CSV or NDJSON upload.
+
+    CSV uploads may have a header with an ``email`` column; otherwise the first
+    column is used. NDJSON rows are either ``{"email": ...}`` or a bare string.
+    """
+    email_column = None
+    async for line in lines:
+        if not line.strip():
+            continue
+        if upload_format == "ndjson":
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield ""
+                continue
+            yield row.get("email", "") if isinstance(row, dict) else str(row)
+            continue
+
+        row = next(csv.reader([line]), [])
+        if email_column is None:
+            header = [column.strip().lower() for column in row]
+            if "email" in header:
+                email_column = header.index("email")
+                continue
+            email_column = 0
+        yield row[email_column] if email_column < len(row) else ""
@@ -0,0 +1,334 @@
+import json
+import sqlite3
+import time
+from threading import Event, Lock, Thread
+
+from app import settings
+
+PIPELINE_FIELDS = (
+    "stage",
+    "research",
+    "first_email",
+    "subject",
+    "sent_message_ids",
+    "previous_message",
+)
+JSON_FIELDS = ("sent_message_ids",)
+# Pipelines in these stages are never resumed.
+TERMINAL_STAGES = ("done", "failed")
+
+
+class JobStore:
+    """Pipeline state store interface.
+
+    The base class keeps nothing, which is what a JaWorker uses when no store
+    is configured. Subclasses persist pipeline stage, reply state and logs so
+    pipelines can resume after a restart.
+    """
+
+    sequence_lock = Lock()
+    sequences = {}
+
+    def save_pipeline(self, email, **fields):
+        pass
+
+    def get_pipeline(self, email):
+        return None
+
+    def load_pipelines(self):
+        return []
+
+    def pipelines_updated_since(self, since):
+        return []
+
+    def add_replied_id(self, email, message_id):
+        pass
+
+    def replied_ids(self, email):
+        return set()
+
+    def save_pending_reply(self, email, message_id, message):
+        pass
+
+    def pending_replies(self, email):
+        return []
+
+    def append_log(self, email, message):
+        pass
+
+    def get_logs(self, email, limit=None):
+        return []
+
+    def log_entries_since(self, email, cursor=0, limit=None):
+        """Returns ``email``'s stored log entries with a row id above ``cursor``, oldest first."""
+        return []
+
+    def reserve_ids(self, name, count):
+        """Returns the first of ``count`` ids in sequence ``name`` that no one else will get."""
+        with self.sequence_lock:
+            start = self.sequences.get(name, 1)
+            self.sequences[name] = start + count
+            return start
+
+    def clear(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteJobStore(JobStore):
+    """SQLite-backed job store that batches writes on a background thread.
+
+    Writes are queued and committed together every ``flush_interval`` seconds
+    or once ``batch_size`` are pending. Reads flush first so they always see
+    the caller's own writes.
+    """
+
+    def __init__(self, path, flush_interval=0.5, batch_size=100, timeout=30):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        # Queue workers share the file, so wait out their write locks.
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=timeout)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS pipelines (
+                email TEXT PRIMARY KEY,
+                stage TEXT,
+                research TEXT,
+                first_email TEXT,
+                subject TEXT,
+                sent_message_ids TEXT,
+                previous_message TEXT,
+                updated_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS replied (
+                email TEXT,
+                message_id TEXT,
+                PRIMARY KEY (email, message_id)
+            );
+            CREATE TABLE IF NOT EXISTS pending_replies (
+                email TEXT,
+                message_id TEXT,
+                message TEXT,
+                PRIMARY KEY (email, message_id)
+            );
+            CREATE TABLE IF NOT EXISTS sequences (
+                name TEXT PRIMARY KEY,
+                value INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT,
+                created_at REAL,
+                message TEXT
+            );
+            CREATE INDEX IF NOT EXISTS logs_email ON logs (email, id);
+            CREATE INDEX IF NOT EXISTS pipelines_updated ON pipelines (updated_at);
+            """
+        )
+        self.conn.commit()
+        self.pending = []
+        self.lock = Lock()
+        self.write_lock = Lock()
+        self.wakeup = Event()
+        self.stopped = Event()
+        self.thread = Thread(target=self.flush_loop, daemon=True)
+        self.thread.start()
+
+    def write(self, sql, params):
+        with self.lock:
+            self.pending.append((sql, params))
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.wakeup.set()
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+            if not pending:
+                return
+            try:
+                with self.conn:
+                    for sql, params in pending:
+                        self.conn.execute(sql, params)
+            except sqlite3.OperationalError:
+                # Locked or busy: keep the batch, ahead of newer writes, for the next flush.
+                with self.lock:
+                    self.pending[:0] = pending
+                raise
+
+    def flush_loop(self):
+        while not self.stopped.is_set():
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Error flushing job store: {e}")
+
+    def query(self, sql, params=()):
+        self.flush()
+        with self.write_lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def save_pipeline(self, email, **fields):
+        unknown = set(fields) - set(PIPELINE_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown pipeline fields: {sorted(unknown)}")
+        values = {
+            key: json.dumps(value) if key in JSON_FIELDS else value
+            for key, value in fields.items()
+        }
+        values["updated_at"] = time.time()
+        self.write(
+            "INSERT INTO pipelines (email, updated_at) VALUES (?, ?) "
+            "ON CONFLICT(email) DO NOTHING",
+            (email, values["updated_at"]),
+        )
+        assignments = ", ".join(f"{key} = ?" for key in values)
+        self.write(
+            f"UPDATE pipelines SET {assignments} WHERE email = ?",
+            (*values.values(), email),
+        )
+
+    def get_pipeline(self, email):
+        rows = self.query(
+            f"SELECT email, {', '.join(PIPELINE_FIELDS)} FROM pipelines WHERE email = ?",
+            (email,),
+        )
+        return self.row_to_pipeline(rows[0]) if rows else None
+
+    def load_pipelines(self):
+        rows = self.query(
+            f"SELECT email, {', '.join(PIPELINE_FIELDS)} FROM pipelines "
+            f"WHERE stage IS NULL OR stage NOT IN ({', '.join('?' * len(TERMINAL_STAGES))}) "
+            "ORDER BY updated_at",
+            TERMINAL_STAGES,
+        )
+        return [self.row_to_pipeline(row) for row in rows]
+
+    def pipelines_updated_since(self, since):
+        rows = self.query(
+            f"SELECT email, {', '.join(PIPELINE_FIELDS)}, updated_at FROM pipelines "
+            "WHERE updated_at >= ? ORDER BY updated_at",
+            (since,),
+        )
+        return [
+            {**self.row_to_pipeline(row[:-1]), "updated_at": row[-1]} for row in rows
+        ]
+
+    def row_to_pipeline(self, row):
+        pipeline = dict(zip(("email",) + PIPELINE_FIELDS, row))
+        for key in JSON_FIELDS:
+            pipeline[key] = json.loads(pipeline[key]) if pipeline[key] else []
+        return pipeline
+
+    def add_replied_id(self, email, message_id):
+        self.write(
+            "INSERT OR IGNORE INTO replied (email, message_id) VALUES (?, ?)",
+            (email, message_id),
+        )
+        self.write(
+            "DELETE FROM pending_replies WHERE email = ? AND message_id = ?",
+            (email, str(message_id)),
+        )
+        # Losing this write could mean replying to the same email twice.
+        self.flush()
+
+    def replied_ids(self, email):
+        rows = self.query("SELECT message_id FROM replied WHERE email = ?", (email,))
+        return {row[0] for row in rows}
+
+    def save_pending_reply(self, email, message_id, message):
+        """Keeps a routed reply until it is answered, since the inbox checkpoint
+        moves past it as soon as it is dispatched."""
+        self.write(
+            "INSERT OR IGNORE INTO pending_replies (email, message_id, message) "
+            "VALUES (?, ?, ?)",
+            (email, str(message_id), message),
+        )
+        self.flush()
+
+    def pending_replies(self, email):
+        rows = self.query(
+            "SELECT message FROM pending_replies WHERE email = ? ORDER BY rowid",
+            (email,),
+        )
+        return [row[0] for row in rows]
+
+    def append_log(self, email, message):
+        self.write(
+            "INSERT INTO logs (email, created_at, message) VALUES (?, ?, ?)",
+            (email, time.time(), message),
+        )
+
+    def get_logs(self, email, limit=None):
+        rows = self.query(
+            "SELECT message FROM logs WHERE email = ? ORDER BY id DESC LIMIT ?",
+            (email, -1 if limit is None else limit),
+        )
+        return [row[0] for row in reversed(rows)]
+
+    def log_entries_since(self, email, cursor=0, limit=None):
+        rows = self.query(
+            "SELECT id, created_at, message FROM logs WHERE email = ? AND id > ? "
+            "ORDER BY id LIMIT ?",
+            (email, cursor, -1 if limit is None else limit),
+        )
+        return [
+            {"id": row[0], "ts": row[1], "email": email, "stage": None, "level": "info", "message": row[2]}
+            for row in rows
+        ]
+
+    def reserve_ids(self, name, count):
+        # Not batched: every process sharing the file must see the new value.
+        with self.write_lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO sequences (name, value) VALUES (?, 1) "
+                "ON CONFLICT(name) DO NOTHING",
+                (name,),
+            )
+            start = self.conn.execute(
+                "SELECT value FROM sequences WHERE name = ?", (name,)
+            ).fetchone()[0]
+            self.conn.execute(
+                "UPDATE sequences SET value = value + ? WHERE name = ?", (count, name)
+            )
+        return start
+
+    def clear(self):
+        with self.lock:
+            self.pending = []
+        with self.write_lock, self.conn:
+            self.conn.execute("DELETE FROM pipelines")
+            self.conn.execute("DELETE FROM replied")
+            self.conn.execute("DELETE FROM pending_replies")
+            self.conn.execute("DELETE FROM logs")
+
+    def close(self):
+        self.stopped.set()
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()
+        self.conn.close()
+
+
+def create_job_store(url):
+    """Builds a job store from a URL such as ``sqlite:///jazon.db`` or ``memory://``."""
+    if not url or url == "none":
+        return JobStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteJobStore(url[len("sqlite:///"):])
+    if url == "memory://":
+        return SQLiteJobStore(":memory:")
+    raise ValueError(f"Unsupported job store URL: {url}")
+
+
+job_store = create_job_store(settings.job_store_url)
@@ -1,12 +1,67 @@
-from lyzr_automata.agents.agent_base import Agent
-from lyzr_automata.ai_models.openai import OpenAIModel
-from lyzr_automata.ai_models.perplexity import PerplexityModel
-from lyzr_automata.memory.open_ai import OpenAIMemory
+import asyncio
+from threading import Lock
 
-from lyzr_automata.tasks.task_base import Task
-from lyzr_automata.tasks.task_literals import InputType, OutputType
-from lyzr_automata.tools.prebuilt_tools import send_email_by_smtp_tool
-from duckduckgo_search import AsyncDDGS
+from app import settings
+from app.memory_registry import memory_registry
+from app.prompts import default_prompts
+from app.reply_context import build_reply_context
+
+# lyzr_automata (and the openai client under it) and duckduckgo_search are
+# imported where they are first used, so a Lambda cold start only pays for
+# them when an invocation actually needs them.
+
+# Models and agents built by one invocation are kept here and reused by every
+# later invocation served by the same warm container. Memories and their
+# retrieval models are kept the same way by memory_registry.
+warm_state = {}
+warm_lock = Lock()
+
+
+def warm(key, build):
+    with warm_lock:
+        value = warm_state.get(key)
+        if value is None:
+            value = warm_state[key] = build()
+        return value
+
+
+def build_models(open_ai_key, perplexity_api_key):
+    from lyzr_automata.ai_models.openai import OpenAIModel
+    from lyzr_automata.ai_models.perplexity import PerplexityModel
+
+    open_ai_model_text = OpenAIModel(
+        api_key=open_ai_key,
+        parameters={
+            "model": "gpt-4-turbo-preview",
+            "temperature": 1,
+            "max_tokens": 1500,
+        },
+    )
+    perplexity_model_text = PerplexityModel(
+        api_key=perplexity_api_key,
+        parameters={
+            "model": "pplx-7b-online",
+        },
+    )
+    print(open_ai_model_text)
+    print(perplexity_model_text)
+    return open_ai_model_text, perplexity_model_text
+
+
+def build_agents(draft_mail_agent_prompt, sales_agent_prompt, company_product_memory, previous_sales_conversation_memory):
+    from lyzr_automata.agents.agent_base import Agent
+
+    email_composer_agent = Agent(
+        prompt_persona=draft_mail_agent_prompt,
+        role="Draft Email Expert",
+        memory=company_product_memory,
+    )
+    sales_expert_agent = Agent(
+        prompt_persona=sales_agent_prompt,
+        role="Sales Head Manager",
+        memory=previous_sales_conversation_memory,
+    )
+    return email_composer_agent, sales_expert_agent
 
 
 class JaWorker:
@@ -20,6 +75,7 @@ class JaWorker:
         sales_agent_prompt,
         first_email_task_prompt,
         reply_email_task_prompt,
+        reply_context_tokens=2000,
     ):
         self.open_ai_key = open_ai_key
         self.perplexity_api_key = perplexity_api_key
@@ -30,6 +86,7 @@ class JaWorker:
         self.sales_expert_agent_prompt = sales_agent_prompt
         self.first_email_task_prompt = first_email_task_prompt
         self.reply_email_task_prompt = reply_email_task_prompt
+        self.reply_context_tokens = reply_context_tokens
 
     def init(self):
 
@@ -45,6 +102,8 @@ class JaWorker:
         pass
 
     async def search_website(self, query):
+        from duckduckgo_search import AsyncDDGS
+
         results = await AsyncDDGS().text(query, max_results=3)
         return results
 
@@ -60,40 +119,44 @@ class JaWorker:
         # self.auto_reply(subject=self.subject)
 
     def create_models(self, open_ai_key, perplexity_api_key):
-        self.open_ai_model_text = OpenAIModel(
-            api_key=open_ai_key,
-            parameters={
-                "model": "gpt-4-turbo-preview",
-                "temperature": 1,
-                "max_tokens": 1500,
-            },
-        )
-        self.perplexity_model_text = PerplexityModel(
-            api_key=perplexity_api_key,
-            parameters={
-                "model": "pplx-7b-online",
-            },
+        self.open_ai_model_text, self.perplexity_model_text = warm(
+            ("models", open_ai_key, perplexity_api_key),
+            lambda: build_models(open_ai_key, perplexity_api_key),
         )
-        print(self.open_ai_model_text)
-        print(self.perplexity_model_text)
 
     def create_agents(self):
-        self.email_composer_agent = Agent(
-            prompt_persona=self.draft_mail_agent_prompt,
-            role="Draft Email Expert",
-            memory=self.company_product_memory,
-        )
-        self.sales_expert_agent = Agent(
-            prompt_persona=self.sales_expert_agent_prompt,
-            role="Sales Head Manager",
-            memory=self.previous_sales_conversation_memory,
+        self.email_composer_agent, self.sales_expert_agent = warm(
+            (
+                "agents",
+                self.draft_mail_agent_prompt,
+                self.sales_expert_agent_prompt,
+                id(self.company_product_memory),
+                id(self.previous_sales_conversation_memory),
+            ),
+            lambda: build_agents(
+                self.draft_mail_agent_prompt,
+                self.sales_expert_agent_prompt,
+                self.company_product_memory,
+                self.previous_sales_conversation_memory,
+            ),
         )
 
     def create_memories(self, company_product_data_fp, previous_sales_data_fp):
-        self.company_product_memory = OpenAIMemory(file_path=company_product_data_fp)
-        self.previous_sales_conversation_memory = OpenAIMemory(
-            file_path=previous_sales_data_fp
-        )
+        self.company_product_memory = memory_registry.get(company_product_data_fp)
+        self.previous_sales_conversation_memory = memory_registry.get(previous_sales_data_fp)
+        # Every Task asks its agent's memory for a retrieval model. The registry
+        # keeps the built ones, so only the cold invocation uploads the files.
+        for memory in (self.company_product_memory, self.previous_sales_conversation_memory):
+            memory.generate_memory_model(self.open_ai_model_text)
+
+    def run_task(self, **task_kwargs):
+        from lyzr_automata.tasks.task_base import Task
+        from lyzr_automata.tasks.task_literals import InputType, OutputType
+
+        if "tool" not in task_kwargs:
+            task_kwargs.setdefault("output_type", OutputType.TEXT)
+            task_kwargs.setdefault("input_type", InputType.TEXT)
+        return Task(**task_kwargs).execute()
 
     async def research_task(self, email):
         self.logs.append(f"Researching about our prospect {self.prospect_email}")
@@ -102,69 +165,103 @@ class JaWorker:
         domain = info[1]
         try:
             ddg_results = await self.search_website(domain)
-        except:
+        except Exception as e:
+            self.logs.append(f"Website search failed ({e}), continuing without it")
             ddg_results = ""
         self.logs.append("I am searching about our prospect on internet")
 
-        pp_search = Task(
+        pp_search = self.run_task(
             name="Research Task",
-            output_type=OutputType.TEXT,
-            input_type=InputType.TEXT,
             model=self.perplexity_model_text,
             instructions=f"search information online in points about {domain}   1. who is {name} with respect to {domain} website,  2. what does {domain} website do provide a big summary 3. {email}",
             log_output=True,
-        ).execute()
-        response = Task(
+        )
+        response = self.run_task(
             name="task compiler",
-            output_type=OutputType.TEXT,
-            input_type=InputType.TEXT,
             model=self.open_ai_model_text,
             instructions=f" {pp_search} {ddg_results} - compile this information into a small paragraph",
             log_output=True,
-        ).execute()
+        )
         self.logs.append("I have completed the research")
         return response
 
     def email_composer(self, input, instructions):
         self.logs.append("I am drafting an email based on our prospectus")
-        email_draft_task = Task(
+        email_draft_task = self.run_task(
             name="email composer",
-            output_type=OutputType.TEXT,
-            input_type=InputType.TEXT,
             model=self.open_ai_model_text,
             agent=self.email_composer_agent,
             instructions=instructions,
             log_output=True,
             default_input=input,
-        ).execute()
+        )
         self.logs.append("Refining email based on our previous sales calls")
-        email_composer_task = Task(
+        email_composer_task = self.run_task(
             name="email composer",
-            output_type=OutputType.TEXT,
-            input_type=InputType.TEXT,
             model=self.open_ai_model_text,
             instructions="re write this MAIL according to pervious conversions given in the pdf file [IMPORTANT!] use html make it looks humanly written dont use css and make sure you send only the email no extra text as output",
             agent=self.sales_expert_agent,
             log_output=True,
             default_input=f"MAIL : ${email_draft_task}",
-        ).execute()
+        )
         return email_composer_task
 
     def send_mail_task(self, input):
         self.logs.append("Sending first email to our prospect")
-        response = Task(
+        response = self.run_task(
             name="Send Email Task",
             tool=self.email_sender_tool,
             instructions="Send Email",
             model=self.open_ai_model_text,
             previous_output=input,
             default_input=f"email:{self.prospect_email}",
-        ).execute()
+        )
         self.logs.append("First email sent")
         return response
 
     def reply_email(self, history_email_body: str, current_email_body: str):
+        context = build_reply_context(
+            history_email_body, current_email_body, self.reply_context_tokens
+        )
+        self.logs.append(
+            f"Reply context is {context.tokens} tokens ({context.raw_tokens - context.tokens} trimmed)"
+        )
         return self.email_composer(
-            input=f"previous_email:{history_email_body} current_email:{current_email_body}",
+            input=f"previous_email:{context.previous} current_email:{context.current}",
             instructions=self.reply_email_task_prompt,
-        )
\ No newline at end of file
+        )
+
+
+def get_worker(prompts=None):
+    prompts = {**default_prompts, **(prompts or {})}
+    worker = JaWorker(
+        open_ai_key=settings.open_ai_key,
+        perplexity_api_key=settings.perplexity_key,
+        company_product_data_fp=settings.company_product_data_fp,
+        previous_sales_data_fp=settings.previous_sales_data_fp,
+        draft_mail_agent_prompt=prompts["draft_email_agent_prompt"],
+        sales_agent_prompt=prompts["sales_agent_prompt"],
+        first_email_task_prompt=prompts["first_email_task_prompt"],
+        reply_email_task_prompt=prompts["reply_email_task_prompt"],
+        reply_context_tokens=settings.reply_context_tokens,
+    )
+    # Only the first invocation in a container builds anything; later ones hit warm_state.
+    worker.init()
+    return worker
+
+
+def lambda_handler(event, context):
+    """Drafts a reply (or, given ``prospect_email``, researches and drafts a first email)."""
+    worker = get_worker(event.get("prompts"))
+    if event.get("prospect_email"):
+        worker.prospect_email = event["prospect_email"]
+        research = asyncio.run(worker.research_task(email=event["prospect_email"]))
+        email = worker.email_composer(
+            input=f" PROSPECT_INFO : {research}",
+            instructions=worker.first_email_task_prompt,
+        )
+    else:
+        email = worker.reply_email(
+            event.get("history_email_body", ""), event["current_email_body"]
+        )
+    return {"email": email, "logs": worker.logs}
@@ -0,0 +1,228 @@
+import time
+from threading import RLock
+
+from app.log_buffer import LogBuffer
+from app.thread_index import reply_key
+
+
+class WorkerSummary:
+    """What is left of a JaWorker once it has been compacted.
+
+    Holds no models, agents or memories. It stays subscribed to the inbox so a
+    late reply from the prospect revives a full worker through ``on_reply``.
+    """
+
+    __slots__ = (
+        "email",
+        "stage",
+        "subject",
+        "sender_email",
+        "sent_message_ids",
+        "reply_count",
+        "logs",
+        "last_active",
+        "mailer",
+        "job_store",
+        "on_reply",
+    )
+
+    def __init__(self, worker, on_reply, log_tail=20):
+        self.email = worker.prospect_email
+        self.stage = worker.stage
+        self.subject = getattr(worker, "subject", None)
+        self.sender_email = worker.mail_sender_config["sender_email"]
+        self.sent_message_ids = tuple(worker.sent_message_ids)
+        self.reply_count = getattr(worker, "reply_count", 0)
+        self.logs = LogBuffer(maxlen=log_tail)
+        for entry in worker.logs.since(0)[-log_tail:]:
+            self.logs.add(entry)
+        self.last_active = worker.last_active
+        self.mailer = worker.mailer
+        self.job_store = worker.job_store
+        self.on_reply = on_reply
+
+    @classmethod
+    def from_pipeline(
+        cls, pipeline, logs, mailer, job_store, sender_email, on_reply, log_tail=20
+    ):
+        """Rebuilds a summary from a stored pipeline that was listening before a restart."""
+        summary = cls.__new__(cls)
+        summary.email = pipeline["email"]
+        summary.stage = pipeline["stage"]
+        summary.subject = pipeline["subject"]
+        summary.sender_email = sender_email
+        summary.sent_message_ids = tuple(pipeline["sent_message_ids"])
+        summary.reply_count = len(job_store.replied_ids(summary.email))
+        summary.logs = LogBuffer(maxlen=log_tail)
+        summary.logs.extend(logs[-log_tail:], email=summary.email)
+        summary.last_active = time.monotonic()
+        summary.mailer = mailer
+        summary.job_store = job_store
+        summary.on_reply = on_reply
+        return summary
+
+    def process_email(self, email_message):
+        # Stored before the revived worker gets to it, so a restart in
+        # between does not lose the reply.
+        self.job_store.save_pending_reply(
+            self.email,
+            reply_key(email_message),
+            email_message.as_bytes().decode("latin-1"),
+        )
+        self.on_reply(self.email, email_message)
+
+    def listen(self):
+        if self.subject and self.stage != "failed":
+            self.mailer.subscribe(
+                self.email,
+                self,
+                self.sender_email,
+                subject=self.subject,
+                sent_ids=self.sent_message_ids,
+            )
+
+    def stop_listening(self):
+        self.mailer.unsubscribe(self.email, self)
+
+    def close(self):
+        self.stop_listening()
+        self.mailer.threads.forget(self.email)
+
+    def is_idle(self):
+        return True
+
+
+class WorkerLifecycle:
+    """Caps server memory by compacting idle JaWorkers into WorkerSummary records.
+
+    A worker is compacted once its pipeline has failed, or once it is only
+    listening for replies and has seen no activity for ``idle_ttl`` seconds.
+    At most ``max_live_workers`` full workers are kept, compacting the least
+    recently active idle ones first, and at most ``max_summaries`` summaries.
+    """
+
+    def __init__(
+        self,
+        workers,
+        revive,
+        max_live_workers=1000,
+        idle_ttl=1800,
+        max_summaries=100000,
+    ):
+        self.workers = workers
+        self.revive_worker = revive
+        self.max_live_workers = max_live_workers
+        self.idle_ttl = idle_ttl
+        self.max_summaries = max_summaries
+        self.compacted = 0
+        self.revived = 0
+        self.dropped = 0
+        # Summaries left subscribed until the worker that replaced them subscribes.
+        self.stand_ins = {}
+        self.lock = RLock()
+
+    def compact(self, email):
+        with self.lock:
+            worker = self.workers.get(email)
+            if worker is None or isinstance(worker, WorkerSummary):
+                return
+            summary = WorkerSummary(worker, self.revive)
+            worker.close()
+            stand_in = self.stand_ins.pop(email, None)
+            if stand_in is not None:
+                # Still subscribed if the worker never got to subscribe itself.
+                stand_in.stop_listening()
+            summary.listen()
+            self.workers[email] = summary
+            self.compacted += 1
+
+    def restore(self, pipeline, logs, mailer, job_store, sender_email):
+        """Resumes a stored listening pipeline as a summary, without building a worker."""
+        summary = WorkerSummary.from_pipeline(
+            pipeline, logs, mailer, job_store, sender_email, self.revive
+        )
+        with self.lock:
+            summary.listen()
+            self.workers[summary.email] = summary
+
+    def replace(self, email, worker):
+        """Makes ``worker`` the full worker for ``email``.
+
+        A summary it replaces stays subscribed until the worker subscribes
+        itself, so replies arriving in between are handed to the worker
+        rather than dropped.
+        """
+        with self.lock:
+            previous = self.workers.get(email)
+            if isinstance(previous, WorkerSummary):
+                self.stand_ins[email] = previous
+            self.workers[email] = worker
+            self.enforce_cap()
+
+    def revive(self, email, email_message):
+        with self.lock:
+            worker = self.workers.get(email)
+            if isinstance(worker, WorkerSummary):
+                self.revived += 1
+                self.revive_worker(email, worker, [email_message])
+            elif (
+                worker is not None
+                and email in self.stand_ins
+                and worker.stage not in ("listening", "done", "failed")
+            ):
+                # Routed to the stand-in: the worker takes it when it subscribes.
+                worker.pending_messages.append(email_message)
+
+    def sweep(self):
+        now = time.monotonic()
+        with self.lock:
+            live, _ = self.partition()
+            for email, worker in live:
+                if not worker.is_idle():
+                    continue
+                finished = worker.stage in ("done", "failed")
+                if finished or now - worker.last_active > self.idle_ttl:
+                    self.compact(email)
+            self.enforce_cap()
+            _, summaries = self.partition()
+            summaries.sort(key=lambda item: item[1].last_active)
+            excess = max(0, len(summaries) - self.max_summaries)
+            for email, summary in summaries[:excess]:
+                summary.close()
+                # No longer listening, so a restart must not bring it back.
+                summary.job_store.save_pipeline(email, stage="done")
+                del self.workers[email]
+                self.dropped += 1
+
+    def enforce_cap(self):
+        with self.lock:
+            live, _ = self.partition()
+            excess = len(live) - self.max_live_workers
+            if excess <= 0:
+                return
+            idle = sorted(
+                (item for item in live if item[1].is_idle()),
+                key=lambda item: item[1].last_active,
+            )
+            for email, _ in idle[:excess]:
+                self.compact(email)
+
+    def partition(self):
+        live, summaries = [], []
+        for email, worker in list(self.workers.items()):
+            if isinstance(worker, WorkerSummary):
+                summaries.append((email, worker))
+            else:
+                live.append((email, worker))
+        return live, summaries
+
+    def stats(self):
+        live, summaries = self.partition()
+        return {
+            "live_workers": len(live),
+            "summaries": len(summaries),
+            "max_live_workers": self.max_live_workers,
+            "compacted": self.compacted,
+            "revived": self.revived,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import sqlite3
+import time
+from threading import Lock
+
+from app import settings
+
+
+class ResponseCache:
+    """Opt-in, size-bounded SQLite cache of LLM task outputs.
+
+    Entries are keyed by model class and parameters, agent persona,
+    instructions and input. Only tasks named in ``cached_tasks`` are cached, so
+    creative temperature=1 drafts are regenerated unless explicitly listed.
+    Text is stored as is and other responses, such as Perplexity's JSON
+    replies, as JSON. Lookups hit SQLite, so call them off the event loop.
+    """
+
+    def __init__(
+        self,
+        path=None,
+        ttl=7 * 24 * 3600,
+        max_bytes=100 * 1024 * 1024,
+        cached_tasks=(),
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.cached_tasks = set(cached_tasks)
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+        self.conn = None
+        if path:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT, size INTEGER, "
+                "created_at REAL, accessed_at REAL)"
+            )
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(responses)")}
+            if "format" not in columns:
+                self.conn.execute("ALTER TABLE responses ADD COLUMN format TEXT")
+            self.conn.commit()
+
+    def should_cache(self, task_kwargs):
+        # Tool tasks have side effects (sending mail) and are never cached.
+        return (
+            self.conn is not None
+            and "tool" not in task_kwargs
+            and task_kwargs.get("name") in self.cached_tasks
+        )
+
+    def key_for(self, task_kwargs):
+        model = task_kwargs.get("model")
+        agent = task_kwargs.get("agent")
+        parts = {
+            "model": type(model).__name__,
+            "parameters": getattr(model, "parameters", None),
+            "persona": getattr(agent, "prompt_persona", None),
+            "instructions": task_kwargs.get("instructions"),
+            "input": task_kwargs.get("default_input"),
+            "previous_output": task_kwargs.get("previous_output"),
+        }
+        encoded = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, created_at, format FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.conn.commit()
+                self.misses += 1
+                return None
+            self.conn.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.conn.commit()
+            self.hits += 1
+            return json.loads(row[0]) if row[2] == "json" else row[0]
+
+    def set(self, key, value):
+        if isinstance(value, str):
+            stored, value_format = value, "text"
+        else:
+            try:
+                stored, value_format = json.dumps(value), "json"
+            except (TypeError, ValueError):
+                return
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, value, size, created_at, accessed_at, format) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, stored, len(stored.encode()), now, now, value_format),
+            )
+            self.evict()
+
+    def evict(self):
+        self.conn.execute(
+            "DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,)
+        )
+        total = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at"
+        ).fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.conn is not None,
+                "cached_tasks": sorted(self.cached_tasks),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+response_cache = ResponseCache(
+    path=settings.llm_cache_fp if settings.llm_cache_enabled else None,
+    ttl=settings.llm_cache_ttl,
+    max_bytes=settings.llm_cache_max_bytes,
+    cached_tasks=settings.llm_cache_tasks,
+)
@@ -2,6 +2,7 @@ import os
 import boto3
 import email
 import re
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
@@ -9,6 +10,12 @@ from email.mime.application import MIMEApplication
 
 region = os.environ['Region']
 
+# Created once per container and reused across warm invocations.
+client_s3 = boto3.client("s3")
+client_ses = boto3.client('ses', region)
+
+S3_FETCH_WORKERS = int(os.environ.get('S3FetchWorkers', 8))
+
 def get_message_from_s3(message_id):
     incoming_email_bucket = os.environ['MailS3Bucket']
     incoming_email_prefix = os.environ['MailS3Prefix']
@@ -20,9 +27,6 @@ def get_message_from_s3(message_id):
 
     object_http_path = (f"http://s3.console.aws.amazon.com/s3/object/{incoming_email_bucket}/{object_path}?region={region}")
 
-    # Create a new S3 client.
-    client_s3 = boto3.client("s3")
-
     # Get the email object from the S3 bucket.
     object_s3 = client_s3.get_object(Bucket=incoming_email_bucket, Key=object_path)
     # Read the content of the message.
@@ -47,7 +51,7 @@ def create_reply_message(file_dict):
     original_sender = mailobject['From']
 
     # Create a new subject line.
-    subject_original = mailobject['Subject']
+    subject_original = mailobject['Subject'] or ""
     subject = "Re: " + subject_original
 
     # The body text of the reply email.
@@ -76,11 +80,6 @@ def create_reply_message(file_dict):
     return message
 
 def send_email(message):
-    aws_region = os.environ['Region']
-
-    # Create a new SES client.
-    client_ses = boto3.client('ses', region)
-
     # Send the email.
     try:
         # Provide the contents of the email.
@@ -102,17 +101,45 @@ def send_email(message):
 
     return output
 
-def lambda_handler(event, context):
-    # Get the unique ID of the message. This corresponds to the name of the file in S3.
-    message_id = event['Records'][0]['ses']['mail']['messageId']
-    print(f"Received message ID {message_id}")
-
-    # Retrieve the file from the S3 bucket.
-    file_dict = get_message_from_s3(message_id)
-
+def process_record(message_id, file_dict):
     # Create the reply message.
     message = create_reply_message(file_dict)
 
     # Send the email and print the result.
     result = send_email(message)
-    print(result)
\ No newline at end of file
+    print(result)
+    if not result.startswith("Email sent!"):
+        raise RuntimeError(result)
+
+def record_message_ids(records):
+    # Get the unique ID of every message in the batch. These correspond to the names of the files in S3.
+    # A redelivered message is answered once, and a record without an ID is
+    # skipped rather than failing the whole batch.
+    message_ids = {}
+    for index, record in enumerate(records):
+        try:
+            message_ids[record['ses']['mail']['messageId']] = None
+        except (KeyError, TypeError) as e:
+            print(f"Skipping malformed record {index}: {e!r}")
+    return list(message_ids)
+
+def lambda_handler(event, context):
+    message_ids = record_message_ids(event.get('Records', []))
+    print(f"Received message IDs {message_ids}")
+    if not message_ids:
+        return {"batchItemFailures": []}
+
+    # Retrieve the files from the S3 bucket concurrently.
+    with ThreadPoolExecutor(max_workers=max(1, min(S3_FETCH_WORKERS, len(message_ids)))) as executor:
+        fetches = {message_id: executor.submit(get_message_from_s3, message_id) for message_id in message_ids}
+
+    # Reply to each message, reporting only the failed ones so the rest are not retried.
+    failures = []
+    for message_id, fetch in fetches.items():
+        try:
+            process_record(message_id, fetch.result())
+        except Exception as e:
+            print(f"Failed to process message ID {message_id}: {e}")
+            failures.append({"itemIdentifier": message_id})
+
+    return {"batchItemFailures": failures}
\ No newline at end of file
@@ -0,0 +1,120 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+
+from app.job_store import job_store
+
+# Log ids are reserved from the job store a block at a time, so they keep
+# increasing across restarts and clients' saved cursors stay valid.
+LOG_ID_BLOCK = 1000
+sequence = {"next": 0, "end": 0}
+sequence_lock = Lock()
+
+
+def next_log_id():
+    with sequence_lock:
+        if sequence["next"] >= sequence["end"]:
+            sequence["next"] = job_store.reserve_ids("log", LOG_ID_BLOCK)
+            sequence["end"] = sequence["next"] + LOG_ID_BLOCK
+        sequence["next"] += 1
+        return sequence["next"] - 1
+
+
+class LogBuffer:
+    """Fixed-size ring buffer of structured log entries.
+
+    Every entry carries a process-wide increasing ``id`` that clients use as a
+    resume cursor, so they only ever receive entries they have not seen.
+    """
+
+    def __init__(self, maxlen=500):
+        self.entries = deque(maxlen=maxlen)
+        self.lock = Lock()
+
+    def append(self, message, email=None, stage=None, level="info"):
+        entry = {
+            "id": next_log_id(),
+            "ts": time.time(),
+            "email": email,
+            "stage": stage,
+            "level": level,
+            "message": message,
+        }
+        self.add(entry)
+        return entry
+
+    def add(self, entry):
+        with self.lock:
+            self.entries.append(entry)
+
+    def extend(self, messages, email=None):
+        for message in messages:
+            self.append(message, email=email)
+
+    def since(self, cursor=0):
+        # Entries are in id order, so walk back only over the new ones.
+        new_entries = []
+        with self.lock:
+            for entry in reversed(self.entries):
+                if entry["id"] <= cursor:
+                    break
+                new_entries.append(entry)
+        new_entries.reverse()
+        return new_entries
+
+    def messages(self):
+        with self.lock:
+            return [entry["message"] for entry in self.entries]
+
+    def last_id(self):
+        with self.lock:
+            return self.entries[-1]["id"] if self.entries else 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.messages())
+
+
+class LogHub(LogBuffer):
+    """Ring buffer of the newest entries across all workers, for multi-prospect streams.
+
+    Every worker entry passes through the hub, so log streams wait on
+    ``listen()`` to be woken by new entries instead of polling.
+    """
+
+    def __init__(self, maxlen=10000):
+        super().__init__(maxlen=maxlen)
+        self.listeners = set()
+
+    def add(self, entry):
+        super().add(entry)
+        with self.lock:
+            listeners = list(self.listeners)
+        for loop, changed in listeners:
+            if not changed.is_set():
+                loop.call_soon_threadsafe(changed.set)
+
+    @contextmanager
+    def listen(self):
+        """Yields an asyncio.Event that is set whenever an entry is added."""
+        listener = (asyncio.get_running_loop(), asyncio.Event())
+        with self.lock:
+            self.listeners.add(listener)
+        try:
+            yield listener[1]
+        finally:
+            with self.lock:
+                self.listeners.discard(listener)
+
+    def since(self, cursor=0, emails=None):
+        entries = super().since(cursor)
+        if emails:
+            entries = [entry for entry in entries if entry["email"] in emails]
+        return entries
+
+
+log_hub = LogHub(maxlen=10000)
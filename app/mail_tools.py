@@ -0,0 +1,97 @@
+import re
+from collections import namedtuple
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formatdate, make_msgid
+from typing import Optional
+
+from lyzr_automata.tools.tool_base import Tool
+from pydantic import BaseModel
+
+
+ComposedEmail = namedtuple("ComposedEmail", ["subject", "html"])
+
+SUBJECT_LINE = re.compile(
+    r"^\s*\**subject\**\s*:\s*\**\s*(.+?)\s*$", re.IGNORECASE | re.MULTILINE
+)
+CODE_FENCE = re.compile(r"^\s*```[a-z]*\s*$", re.IGNORECASE | re.MULTILINE)
+
+
+def parse_composed_email(text):
+    """Splits composer output of the form ``Subject: ...`` + HTML body.
+
+    Returns a ComposedEmail whose subject is None when the model left it out.
+    """
+    text = CODE_FENCE.sub("", str(text)).strip()
+    match = SUBJECT_LINE.search(text)
+    # Only accept a subject line that comes before the body starts.
+    if match is None or "<" in text[:match.start()]:
+        return ComposedEmail(None, text)
+    subject = re.sub(r"<[^>]+>", "", match.group(1)).strip()
+    html = (text[:match.start()] + text[match.end():]).strip()
+    return ComposedEmail(subject or None, html)
+
+
+def reply_subject(subject):
+    return subject if subject.lower().startswith("re:") else f"Re: {subject}"
+
+
+def reply_references(email_message):
+    """Builds the References header for a reply to ``email_message``."""
+    message_id = email_message["Message-ID"]
+    references = (
+        email_message["References"] or email_message["In-Reply-To"] or ""
+    ).split()
+    if message_id and message_id not in references:
+        references.append(message_id)
+    return " ".join(references) or None
+
+
+class SendEmailInput(BaseModel):
+    email: str
+    subject: str
+    body: str
+    thread_id: Optional[str] = None
+
+
+class SendEmailOutput(BaseModel):
+    subject: str
+    message_id: str
+
+
+def build_email(sender_email, to_addr, subject, html_body, in_reply_to=None, references=None):
+    msg = MIMEMultipart("alternative")
+    msg["From"] = sender_email
+    msg["To"] = to_addr
+    msg["Subject"] = subject
+    msg["Date"] = formatdate(localtime=True)
+    msg["Message-ID"] = make_msgid(domain=sender_email.split("@")[-1])
+    if in_reply_to:
+        msg["In-Reply-To"] = in_reply_to
+        msg["References"] = references or in_reply_to
+    msg.attach(MIMEText(html_body, "html"))
+    return msg
+
+
+def send_email(pool, sender_email, to_addr, subject, html_body, in_reply_to=None, references=None):
+    msg = build_email(sender_email, to_addr, subject, html_body, in_reply_to, references)
+    pool.send_message(msg)
+    return {"subject": subject, "message_id": msg["Message-ID"]}
+
+
+def send_email_by_smtp_pool_tool(pool, sender_email):
+    """Same contract as lyzr's send_email_by_smtp_tool, but sends over a shared pool."""
+
+    def send(email, subject, body, thread_id=None):
+        return send_email(
+            pool, sender_email, email, subject, body, in_reply_to=thread_id
+        )
+
+    return Tool(
+        name="Send Email Tool",
+        desc="Sends an HTML email to the given address with the given subject",
+        function=send,
+        function_input=SendEmailInput,
+        function_output=SendEmailOutput,
+        default_params={},
+    )
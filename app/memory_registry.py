@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+from threading import Lock
+
+
+def open_ai_memory_model(file_path, model, ids_file):
+    """Builds lyzr's file-retrieval model for ``file_path``, uploading it unless
+    ``ids_file`` already records an assistant for it."""
+    # Imported here so importing the registry stays cheap on Lambda cold starts.
+    from lyzr_automata.memory.open_ai import FileRetrievalAssistant, OpenAIFileMemoryModel
+
+    # Same setup as OpenAIFileMemoryModel.__init__, except that the assistant
+    # ids are persisted per file content rather than in one shared file.
+    os.environ["OPENAI_API_KEY"] = model.api_key
+    memory_model = OpenAIFileMemoryModel.__new__(OpenAIFileMemoryModel)
+    memory_model.parameters = {"file_path": file_path, "persist": True, **model.parameters}
+    memory_model.model = model.parameters["model"]
+    memory_model.file_path = file_path
+    memory_model.persist = True
+    memory_model.retriever = FileRetrievalAssistant(persist=True, ids_file=ids_file)
+    memory_model.retriever.upload_file(file_path, model=memory_model.model)
+    return memory_model
+
+
+class SharedMemory:
+    """Stands in for OpenAIMemory on an Agent.
+
+    lyzr calls ``generate_memory_model`` for every Task; this one returns the
+    registry's retrieval model for the file's content instead of building
+    and uploading a new one each time.
+    """
+
+    def __init__(self, registry, file_path, content_hash):
+        self.registry = registry
+        self.file_path = file_path
+        self.content_hash = content_hash
+
+    def generate_memory_model(self, model):
+        return self.registry.memory_model(self, model)
+
+
+class MemoryRegistry:
+    """Process-wide cache of knowledge-base retrieval models keyed by file content hash.
+
+    Every JaWorker shares the same knowledge-base files, so each file is
+    uploaded once per model and the resulting retrieval model is reused until
+    the file's content changes. Assistant ids are persisted under ``ids_dir``
+    per content hash, so a restart reuses them and a changed file gets its own.
+    """
+
+    def __init__(self, memory_factory=None, ids_dir="."):
+        self.memory_factory = memory_factory or open_ai_memory_model
+        self.ids_dir = ids_dir
+        self.memories = {}
+        self.models = {}
+        self.file_hashes = {}
+        self.build_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, file_path):
+        """Returns the memory to give an Agent for ``file_path``'s current content."""
+        content_hash = self.content_hash(file_path)
+        with self.lock:
+            memory = self.memories.get(content_hash)
+            if memory is None:
+                memory = self.memories[content_hash] = SharedMemory(
+                    self, file_path, content_hash
+                )
+            return memory
+
+    def memory_model(self, memory, model):
+        key = (
+            memory.content_hash,
+            getattr(model, "api_key", None),
+            json.dumps(getattr(model, "parameters", None) or {}, sort_keys=True, default=str),
+        )
+        with self.lock:
+            memory_model = self.models.get(key)
+            if memory_model is not None:
+                self.hits += 1
+                return memory_model
+            build_lock = self.build_locks.setdefault(key, Lock())
+
+        with build_lock:
+            with self.lock:
+                memory_model = self.models.get(key)
+                if memory_model is not None:
+                    self.hits += 1
+                    return memory_model
+                self.misses += 1
+            memory_model = self.memory_factory(
+                memory.file_path, model, self.ids_file(memory.content_hash, model)
+            )
+            with self.lock:
+                self.models[key] = memory_model
+                self.build_locks.pop(key, None)
+            return memory_model
+
+    def ids_file(self, content_hash, model):
+        # Assistants are created for one model, so the model is part of the name.
+        model_name = (getattr(model, "parameters", None) or {}).get("model", "default")
+        return os.path.join(self.ids_dir, f"assistant_ids.{content_hash[:16]}.{model_name}.json")
+
+    def content_hash(self, file_path):
+        # Only re-read the file when its size or mtime changed since the last lookup.
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            cached = self.file_hashes.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+        with self.lock:
+            self.file_hashes[path] = (signature, content_hash)
+        return content_hash
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "memories": len(self.models),
+            }
+
+    def clear(self):
+        with self.lock:
+            self.memories.clear()
+            self.models.clear()
+            self.file_hashes.clear()
+
+
+memory_registry = MemoryRegistry()
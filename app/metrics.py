@@ -0,0 +1,160 @@
+import asyncio
+import functools
+import time
+from contextlib import contextmanager, nullcontext
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+from app import settings
+from app.reply_context import count_tokens
+
+try:
+    from opentelemetry import trace
+except ImportError:  # optional, spans are only timed into Prometheus
+    trace = None
+
+
+# Estimated USD per 1K prompt / completion tokens, for the cost counter.
+MODEL_PRICES = {
+    "gpt-4-turbo-preview": (0.01, 0.03),
+    "pplx-7b-online": (0.0002, 0.0002),
+}
+
+STAGE_SECONDS = Histogram(
+    "jazon_stage_seconds",
+    "Duration of pipeline stages, LLM calls, IMAP and SMTP operations",
+    ["stage", "status"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120),
+)
+LLM_TOKENS = Counter(
+    "jazon_llm_tokens_total",
+    "Estimated prompt and completion tokens sent to and received from LLMs",
+    ["task", "model", "kind"],
+)
+LLM_COST = Counter(
+    "jazon_llm_cost_usd_total",
+    "Estimated LLM spend in USD",
+    ["model"],
+)
+SLO_BUCKETS = (5, 10, 20, 30, 60, 120, 180, 300, 600, 1200)
+TIME_TO_FIRST_EMAIL = Histogram(
+    "jazon_time_to_first_email_seconds",
+    "Time from a prospect being queued to its first email being sent",
+    buckets=SLO_BUCKETS,
+)
+TIME_TO_REPLY = Histogram(
+    "jazon_time_to_reply_seconds",
+    "Time from a prospect reply being picked up to our answer being sent",
+    buckets=SLO_BUCKETS,
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    "jazon_time_to_first_token_seconds",
+    "Time from a streamed draft being requested to its first token",
+    ["stage"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60),
+)
+SCHEDULER_WAIT = Histogram(
+    "jazon_scheduler_wait_seconds",
+    "Time pipeline scheduler jobs wait for a slot, per priority class",
+    ["priority"],
+    buckets=(0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+STREAMS_CANCELLED = Counter(
+    "jazon_llm_streams_cancelled_total",
+    "Streamed LLM calls stopped early because the client went away",
+    ["task"],
+)
+
+
+class NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+
+def setup_tracing():
+    """Exports spans over OTLP when the OpenTelemetry SDK and exporter are installed.
+
+    The exporter reads OTEL_EXPORTER_OTLP_ENDPOINT (and the other standard
+    OTEL_* variables) itself.
+    """
+    try:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        print("OpenTelemetry SDK or OTLP exporter not installed, not exporting traces")
+        return
+    provider = TracerProvider(resource=Resource.create({"service.name": "jazon-sdr"}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+
+
+if trace is not None and settings.otel_endpoint:
+    setup_tracing()
+tracer = trace.get_tracer("jazon") if trace is not None else None
+
+
+@contextmanager
+def span(stage, **attributes):
+    """Times ``stage`` into jazon_stage_seconds and an OpenTelemetry span, if available."""
+    start = time.perf_counter()
+    status = "ok"
+    trace_span = (
+        tracer.start_as_current_span(stage, attributes=attributes)
+        if tracer is not None
+        else nullcontext(NoopSpan())
+    )
+    # The trace span sees the exception too, and records it on the span.
+    with trace_span as current:
+        try:
+            yield current
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            STAGE_SECONDS.labels(stage, status).observe(time.perf_counter() - start)
+
+
+def traced(stage):
+    """Wraps a JaWorker coroutine method in ``span(stage)``, tagged with the prospect."""
+
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            with span(stage, prospect=self.prospect_email or ""):
+                return await method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def model_name(model):
+    parameters = getattr(model, "parameters", None) or {}
+    return parameters.get("model") or type(model).__name__
+
+
+def record_llm_usage(
+    current, task, model, prompt, completion, prompt_tokens=None, completion_tokens=None
+):
+    """Counts tokens and cost of one LLM call; pass counts already taken to skip recounting."""
+    if prompt_tokens is None:
+        prompt_tokens = count_tokens(str(prompt))
+    if completion_tokens is None:
+        completion_tokens = count_tokens(str(completion))
+    LLM_TOKENS.labels(task, model, "prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(task, model, "completion").inc(completion_tokens)
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0, 0))
+    LLM_COST.labels(model).inc(
+        (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+    )
+    current.set_attribute("llm.prompt_tokens", prompt_tokens)
+    current.set_attribute("llm.completion_tokens", completion_tokens)
+
+
+def render():
+    return generate_latest(), CONTENT_TYPE_LATEST
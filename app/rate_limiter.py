@@ -0,0 +1,328 @@
+import asyncio
+import random
+import re
+import time
+from collections import OrderedDict, deque
+
+import httpx
+import openai
+import requests
+from lyzr_automata.ai_models.perplexity import PerplexityModel
+
+from app import settings
+
+# Tier-1 quotas; override per provider:model with the RATE_LIMITS setting.
+DEFAULT_LIMITS = {
+    "openai:gpt-4-turbo-preview": {
+        "requests_per_minute": 500,
+        "tokens_per_minute": 30000,
+        "max_concurrency": 16,
+    },
+    "perplexity:pplx-7b-online": {
+        "requests_per_minute": 20,
+        "max_concurrency": 4,
+    },
+}
+UNKNOWN_MODEL_LIMITS = {"max_concurrency": 64}
+BURST_SECONDS = 10
+DEFAULT_COMPLETION_TOKENS = 500
+
+
+class ProviderHTTPError(Exception):
+    """A non-200 response from a provider client that does not raise on its own."""
+
+    def __init__(self, status_code, headers, body):
+        super().__init__(f"HTTP {status_code}: {body[:200]}")
+        self.status_code = status_code
+        self.headers = headers
+
+
+class TokenBucket:
+    """Refills at ``per_minute / 60`` per second, holding ``BURST_SECONDS`` of quota."""
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.available = min(
+            self.capacity, self.available + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def time_until(self, amount):
+        self.refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.available) / self.rate)
+
+    def consume(self, amount):
+        self.refill()
+        # May go negative when the real usage turns out higher than estimated.
+        self.available -= amount
+
+    def refund(self, amount):
+        self.refill()
+        self.available = min(self.capacity, self.available + amount)
+
+    def cap(self, remaining):
+        # The provider's own count wins when it is lower than ours.
+        self.refill()
+        self.available = min(self.available, remaining)
+
+
+def parse_reset(value):
+    """Parses OpenAI reset durations such as ``"1s"``, ``"6m0s"`` or ``"20ms"``."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    seconds = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds
+
+
+class ProviderLimiter:
+    """Request and token quotas plus adaptive concurrency for one provider model.
+
+    Callers wait in one queue per worker and are granted slots round-robin
+    across workers, so a prospect with many calls cannot starve the others.
+    The concurrency limit grows by about one per limit's worth of successful
+    calls and halves on every 429 or 5xx (AIMD).
+    """
+
+    def __init__(
+        self,
+        name,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        max_concurrency=8,
+        min_concurrency=1,
+    ):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.queues = OrderedDict()
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.loop = None
+        self.wakeup = None
+        self.pump_task = None
+        self.granted = 0
+        self.throttled = 0
+        self.failures = 0
+
+    async def acquire(self, worker, tokens):
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.wakeup = asyncio.Event()
+            self.pump_task = self.loop.create_task(self.pump())
+        future = self.loop.create_future()
+        self.queues.setdefault(worker, deque()).append((future, tokens))
+        self.wakeup.set()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self.wakeup.set()
+
+    async def pump(self):
+        while True:
+            self.wakeup.clear()
+            delay = self.grant()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def grant(self):
+        """Grants queued calls while quota allows; returns how long to wait before retrying."""
+        while self.queues:
+            worker, waiters = next(iter(self.queues.items()))
+            while waiters and waiters[0][0].done():
+                waiters.popleft()  # cancelled while queued
+            if not waiters:
+                del self.queues[worker]
+                continue
+            if self.in_flight >= int(self.limit):
+                return None
+            wait = self.blocked_until - time.monotonic()
+            tokens = waiters[0][1]
+            if self.requests is not None:
+                wait = max(wait, self.requests.time_until(1))
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.time_until(tokens))
+            if wait > 0:
+                return wait
+            if self.requests is not None:
+                self.requests.consume(1)
+            if self.tokens is not None:
+                self.tokens.consume(tokens)
+            future, _ = waiters.popleft()
+            future.set_result(None)
+            self.in_flight += 1
+            self.granted += 1
+            self.queues.move_to_end(worker)
+        return None
+
+    def succeeded(self, estimated_tokens, used_tokens):
+        if self.tokens is not None and used_tokens is not None:
+            self.tokens.refund(estimated_tokens - used_tokens)
+        self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+        self.release()
+
+    def failed(self, error, attempt):
+        """Releases the slot and returns the backoff delay, or None if ``error`` is not retryable."""
+        self.release()
+        status = getattr(error, "status_code", None)
+        retryable = status is not None and (status == 429 or status >= 500)
+        if not retryable and not isinstance(
+            error, (openai.APIConnectionError, requests.ConnectionError, requests.Timeout)
+        ):
+            return None
+        if status == 429:
+            self.throttled += 1
+        else:
+            self.failures += 1
+        self.decrease()
+        # Full jitter keeps retries from many workers from arriving together.
+        delay = random.uniform(0, min(60, 2 ** attempt))
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        headers = headers if headers is not None else getattr(error, "headers", None) or {}
+        retry_after = parse_reset(headers.get("retry-after"))
+        if retry_after:
+            delay = max(delay, retry_after)
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        return delay
+
+    def decrease(self):
+        self.limit = max(self.min_concurrency, self.limit / 2)
+        self.last_decrease = time.monotonic()
+
+    def observe_headers(self, headers):
+        """Called from provider clients' threads with every response's headers."""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.apply_headers, dict(headers))
+
+    def apply_headers(self, headers):
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            if remaining is None or not remaining.isdigit():
+                continue
+            remaining = int(remaining)
+            if bucket is not None:
+                bucket.cap(remaining)
+            if remaining == 0:
+                reset = parse_reset(headers.get(f"x-ratelimit-reset-{kind}")) or 1
+                self.blocked_until = max(self.blocked_until, time.monotonic() + reset)
+            # Back off before the provider starts refusing, at most once a second.
+            low = limit and limit.isdigit() and remaining < int(limit) * 0.1
+            if low and time.monotonic() - self.last_decrease > 1:
+                self.decrease()
+
+    def stats(self):
+        return {
+            "limit": round(self.limit, 2),
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queued": sum(len(waiters) for waiters in self.queues.values()),
+            "granted": self.granted,
+            "throttled": self.throttled,
+            "failures": self.failures,
+        }
+
+
+class CheckedPerplexityModel(PerplexityModel):
+    """PerplexityModel that raises on HTTP errors instead of returning the error body."""
+
+    limiter = None
+
+    def query_perplexity_api(self, messages):
+        response = requests.post(
+            "https://api.perplexity.ai/chat/completions",
+            headers={
+                "accept": "application/json",
+                "authorization": f"Bearer {self.api_key}",
+                "content-type": "application/json",
+            },
+            json={**self.parameters, "messages": messages},
+            timeout=120,
+        )
+        if self.limiter is not None:
+            self.limiter.observe_headers(response.headers)
+        if response.status_code != 200:
+            raise ProviderHTTPError(response.status_code, response.headers, response.text)
+        return response.json()
+
+
+class RateLimiter:
+    """Process-wide registry of ProviderLimiters keyed by ``provider:model``."""
+
+    def __init__(self, limits=None, max_retries=4):
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.max_retries = max_retries
+        self.limiters = {}
+        self.openai_clients = {}
+
+    def provider(self, model):
+        name = type(model).__name__.lower()
+        for provider in ("openai", "perplexity"):
+            if provider in name:
+                return provider
+        return name
+
+    def for_model(self, model):
+        parameters = getattr(model, "parameters", None) or {}
+        key = f"{self.provider(model)}:{parameters.get('model')}"
+        limiter = self.limiters.get(key)
+        if limiter is None:
+            limiter = ProviderLimiter(key, **self.limits.get(key, UNKNOWN_MODEL_LIMITS))
+            self.limiters[key] = limiter
+        return limiter
+
+    def estimate_tokens(self, model, prompt_tokens):
+        parameters = getattr(model, "parameters", None) or {}
+        return prompt_tokens + parameters.get("max_tokens", DEFAULT_COMPLETION_TOKENS)
+
+    def instrument_openai(self, model):
+        """Swaps the model's OpenAI client for a shared one that reports rate-limit
+        headers and leaves retries to the limiter."""
+        limiter = self.for_model(model)
+        client = self.openai_clients.get((model.api_key, limiter.name))
+        if client is None:
+            client = openai.OpenAI(
+                api_key=model.api_key,
+                max_retries=0,
+                http_client=httpx.Client(
+                    event_hooks={"response": [lambda response: limiter.observe_headers(response.headers)]}
+                ),
+            )
+            self.openai_clients[(model.api_key, limiter.name)] = client
+        model.client = client
+        return model
+
+    def perplexity_model(self, api_key, parameters):
+        model = CheckedPerplexityModel(api_key=api_key, parameters=parameters)
+        model.limiter = self.for_model(model)
+        return model
+
+    def stats(self):
+        return {key: limiter.stats() for key, limiter in self.limiters.items()}
+
+
+rate_limiter = RateLimiter(settings.rate_limits, max_retries=settings.llm_max_retries)
@@ -0,0 +1,172 @@
+import math
+import re
+from collections import namedtuple
+from email.message import Message
+from html.parser import HTMLParser
+
+try:
+    import tiktoken
+except ImportError:  # optional, token counts fall back to an estimate
+    tiktoken = None
+
+
+ReplyContext = namedtuple("ReplyContext", ["previous", "current", "tokens", "raw_tokens"])
+
+HTML_TAG = re.compile(r"<[a-z][^>]*>", re.IGNORECASE)
+BLOCK_TAGS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "table", "ul", "ol"}
+VOID_TAGS = {"br", "img", "hr", "meta", "link", "input", "wbr"}
+QUOTE_CLASSES = ("gmail_quote", "moz-cite-prefix", "yahoo_quoted", "protonmail_quote")
+
+# Lines that start the quoted history of a reply; everything after is dropped.
+QUOTE_HEADERS = [
+    re.compile(r"^On\b[^\n]*(\n[^\n]*)?\bwrote:\s*$", re.MULTILINE),
+    re.compile(r"^-{2,}\s*Original Message\s*-{2,}\s*$", re.IGNORECASE | re.MULTILINE),
+    re.compile(r"^_{10,}\s*$", re.MULTILINE),
+    re.compile(r"^From:[^\n]*\n(Sent|Date):", re.MULTILINE),
+]
+# Lines that start a signature or a client footer.
+SIGNATURES = [
+    re.compile(r"^--\s*$", re.MULTILINE),
+    re.compile(r"^Sent from my \w+", re.MULTILINE),
+    re.compile(r"^Get Outlook for \w+", re.MULTILINE),
+]
+
+TRUNCATED = " [...]"
+
+encoding = None
+
+
+def count_tokens(text):
+    global encoding
+    if tiktoken is None:
+        # Roughly four characters per token for English prose.
+        return math.ceil(len(text) / 4)
+    if encoding is None:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, budget):
+    if budget <= 0:
+        return ""
+    if count_tokens(text) <= budget:
+        return text
+    budget = max(1, budget - count_tokens(TRUNCATED))
+    if tiktoken is None:
+        text = text[: budget * 4]
+    else:
+        text = encoding.decode(encoding.encode(text, disallowed_special=())[:budget])
+    # Cut back to a word boundary so the model does not see half a word.
+    words = text.rsplit(None, 1)
+    return (words[0] if len(words) > 1 else text).rstrip() + TRUNCATED
+
+
+class TextExtractor(HTMLParser):
+    """Collects the visible text of an HTML body, skipping quoted history."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            if tag == "br" and not self.skip_depth:
+                self.parts.append("\n")
+            return
+        classes = dict(attrs).get("class") or ""
+        if (
+            self.skip_depth
+            or tag in ("blockquote", "script", "style", "head")
+            or any(name in classes for name in QUOTE_CLASSES)
+        ):
+            self.skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in VOID_TAGS:
+            return
+        if self.skip_depth:
+            self.skip_depth -= 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+    def text(self):
+        return "".join(self.parts)
+
+
+def html_to_text(html):
+    parser = TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return parser.text()
+
+
+def decode_part(part):
+    payload = part.get_payload(decode=True)
+    if payload is None:
+        return str(part.get_payload())
+    return payload.decode(part.get_content_charset() or "utf-8", errors="replace")
+
+
+def message_text(message):
+    """Returns the readable body of an email.message.Message, HTML or plain string."""
+    if message is None:
+        return ""
+    if not isinstance(message, Message):
+        text = str(message)
+        return html_to_text(text) if HTML_TAG.search(text) else text
+
+    html = None
+    for part in message.walk():
+        if part.is_multipart() or part.get_content_disposition() == "attachment":
+            continue
+        content_type = part.get_content_type()
+        if content_type == "text/plain":
+            return decode_part(part)
+        if content_type == "text/html" and html is None:
+            html = decode_part(part)
+    return html_to_text(html) if html is not None else ""
+
+
+def strip_quoted(text):
+    for pattern in QUOTE_HEADERS:
+        match = pattern.search(text)
+        if match:
+            text = text[: match.start()]
+    return "\n".join(line for line in text.splitlines() if not line.startswith(">"))
+
+
+def strip_signature(text):
+    for pattern in SIGNATURES:
+        match = pattern.search(text)
+        if match:
+            text = text[: match.start()]
+    return text
+
+
+def clean_text(message):
+    text = strip_signature(strip_quoted(message_text(message)))
+    text = re.sub(r"[ \t\xa0]+", " ", text)
+    return re.sub(r"\s*\n\s*(\n\s*)+", "\n\n", text).strip()
+
+
+def build_reply_context(previous_message, current_message, budget=2000):
+    """Reduces the previous and current email of a thread to their new text.
+
+    The current email gets the budget first, keeping up to a third of it for
+    the previous email, which then gets whatever the current one left over.
+    """
+    previous = clean_text(previous_message)
+    current = clean_text(current_message)
+    current = truncate_tokens(current, budget - min(count_tokens(previous), budget // 3))
+    previous = truncate_tokens(previous, budget - count_tokens(current))
+    raw_tokens = count_tokens(str(previous_message or "")) + count_tokens(str(current_message))
+    return ReplyContext(
+        previous, current, count_tokens(previous) + count_tokens(current), raw_tokens
+    )
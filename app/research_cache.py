@@ -0,0 +1,156 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from threading import Lock, Timer
+
+from app import settings
+
+
+class ResearchCache:
+    """Per-domain research results with a TTL, LRU size limit and optional JSON file.
+
+    Prospects from the same company share one DDG search, Perplexity query and
+    compiled summary. Concurrent misses for a domain wait on a single lookup.
+    Writes to the file are batched on a timer thread, at most one every
+    ``save_delay`` seconds, so a burst of new domains never blocks the loop.
+    """
+
+    def __init__(self, ttl=24 * 3600, max_entries=1000, persist_fp=None, save_delay=5):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.persist_fp = persist_fp
+        self.save_delay = save_delay
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+        self.save_lock = Lock()
+        self.save_timer = None
+        self.load()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        self.schedule_save()
+
+    async def get_or_compute(self, key, compute, cacheable=bool):
+        """Returns the cached value for ``key`` or awaits ``compute()`` once for all callers.
+
+        Results for which ``cacheable`` is false (by default, falsy ones) are
+        handed back but not stored, so failed lookups are retried.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        pending = self.in_flight.get(key)
+        if pending is not None:
+            # Joining an in-flight lookup costs no external calls.
+            with self.lock:
+                self.misses -= 1
+                self.hits += 1
+            return await asyncio.shield(pending)
+
+        pending = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = pending
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            pending.cancel()
+            raise
+        except Exception as e:
+            pending.set_exception(e)
+            # Nobody else may be waiting; avoid "exception never retrieved".
+            pending.exception()
+            raise
+        else:
+            pending.set_result(value)
+            if cacheable(value):
+                self.set(key, value)
+            return value
+        finally:
+            self.in_flight.pop(key, None)
+
+    def load(self):
+        if not self.persist_fp or not os.path.exists(self.persist_fp):
+            return
+        try:
+            with open(self.persist_fp) as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable research cache: {e}")
+            return
+        now = time.time()
+        for key, (stored_at, value) in stored.items():
+            if now - stored_at <= self.ttl:
+                self.entries[key] = (stored_at, value)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def schedule_save(self):
+        if not self.persist_fp:
+            return
+        with self.lock:
+            if self.save_timer is not None:
+                return
+            self.save_timer = Timer(self.save_delay, self.flush)
+            self.save_timer.daemon = True
+            self.save_timer.start()
+
+    def flush(self):
+        """Writes pending changes now; called by the timer and on shutdown."""
+        with self.lock:
+            if self.save_timer is not None:
+                self.save_timer.cancel()
+                self.save_timer = None
+        self.save()
+
+    def save(self):
+        if not self.persist_fp:
+            return
+        with self.lock:
+            stored = dict(self.entries)
+        with self.save_lock:
+            tmp_fp = self.persist_fp + ".tmp"
+            with open(tmp_fp, "w") as f:
+                json.dump(stored, f)
+            os.replace(tmp_fp, self.persist_fp)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+            }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        self.flush()
+
+
+research_cache = ResearchCache(
+    ttl=settings.research_cache_ttl,
+    max_entries=settings.research_cache_size,
+    persist_fp=settings.research_cache_fp,
+)
@@ -0,0 +1,119 @@
+import heapq
+import math
+import re
+from collections import Counter
+from threading import Lock
+
+from app.memory_registry import memory_registry
+from app.reply_context import truncate_tokens
+
+WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+# Lines that start a new example in a sales-history file: "Email 3: ...",
+# "Conversation 12", "Thread #4" or a separator line.
+EXAMPLE_START = re.compile(
+    r"^(?:(?:email|conversation|thread)\s*#?\d+\b.*|-{3,}|={3,})\s*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+STOPWORDS = frozenset(
+    """a an and are as at be but by for from has have hi i if in is it its me my
+    of on or our so that the their them they this to us was we were what when
+    which will with you your""".split()
+)
+# Query terms past this many, rarest first, barely change the ranking.
+MAX_QUERY_TERMS = 64
+
+
+def tokenize(text):
+    return [word for word in WORD.findall(text.lower()) if word not in STOPWORDS]
+
+
+def split_examples(text):
+    """Splits a sales-history corpus into its individual emails or threads."""
+    # Histories are sometimes pasted as a Python string literal.
+    text = re.sub(r'^\s*\w+\s*=\s*"""|"""\s*$', "", text)
+    starts = [match.start() for match in EXAMPLE_START.finditer(text)]
+    if starts:
+        bounds = starts + [len(text)]
+        chunks = [text[:starts[0]]] + [
+            text[start:end] for start, end in zip(bounds, bounds[1:])
+        ]
+    else:
+        chunks = re.split(r"\n\s*\n\s*\n", text)
+    return [chunk.strip() for chunk in chunks if len(tokenize(chunk)) > 3]
+
+
+class SalesIndex:
+    """Okapi BM25 over previous sales emails, for picking composer examples.
+
+    Built once per sales-history file; ``search`` only walks the postings of
+    the query's terms, so lookups stay fast as the history grows.
+    """
+
+    def __init__(self, examples, k1=1.5, b=0.75):
+        self.examples = examples
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.lengths = []
+        for doc_id, example in enumerate(examples):
+            counts = Counter(tokenize(example))
+            self.lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                self.postings.setdefault(term, []).append((doc_id, count))
+        average_length = sum(self.lengths) / len(self.lengths) if examples else 0
+        self.norms = [
+            k1 * (1 - b + b * length / average_length) for length in self.lengths
+        ]
+        self.idf = {
+            term: math.log(1 + (len(examples) - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    @classmethod
+    def from_file(cls, file_path):
+        with open(file_path, errors="ignore") as f:
+            return cls(split_examples(f.read()))
+
+    def search(self, query, k=3):
+        """Returns the ``k`` examples most relevant to ``query``, best first."""
+        terms = sorted(
+            {term for term in tokenize(query) if term in self.idf},
+            key=self.idf.get,
+            reverse=True,
+        )[:MAX_QUERY_TERMS]
+        scores = Counter()
+        for term in terms:
+            idf = self.idf[term]
+            for doc_id, count in self.postings[term]:
+                scores[doc_id] += idf * count * (self.k1 + 1) / (count + self.norms[doc_id])
+        if not scores:
+            # Nothing in common; any examples still show the house style.
+            return self.examples[:k]
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [self.examples[doc_id] for doc_id, _ in best]
+
+    def examples_for(self, query, k=3, max_tokens=500):
+        """Formats the top ``k`` examples for a prompt, each cut to ``max_tokens``."""
+        return "\n\n".join(
+            f"Example {rank}:\n{truncate_tokens(example, max_tokens)}"
+            for rank, example in enumerate(self.search(query, k), 1)
+        )
+
+
+class SalesIndexRegistry:
+    """Process-wide SalesIndex per sales-history file, rebuilt when its content changes."""
+
+    def __init__(self):
+        self.indexes = {}
+        self.lock = Lock()
+
+    def get(self, file_path):
+        content_hash = memory_registry.content_hash(file_path)
+        with self.lock:
+            index = self.indexes.get(content_hash)
+            if index is None:
+                index = self.indexes[content_hash] = SalesIndex.from_file(file_path)
+            return index
+
+
+sales_indexes = SalesIndexRegistry()
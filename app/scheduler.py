@@ -0,0 +1,242 @@
+import asyncio
+import functools
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+
+from app import metrics, settings
+
+
+# Highest priority first: answering a prospect who wrote back beats
+# resuming a conversation, which beats researching a new prospect.
+PRIORITIES = ("reply", "follow_up", "first_touch")
+
+
+class PipelineScheduler:
+    """Runs every prospect pipeline on one shared event loop.
+
+    At most ``max_concurrency`` jobs run at once, and at most
+    ``class_limits[priority]`` of each priority class; by default first
+    touches leave a fifth of the slots to replies and follow-ups, so a bulk
+    import never fills the scheduler. Free slots go to the waiting job with
+    the best priority. A job waiting ``aging_seconds`` is raised one class,
+    never further, never above follow-ups and never ahead of a waiting
+    reply, so a first touch that has waited longer than a backlog of
+    follow-ups runs before them but cannot delay replies. Blocking
+    LLM and SMTP calls go through ``run_blocking`` onto a thread pool of
+    ``worker_threads`` threads.
+    """
+
+    def __init__(
+        self, max_concurrency=10, worker_threads=16, class_limits=None, aging_seconds=30
+    ):
+        self.max_concurrency = max_concurrency
+        self.worker_threads = worker_threads
+        self.class_limits = {
+            "reply": max_concurrency,
+            "follow_up": max_concurrency,
+            "first_touch": max(1, max_concurrency - max(1, max_concurrency // 5)),
+            **(class_limits or {}),
+        }
+        self.aging_seconds = aging_seconds
+        self.executor = ThreadPoolExecutor(
+            max_workers=worker_threads, thread_name_prefix="pipeline"
+        )
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self.executor)
+        self.thread = Thread(target=self.loop.run_forever, daemon=True)
+        self.waiting = {priority: deque() for priority in PRIORITIES}
+        self.classes = {
+            priority: {
+                "queued": 0,
+                "running": 0,
+                "started": 0,
+                "wait_seconds": 0.0,
+                "max_wait_seconds": 0.0,
+            }
+            for priority in PRIORITIES
+        }
+        self.jobs = {}
+        self.queued = 0
+        self.running = 0
+        self.lock = Lock()
+
+    def start(self):
+        if not self.thread.is_alive():
+            self.thread.start()
+
+    def submit(self, key, coro_factory, priority="first_touch"):
+        """Queues ``coro_factory()`` under ``key`` in a priority class and returns a concurrent Future."""
+        if priority not in self.waiting:
+            raise ValueError(f"Unknown priority: {priority}")
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(
+            self.run(coro_factory, priority), self.loop
+        )
+        with self.lock:
+            self.jobs[key] = future
+        future.add_done_callback(functools.partial(self.forget, key))
+        return future
+
+    async def run(self, coro_factory, priority):
+        counts = self.classes[priority]
+        slot = self.loop.create_future()
+        queued_at = time.monotonic()
+        self.waiting[priority].append((slot, queued_at))
+        self.queued += 1
+        counts["queued"] += 1
+        self.dispatch()
+        try:
+            await slot
+        except asyncio.CancelledError:
+            if slot.done() and not slot.cancelled():
+                self.release(priority)
+            else:
+                # Left in the deque; dispatch skips it.
+                self.queued -= 1
+                counts["queued"] -= 1
+            raise
+        waited = time.monotonic() - queued_at
+        counts["wait_seconds"] += waited
+        counts["max_wait_seconds"] = max(counts["max_wait_seconds"], waited)
+        metrics.SCHEDULER_WAIT.labels(priority).observe(waited)
+        try:
+            return await coro_factory()
+        finally:
+            self.release(priority)
+
+    def dispatch(self):
+        """Hands free slots to the best waiting jobs."""
+        while self.running < self.max_concurrency:
+            now = time.monotonic()
+            best = None
+            for rank, priority in enumerate(PRIORITIES):
+                waiters = self.waiting[priority]
+                while waiters and waiters[0][0].done():
+                    waiters.popleft()  # cancelled while queued
+                if not waiters or self.classes[priority]["running"] >= self.class_limits[priority]:
+                    continue
+                queued_at = waiters[0][1]
+                # Whole classes, so within one the longest-waiting job wins.
+                # Never into the best non-reply class's place ahead of it, or
+                # an aged follow-up would always beat an aged first touch.
+                aged = max(rank - (now - queued_at) // self.aging_seconds, rank - 1, 1)
+                score = (rank > 0, aged if rank else 0, queued_at)
+                if best is None or score < best[0]:
+                    best = (score, priority)
+            if best is None:
+                return
+            priority = best[1]
+            slot, _ = self.waiting[priority].popleft()
+            counts = self.classes[priority]
+            self.queued -= 1
+            counts["queued"] -= 1
+            self.running += 1
+            counts["running"] += 1
+            counts["started"] += 1
+            slot.set_result(None)
+
+    def release(self, priority):
+        self.running -= 1
+        self.classes[priority]["running"] -= 1
+        self.dispatch()
+
+    async def relay(self, agen_factory):
+        """Iterates ``agen_factory()`` on the scheduler loop from another event loop.
+
+        Lets the API server's loop consume generators that share the
+        pipelines' caches and rate limiters. Closing or cancelling the relay
+        cancels the generator on the scheduler loop.
+        """
+        self.start()
+        loop = asyncio.get_running_loop()
+        items = asyncio.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for item in agen_factory():
+                    loop.call_soon_threadsafe(items.put_nowait, (item, None))
+            except Exception as e:
+                loop.call_soon_threadsafe(items.put_nowait, (done, e))
+            else:
+                loop.call_soon_threadsafe(items.put_nowait, (done, None))
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self.loop)
+        try:
+            while True:
+                item, error = await items.get()
+                if error is not None:
+                    raise error
+                if item is done:
+                    return
+                yield item
+        finally:
+            future.cancel()
+
+    def forget(self, key, future):
+        with self.lock:
+            if self.jobs.get(key) is future:
+                del self.jobs[key]
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Error in pipeline {key}: {future.exception()}")
+
+    def cancel(self, key):
+        with self.lock:
+            future = self.jobs.get(key)
+        if future is not None:
+            future.cancel()
+
+    def cancel_all(self):
+        with self.lock:
+            futures = list(self.jobs.values())
+        for future in futures:
+            future.cancel()
+
+    def stats(self):
+        now = time.monotonic()
+        classes = {}
+        for priority, counts in self.classes.items():
+            waiters = self.waiting[priority]
+            oldest = next(
+                (queued_at for slot, queued_at in list(waiters) if not slot.done()), None
+            )
+            classes[priority] = {
+                "limit": self.class_limits[priority],
+                "queued": counts["queued"],
+                "running": counts["running"],
+                "started": counts["started"],
+                "avg_wait_seconds": round(counts["wait_seconds"] / counts["started"], 3)
+                if counts["started"]
+                else 0.0,
+                "max_wait_seconds": round(counts["max_wait_seconds"], 3),
+                "oldest_queued_seconds": round(now - oldest, 3) if oldest is not None else 0.0,
+            }
+        return {
+            "max_concurrency": self.max_concurrency,
+            "worker_threads": self.worker_threads,
+            "aging_seconds": self.aging_seconds,
+            "queued": self.queued,
+            "running": self.running,
+            "classes": classes,
+        }
+
+    def stop(self):
+        self.cancel_all()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown(wait=False)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Runs a blocking call on the scheduler's thread pool without stalling the loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+pipeline_scheduler = PipelineScheduler(
+    max_concurrency=settings.max_concurrent_pipelines,
+    worker_threads=settings.pipeline_worker_threads,
+    class_limits=settings.scheduler_class_limits,
+    aging_seconds=settings.scheduler_aging_seconds,
+)
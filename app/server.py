@@ -1,15 +1,39 @@
+import asyncio
 import imaplib
+import json
+import time
+from functools import partial
 from uuid import uuid4
 
 from pydantic import BaseModel
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Query
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-import asyncio
+from fastapi.responses import Response, StreamingResponse
 from typing import Dict, Optional
 
 from app.agent import JaWorker
-from app import settings, imap_service
-from app.utils import create_imap_service
+from app.job_store import JobStore, job_store
+from app.llm_cache import response_cache
+from app import metrics
+from app.lifecycle import WorkerLifecycle
+from app.log_buffer import log_hub
+from app.memory_registry import memory_registry
+from app.prompts import default_prompts
+from app.rate_limiter import rate_limiter
+from app.sales_index import sales_indexes
+from app.research_cache import research_cache
+from app.scheduler import pipeline_scheduler, run_blocking
+from app.smtp_pool import close_smtp_pools
+from app import settings
+from app.email_service import EmailMonitoringService
+from app.work_queue import QueueRouter, work_queue
+from app.worker import (
+    create_worker,
+    pipeline_priority,
+    run_prospect_pipeline,
+    unanswered_replies,
+)
+from app.ingest import is_valid_email, iter_lines, iter_prospect_emails, normalize_email
 
 
 app = FastAPI()
@@ -23,14 +47,26 @@ app.add_middleware(
 )
 
 ja_workers: Dict[str, JaWorker] = {}
-tasks = {}
-
-prompts = {
-    "draft_email_agent_prompt": "you are a expert research draft email creator who is pervasive and will do anything to sell",
-    "sales_agent_prompt": "you are a sales head manager who is good at recreating emails according to company's sales email history provided in the file, and you only return directly sendable email",
-    "first_email_task_prompt": "create a email selling the product/service based on the pdf file provided during creation of assistant. Use the Client/ Prospect information provided (to whom you are selling) as PROSPECT_INFO:  to make the customized mail [IMPORTANT!] use html dont use css make it look fully human written. Send only EMAIL nothing extra",
-    "reply_email_task_prompt": "based on the email response by user and previous email sent. send a response email adapting to the email. Use HTML but make it look like human written email make sure its well formatted. Use the conversions text file to draft it accordingly. **IMPORTANT** Only send the email no additional text",
-}
+batches: Dict[str, dict] = {}
+batch_finished_at: Dict[str, float] = {}
+
+LIFECYCLE_SWEEP_INTERVAL = 60
+# Finished bulk uploads stay readable from /batches/ for this long.
+BATCH_TTL = 24 * 3600
+
+lifecycle = WorkerLifecycle(
+    ja_workers,
+    lambda email, summary, pending: revive_prospect(email, summary, pending),
+    max_live_workers=settings.max_live_workers,
+    idle_ttl=settings.worker_idle_ttl,
+    max_summaries=settings.max_worker_summaries,
+)
+LOG_STREAM_HEARTBEAT = 15
+# Stored logs are written by other processes, which do not wake log_hub listeners.
+LOG_STREAM_POLL_INTERVAL = 1
+inbox: Optional[EmailMonitoringService] = None
+
+prompts = dict(default_prompts)
 class PromptUpdate(BaseModel):
     draft_email_agent_prompt: Optional[str] = None
     sales_agent_prompt: Optional[str] = None
@@ -38,6 +74,68 @@ class PromptUpdate(BaseModel):
     reply_email_task_prompt: Optional[str] = None
 
 
+@app.on_event("startup")
+async def start_inbox():
+    global inbox
+    router = None
+    if work_queue is not None:
+        # Pipelines run on `python -m app.worker` processes; this one only
+        # enqueues prospects and routes their replies.
+        router = QueueRouter(work_queue, job_store, prompts, settings.email)
+    inbox = EmailMonitoringService(
+        settings.imap_server,
+        settings.email,
+        settings.password,
+        checkpoint_fp=settings.imap_checkpoint_fp,
+        before_dispatch=router.sync if router is not None else None,
+        # Compaction swaps subscribers, so it must not interleave with delivery.
+        dispatch_lock=lifecycle.lock,
+    )
+    if router is not None:
+        router.sync(inbox)
+        inbox.start()
+        return
+    pipeline_scheduler.start()
+    # Index the sales history once, before the first composer needs it.
+    sales_indexes.get(settings.previous_sales_data_fp)
+    # Done and failed pipelines are left out.
+    for pipeline in job_store.load_pipelines():
+        logs = job_store.get_logs(pipeline["email"], limit=settings.log_buffer_size)
+        pending_messages = unanswered_replies(pipeline["email"])
+        if pipeline["subject"]:
+            # Listens right away, so replies arriving before the resumed
+            # worker subscribes are handed to it.
+            lifecycle.restore(pipeline, logs, inbox, job_store, settings.email)
+            if pipeline["stage"] == "listening" and not pending_messages:
+                # Nothing to do until the prospect writes back, which revives it.
+                continue
+        start_prospect(pipeline["email"], logs=logs, pending_messages=pending_messages)
+    # Only once every stored thread has a subscriber again.
+    inbox.start()
+    asyncio.create_task(sweep_workers())
+
+
+async def sweep_workers():
+    while True:
+        await asyncio.sleep(LIFECYCLE_SWEEP_INTERVAL)
+        try:
+            lifecycle.sweep()
+        except Exception as e:
+            print(f"Error sweeping workers: {e}")
+
+
+@app.on_event("shutdown")
+async def stop_inbox():
+    if inbox is not None:
+        inbox.stop()
+    pipeline_scheduler.stop()
+    research_cache.flush()
+    job_store.close()
+    if work_queue is not None:
+        work_queue.close()
+    close_smtp_pools()
+
+
 @app.put("/prompts/")
 async def update_prompts(
     prompt_input:PromptUpdate
@@ -68,79 +166,357 @@ async def get_prompts(
         return {"prompts":""}
 
 @app.post("/add-prospect/")
-async def run_sales_pipeline(email: str, background_tasks: BackgroundTasks):
+async def run_sales_pipeline(email: str):
     """
     Starts a sales pipeline for the given email. If the email already has an associated pipeline, returns an error.
     """
-    if email in ja_workers:
+    email = normalize_email(email)
+    if not is_valid_email(email):
+        raise HTTPException(status_code=400, detail="Invalid email")
+    if is_known_prospect(email):
         raise HTTPException(status_code=400, detail="Email already taken")
 
-    imap_service = create_imap_service(
-        settings.imap_server, settings.email, settings.password
-    )
-    
-    sales_agent = JaWorker(
-        open_ai_key=settings.open_ai_key,
-        perplexity_api_key=settings.perplexity_key,
-        company_product_data_fp=settings.company_product_data_fp,
-        previous_sales_data_fp=settings.previous_sales_data_fp,
-        mailer=imap_service,
-        draft_mail_agent_prompt=prompts["draft_email_agent_prompt"],
-        sales_agent_prompt=prompts["sales_agent_prompt"],
-        first_email_task_prompt=prompts["first_email_task_prompt"],
-        reply_email_task_prompt=prompts["reply_email_task_prompt"],
-    )
-    sales_agent.configure_mail_service(
-        username=settings.email,
-        password=settings.password,
-        port=settings.port,
-        sender_email=settings.email,
-        imap_server=settings.imap_server,
-        smtp_server=settings.smtp_server,
-    )
-    sales_agent.init()
-    ja_workers[email] = sales_agent
-    background_tasks.add_task(start_async_task, email, sales_agent)
+    start_prospect(email)
     return {"message": "Sales pipeline initiated", "email": email}
 
 
-# def start_async_task(email: str, sales_agent: JaWorker):
-#     loop = asyncio.new_event_loop()
-#     asyncio.set_event_loop(loop)
-#     loop.run_until_complete(sales_agent.run_pipeline(prospect_email=email))
-#     loop.close()
+@app.post("/add-prospects/")
+async def add_prospects(request: Request, format: Optional[str] = Query(None)):
+    """
+    Starts sales pipelines for every prospect in a streamed CSV or NDJSON upload.
+    Invalid and already-known emails are skipped. Returns a batch id whose progress can be read from /batches/{batch_id}.
+    """
+    upload_format = format or (
+        "ndjson" if "json" in request.headers.get("content-type", "") else "csv"
+    )
+    if upload_format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
 
-def start_async_task(email: str, sales_agent: JaWorker):
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    task = loop.create_task(sales_agent.run_pipeline(prospect_email=email))
-    tasks[email] = (task, loop)  # Store task and its event loop
+    evict_batches()
+    batch_id = str(uuid4())
+    batch = {
+        "batch_id": batch_id,
+        "received": 0,
+        "accepted": 0,
+        "duplicates": 0,
+        "invalid": 0,
+        "completed": 0,
+        "failed": 0,
+        "uploaded": False,
+    }
+    batches[batch_id] = batch
     try:
-        loop.run_until_complete(task)
+        async for email in iter_prospect_emails(iter_lines(request.stream()), upload_format):
+            batch["received"] += 1
+            email = normalize_email(email)
+            if not is_valid_email(email):
+                batch["invalid"] += 1
+                continue
+            if is_known_prospect(email):
+                batch["duplicates"] += 1
+                continue
+            future = start_prospect(email)
+            # Queued prospects complete on worker processes, out of our sight.
+            if future is not None:
+                future.add_done_callback(partial(record_batch_result, batch))
+            batch["accepted"] += 1
     finally:
-        loop.close()
-        tasks.pop(email, None)  # Remove task from tracking once it's done
+        # A failed or disconnected upload still ends, so the batch can be evicted.
+        batch["uploaded"] = True
+        mark_batch_finished(batch)
+    return batch
+
+
+@app.get("/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    """
+    Returns the progress counters for a bulk prospect upload.
+    """
+    evict_batches()
+    if batch_id not in batches:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batches[batch_id]
+
+
+def record_batch_result(batch, future):
+    if future.cancelled() or future.exception() is not None:
+        batch["failed"] += 1
+    else:
+        batch["completed"] += 1
+    mark_batch_finished(batch)
+
+
+def mark_batch_finished(batch):
+    # Queued prospects complete out of our sight, so those batches finish on upload.
+    settled = work_queue is not None or batch["completed"] + batch["failed"] >= batch["accepted"]
+    if batch["uploaded"] and settled and batch["batch_id"] not in batch_finished_at:
+        batch_finished_at[batch["batch_id"]] = time.monotonic()
+
+
+def evict_batches():
+    expired = [
+        batch_id
+        for batch_id, finished_at in batch_finished_at.items()
+        if time.monotonic() - finished_at > BATCH_TTL
+    ]
+    for batch_id in expired:
+        batch_finished_at.pop(batch_id, None)
+        batches.pop(batch_id, None)
+
+
+def is_known_prospect(email: str):
+    # Compacted summaries past the cap are dropped, but the job store remembers them.
+    return email in ja_workers or job_store.get_pipeline(email) is not None
+
+
+def start_prospect(email: str, logs=None, pending_messages=None):
+    if work_queue is not None:
+        job_store.save_pipeline(email, stage="queued")
+        work_queue.enqueue(
+            "pipeline", email, {"prompts": dict(prompts)}, dedupe_key=f"pipeline:{email}"
+        )
+        return None
+    sales_agent = create_worker(prompts, mailer=inbox)
+    if logs:
+        sales_agent.logs.extend(logs, email=email)
+    else:
+        job_store.save_pipeline(email, stage="queued")
+    sales_agent.pending_messages = pending_messages or []
+    lifecycle.replace(email, sales_agent)
+    return pipeline_scheduler.submit(
+        email,
+        lambda: run_prospect_pipeline(email, sales_agent),
+        priority=pipeline_priority(email),
+    )
+
+
+def revive_prospect(email: str, summary, pending_messages):
+    start_prospect(
+        email, logs=summary.logs.messages(), pending_messages=pending_messages
+    )
+
 
 @app.get("/reset/")
 async def reset_application():
-    global ja_workers
-    ja_workers = {}
-    for email, (task, loop) in tasks.items():
-        loop.call_soon_threadsafe(task.cancel)  # Cancel task
-        loop.stop()  # Stop the loop if it's still running
-        loop.close()  # Close the loop
-    tasks.clear()  # Clear all tasks
-    ja_workers.clear()  # Optionally reset ja_workers
+    with lifecycle.lock:
+        for sales_agent in list(ja_workers.values()):
+            sales_agent.stop_listening()
+        # In queue mode the subscribers are QueuedProspects, not ja_workers.
+        if inbox is not None:
+            inbox.threads.clear()
+        ja_workers.clear()
+        lifecycle.stand_ins.clear()
+    pipeline_scheduler.cancel_all()
+    if work_queue is not None:
+        work_queue.clear()
+    job_store.clear()
     return {"message": "All tasks stopped and application reset"}
 
 @app.get("/logs/")
-async def get_logs(email: Optional[str] = Query(None)):
+async def get_logs(
+    email: Optional[str] = Query(None), cursor: Optional[int] = Query(None)
+):
     """
     Returns the logs for the specified email. If the email does not have an associated sales pipeline, returns an error.
+    With a cursor, returns only the structured entries logged after it.
     """
-    if email is None or email not in ja_workers:
+    if email is None:
         raise HTTPException(status_code=404, detail="No logs found for the given email")
+    email = normalize_email(email)
+    if email not in ja_workers:
+        # Pipelines run by queue workers, or dropped summaries, only have stored logs.
+        if job_store.get_pipeline(email) is None:
+            raise HTTPException(status_code=404, detail="No logs found for the given email")
+        return {"logs": job_store.get_logs(email, limit=settings.log_buffer_size)}
 
     sales_agent = ja_workers[email]
-    
-    return {"logs": sales_agent.logs}
+    if cursor is not None:
+        entries = sales_agent.logs.since(cursor)
+        return {"entries": entries, "cursor": entries[-1]["id"] if entries else cursor}
+
+    return {"logs": sales_agent.logs.messages(), "cursor": sales_agent.logs.last_id()}
+
+
+@app.get("/logs/stream/")
+async def stream_logs(
+    request: Request,
+    email: Optional[str] = Query(None),
+    cursor: Optional[int] = Query(None),
+):
+    """
+    Streams new log entries for the specified email as server-sent events.
+    Resumes after the cursor (or the Last-Event-ID header) when given.
+    """
+    email = normalize_email(email)
+    if email in ja_workers:
+        # Looked up on every read: compaction and revival replace the worker.
+        def read_since(after):
+            worker = ja_workers.get(email)
+            return worker.logs.since(after) if worker is not None else log_hub.since(after, {email})
+
+        return log_event_stream(request, read_since, resume_cursor(request, cursor))
+
+    # Pipelines run by queue workers, or dropped summaries, only have stored logs,
+    # which are numbered by the store and polled since other processes write them.
+    if job_store.get_pipeline(email) is None:
+        raise HTTPException(status_code=404, detail="No logs found for the given email")
+    return log_event_stream(
+        request,
+        lambda after: job_store.log_entries_since(email, after, limit=settings.log_buffer_size),
+        resume_cursor(request, cursor),
+        poll_interval=LOG_STREAM_POLL_INTERVAL,
+    )
+
+
+@app.get("/logs/stream/all")
+async def stream_all_logs(
+    request: Request,
+    emails: Optional[str] = Query(None),
+    cursor: Optional[int] = Query(None),
+):
+    """
+    Streams new log entries across all prospects as server-sent events, optionally limited to a comma-separated list of emails.
+    """
+    email_filter = {normalize_email(email) for email in emails.split(",")} if emails else None
+    return log_event_stream(
+        request,
+        lambda after: log_hub.since(after, email_filter),
+        resume_cursor(request, cursor),
+    )
+
+
+def resume_cursor(request: Request, cursor: Optional[int]):
+    if cursor is not None:
+        return cursor
+    last_event_id = request.headers.get("last-event-id")
+    return int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+
+
+def log_event_stream(request: Request, read_since, cursor: int, poll_interval=None):
+    async def events():
+        after = cursor
+        quiet_since = time.monotonic()
+        with log_hub.listen() as changed:
+            while not await request.is_disconnected():
+                # Cleared before reading, so an entry added meanwhile wakes us again.
+                changed.clear()
+                for entry in read_since(after):
+                    yield f"id: {entry['id']}\ndata: {json.dumps(entry)}\n\n"
+                    after = entry["id"]
+                    quiet_since = time.monotonic()
+                try:
+                    await asyncio.wait_for(
+                        changed.wait(), poll_interval or LOG_STREAM_HEARTBEAT
+                    )
+                except asyncio.TimeoutError:
+                    if time.monotonic() - quiet_since >= LOG_STREAM_HEARTBEAT:
+                        yield ": keep-alive\n\n"
+                        quiet_since = time.monotonic()
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/draft/")
+async def stream_draft(request: Request, email: Optional[str] = Query(None)):
+    """
+    Streams a first email for the given prospect as server-sent events while email_composer writes it: a `stage` event as each composer call starts, `token` events with its text and a final `draft` event with the subject and HTML.
+    Reuses the prospect's stored research when there is some. Nothing is sent, and disconnecting stops generation.
+    The draft is an approximate preview: unlike the pipeline, it is written without the product document's retrieval memory, so the `draft` event is marked `approximate`.
+    """
+    email = normalize_email(email)
+    if not is_valid_email(email):
+        raise HTTPException(status_code=400, detail="A valid email is required")
+    research = (job_store.get_pipeline(email) or {}).get("research")
+    sales_agent = create_worker(prompts)
+    # A preview keeps its logs out of the prospect's stored history.
+    sales_agent.job_store = JobStore()
+
+    async def draft():
+        await run_blocking(sales_agent.init)
+        async for event in sales_agent.stream_draft(email, research=research):
+            yield event
+
+    async def events():
+        relay = pipeline_scheduler.relay(draft)
+        try:
+            async for event, data in relay:
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+        finally:
+            await relay.aclose()
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/memory-cache/")
+async def get_memory_cache_stats():
+    """
+    Returns hit/miss counters for the shared knowledge-base memory cache.
+    """
+    return {"memory_cache": memory_registry.stats()}
+
+
+@app.get("/research-cache/")
+async def get_research_cache_stats():
+    """
+    Returns hit ratio and size of the per-domain research cache.
+    """
+    return {"research_cache": research_cache.stats()}
+
+
+@app.get("/llm-cache/")
+async def get_llm_cache_stats():
+    """
+    Returns hit ratio and task policy of the LLM response cache.
+    """
+    return {"llm_cache": response_cache.stats()}
+
+
+@app.get("/scheduler/")
+async def get_scheduler_stats():
+    """
+    Returns queue depth, running jobs and wait times per priority class for the pipeline scheduler.
+    """
+    return {"scheduler": pipeline_scheduler.stats()}
+
+
+@app.get("/workers/")
+async def get_worker_stats():
+    """
+    Returns how many workers are live and how many have been compacted into summaries.
+    """
+    return {"workers": lifecycle.stats()}
+
+
+@app.get("/queue/")
+async def get_work_queue_stats():
+    """
+    Returns job counts by status when pipelines run on queue workers.
+    """
+    return {"queue": work_queue.stats() if work_queue is not None else None}
+
+
+@app.get("/threads/")
+async def get_thread_index_stats():
+    """
+    Returns how many inbound emails were routed to a prospect by Message-ID reference, by subject, or not at all.
+    """
+    return {"threads": inbox.threads.stats() if inbox is not None else {}}
+
+
+@app.get("/rate-limits/")
+async def get_rate_limit_stats():
+    """
+    Returns the adaptive concurrency limit, queue depth and 429/5xx counts per LLM provider model.
+    """
+    return {"rate_limits": rate_limiter.stats()}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Serves stage latency, LLM token and cost, and time-to-first-email / time-to-reply histograms in Prometheus format.
+    """
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
@@ -9,7 +9,38 @@ class Settings:
         email,
         password,
         company_product_data_fp,
-        previous_sales_data_fp
+        previous_sales_data_fp,
+        imap_checkpoint_fp=None,
+        max_concurrent_pipelines=10,
+        pipeline_worker_threads=16,
+        ddg_timeout=10,
+        perplexity_timeout=60,
+        research_cache_ttl=24 * 3600,
+        research_cache_size=1000,
+        research_cache_fp=None,
+        job_store_url=None,
+        smtp_max_sessions=4,
+        send_mode="direct",
+        compose_mode="two_stage",
+        llm_cache_enabled=False,
+        llm_cache_fp="llm_cache.db",
+        llm_cache_ttl=7 * 24 * 3600,
+        llm_cache_max_bytes=100 * 1024 * 1024,
+        llm_cache_tasks=("Research Task", "task compiler"),
+        log_buffer_size=500,
+        max_live_workers=1000,
+        worker_idle_ttl=1800,
+        max_worker_summaries=100000,
+        reply_context_tokens=2000,
+        otel_endpoint=None,
+        rate_limits=None,
+        llm_max_retries=4,
+        work_queue_url=None,
+        work_queue_lease_seconds=300,
+        work_queue_max_attempts=3,
+        sales_examples=3,
+        scheduler_class_limits=None,
+        scheduler_aging_seconds=30,
     ):
         self.open_ai_key = open_ai_key
         self.perplexity_key = perplexity_key
@@ -19,4 +50,35 @@ class Settings:
         self.email = email
         self.password = password
         self.company_product_data_fp = company_product_data_fp
-        self.previous_sales_data_fp = previous_sales_data_fp
\ No newline at end of file
+        self.previous_sales_data_fp = previous_sales_data_fp
+        self.imap_checkpoint_fp = imap_checkpoint_fp
+        self.max_concurrent_pipelines = max_concurrent_pipelines
+        self.pipeline_worker_threads = pipeline_worker_threads
+        self.ddg_timeout = ddg_timeout
+        self.perplexity_timeout = perplexity_timeout
+        self.research_cache_ttl = research_cache_ttl
+        self.research_cache_size = research_cache_size
+        self.research_cache_fp = research_cache_fp
+        self.job_store_url = job_store_url
+        self.smtp_max_sessions = smtp_max_sessions
+        self.send_mode = send_mode
+        self.compose_mode = compose_mode
+        self.llm_cache_enabled = llm_cache_enabled
+        self.llm_cache_fp = llm_cache_fp
+        self.llm_cache_ttl = llm_cache_ttl
+        self.llm_cache_max_bytes = llm_cache_max_bytes
+        self.llm_cache_tasks = llm_cache_tasks
+        self.log_buffer_size = log_buffer_size
+        self.max_live_workers = max_live_workers
+        self.worker_idle_ttl = worker_idle_ttl
+        self.max_worker_summaries = max_worker_summaries
+        self.reply_context_tokens = reply_context_tokens
+        self.otel_endpoint = otel_endpoint
+        self.rate_limits = rate_limits or {}
+        self.llm_max_retries = llm_max_retries
+        self.work_queue_url = work_queue_url
+        self.work_queue_lease_seconds = work_queue_lease_seconds
+        self.work_queue_max_attempts = work_queue_max_attempts
+        self.sales_examples = sales_examples
+        self.scheduler_class_limits = scheduler_class_limits or {}
+        self.scheduler_aging_seconds = scheduler_aging_seconds
\ No newline at end of file
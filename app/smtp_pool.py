@@ -0,0 +1,192 @@
+import smtplib
+import time
+from collections import deque
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
+
+from app import metrics
+
+
+class TracksData:
+    """Remembers whether the current send got as far as DATA.
+
+    Once it has, the server may already have queued the message even if the
+    connection drops before it answers, so resending could deliver it twice.
+    """
+
+    data_started = False
+
+    def data(self, msg):
+        self.data_started = True
+        return super().data(msg)
+
+
+class PooledSMTP(TracksData, smtplib.SMTP):
+    pass
+
+
+class PooledSMTP_SSL(TracksData, smtplib.SMTP_SSL):
+    pass
+
+
+class SMTPConnectionPool:
+    """Keeps logged-in SMTP sessions open and shares them between workers.
+
+    At most ``max_sessions`` sessions exist at once. A session idle for longer
+    than ``health_check_after`` seconds is checked with NOOP before reuse, and
+    one idle for longer than ``idle_timeout`` is closed instead of reused.
+    """
+
+    def __init__(
+        self,
+        host,
+        port,
+        username,
+        password,
+        max_sessions=4,
+        idle_timeout=120,
+        health_check_after=15,
+        timeout=30,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self.idle = deque()
+        self.slots = BoundedSemaphore(max_sessions)
+        self.lock = Lock()
+        self.connects = 0
+        self.reuses = 0
+
+    def connect(self):
+        if self.port == 465:
+            conn = PooledSMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = PooledSMTP(self.host, self.port, timeout=self.timeout)
+            conn.ehlo()
+            conn.starttls()
+            conn.ehlo()
+        conn.login(self.username, self.password)
+        with self.lock:
+            self.connects += 1
+        return conn
+
+    def checkout(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                conn, last_used = self.idle.pop()
+            idle_for = time.monotonic() - last_used
+            if idle_for > self.idle_timeout:
+                self.discard(conn)
+                continue
+            if idle_for > self.health_check_after and not self.is_alive(conn):
+                self.discard(conn)
+                continue
+            with self.lock:
+                self.reuses += 1
+            return conn
+        return self.connect()
+
+    def checkin(self, conn):
+        with self.lock:
+            self.idle.append((conn, time.monotonic()))
+
+    def is_alive(self, conn):
+        try:
+            return conn.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def discard(self, conn):
+        try:
+            conn.quit()
+        except (smtplib.SMTPException, OSError):
+            conn.close()
+
+    @contextmanager
+    def session(self):
+        self.slots.acquire()
+        conn = None
+        try:
+            conn = self.checkout()
+            yield conn
+        except OSError as e:
+            # SMTP protocol errors leave the session usable; socket errors do not.
+            if conn is not None and is_connection_error(e):
+                conn.close()
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                self.checkin(conn)
+            self.slots.release()
+
+    def send_message(self, msg):
+        # A pooled session may have been dropped by the server since its
+        # health check; retry once on a fresh connection, but only if the
+        # message never reached DATA.
+        for attempt in range(2):
+            conn = None
+            try:
+                with metrics.span("smtp_send", attempt=attempt), self.session() as conn:
+                    conn.data_started = False
+                    return conn.send_message(msg)
+            except OSError as e:
+                retryable = conn is None or not conn.data_started
+                if attempt == 1 or not retryable or not is_connection_error(e):
+                    raise
+
+    def stats(self):
+        with self.lock:
+            return {
+                "host": self.host,
+                "port": self.port,
+                "username": self.username,
+                "idle_sessions": len(self.idle),
+                "max_sessions": self.max_sessions,
+                "connects": self.connects,
+                "reuses": self.reuses,
+            }
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = list(self.idle), deque()
+        for conn, _ in idle:
+            self.discard(conn)
+
+
+def is_connection_error(error):
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    return not isinstance(error, smtplib.SMTPException)
+
+
+smtp_pools = {}
+smtp_pools_lock = Lock()
+
+
+def get_smtp_pool(host, port, username, password, max_sessions=4):
+    """Returns the process-wide pool for ``(host, port, username)``, creating it once."""
+    key = (host, int(port), username)
+    with smtp_pools_lock:
+        pool = smtp_pools.get(key)
+        if pool is None:
+            pool = SMTPConnectionPool(
+                host, int(port), username, password, max_sessions=max_sessions
+            )
+            smtp_pools[key] = pool
+        return pool
+
+
+def close_smtp_pools():
+    with smtp_pools_lock:
+        pools = list(smtp_pools.values())
+        smtp_pools.clear()
+    for pool in pools:
+        pool.close()
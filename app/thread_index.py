@@ -0,0 +1,165 @@
+import hashlib
+import re
+from email.utils import parseaddr
+from threading import Lock
+
+from app.utils import decode_header_value
+
+MESSAGE_ID = re.compile(r"<[^<>\s]+>")
+# Reply and forward prefixes in the languages our prospects write in, plus
+# list tags such as "[External]", stacked in any order.
+SUBJECT_PREFIX = re.compile(
+    r"^\s*((re|fwd?|aw|wg|sv|vs|antw|rif|tr)(\[\d+\])?\s*:|\[[^\]]*\])\s*", re.IGNORECASE
+)
+
+
+def message_ids(value):
+    return MESSAGE_ID.findall(str(value or ""))
+
+
+def reply_key(email_message):
+    """Identifies an inbound message for dedupe: its Message-ID, or a content hash without one."""
+    message_id = email_message["Message-ID"]
+    if message_id:
+        return str(message_id)
+    return "sha256:" + hashlib.sha256(email_message.as_bytes()).hexdigest()
+
+
+def normalize_subject(subject):
+    subject = decode_header_value(subject)
+    while True:
+        stripped = SUBJECT_PREFIX.sub("", subject, count=1)
+        if stripped == subject:
+            break
+        subject = stripped
+    return " ".join(subject.split()).lower()
+
+
+class ThreadIndex:
+    """Routes inbound mail to the pipeline whose thread it belongs to.
+
+    Every Message-ID we send is mapped to the prospect it went to, so a reply
+    is found from its In-Reply-To/References headers with dict lookups rather
+    than by asking every subscriber. Mail that references none of our
+    messages falls back to its normalized subject, preferring the prospect
+    it came from when several threads share a subject. Message-IDs persist
+    through the job store's sent_message_ids and are re-added when a pipeline
+    resumes and subscribes again.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.message_ids = {}
+        self.subjects = {}
+        self.subscribers = {}
+        self.threads = {}
+        self.by_reference = 0
+        self.by_subject = 0
+        self.unrouted = 0
+
+    def thread(self, prospect):
+        thread = self.threads.get(prospect)
+        if thread is None:
+            thread = self.threads[prospect] = {"subject": None, "message_ids": set()}
+        return thread
+
+    def add_message_id(self, prospect, message_id):
+        with self.lock:
+            for key in message_ids(message_id):
+                self.message_ids[key] = prospect
+                self.thread(prospect)["message_ids"].add(key)
+
+    def set_subject(self, prospect, subject):
+        key = normalize_subject(subject) if subject else None
+        with self.lock:
+            thread = self.thread(prospect)
+            if thread["subject"] == key:
+                return
+            self.discard_subject(prospect, thread["subject"])
+            thread["subject"] = key
+            if key:
+                self.subjects.setdefault(key, set()).add(prospect)
+
+    def discard_subject(self, prospect, key):
+        prospects = self.subjects.get(key)
+        if prospects is not None:
+            prospects.discard(prospect)
+            if not prospects:
+                del self.subjects[key]
+
+    def subscribe(self, prospect, subscriber, sender_email, subject=None, sent_ids=()):
+        for message_id in sent_ids:
+            self.add_message_id(prospect, message_id)
+        self.set_subject(prospect, subject)
+        with self.lock:
+            self.subscribers[prospect] = (subscriber, sender_email.lower())
+
+    def unsubscribe(self, prospect, subscriber):
+        with self.lock:
+            current = self.subscribers.get(prospect)
+            if current is not None and current[0] is subscriber:
+                del self.subscribers[prospect]
+
+    def forget(self, prospect):
+        """Drops a prospect's subscription and thread keys for good."""
+        with self.lock:
+            self.subscribers.pop(prospect, None)
+            thread = self.threads.pop(prospect, None)
+            if thread is None:
+                return
+            self.discard_subject(prospect, thread["subject"])
+            for key in thread["message_ids"]:
+                if self.message_ids.get(key) == prospect:
+                    del self.message_ids[key]
+
+    def clear(self):
+        """Forgets every prospect, including those subscribed for queue workers."""
+        with self.lock:
+            self.message_ids.clear()
+            self.subjects.clear()
+            self.subscribers.clear()
+            self.threads.clear()
+
+    def route(self, email_message):
+        """Returns the subscriber ``email_message`` is a reply to, or None."""
+        from_addr = parseaddr(email_message["From"] or "")[1].lower()
+        references = message_ids(email_message["In-Reply-To"]) + list(
+            reversed(message_ids(email_message["References"]))
+        )
+        with self.lock:
+            prospect = next(
+                (self.message_ids[key] for key in references if key in self.message_ids),
+                None,
+            )
+            if prospect is not None:
+                self.by_reference += 1
+            else:
+                candidates = self.subjects.get(
+                    normalize_subject(email_message["Subject"] or ""), ()
+                )
+                prospect = next(
+                    (candidate for candidate in candidates if candidate.lower() == from_addr),
+                    None,
+                )
+                if prospect is None and len(candidates) == 1:
+                    prospect = next(iter(candidates))
+                if prospect is not None:
+                    self.by_subject += 1
+            entry = self.subscribers.get(prospect)
+            # Our own sent mail, or a copy of it, is never a prospect reply.
+            if entry is None or entry[1] == from_addr:
+                if prospect is None:
+                    self.unrouted += 1
+                return None
+            return entry[0]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "subscribers": len(self.subscribers),
+                "message_ids": len(self.message_ids),
+                "subjects": len(self.subjects),
+                "routed_by_reference": self.by_reference,
+                "routed_by_subject": self.by_subject,
+                "unrouted": self.unrouted,
+            }
@@ -1,4 +1,5 @@
 import imaplib
+from email.header import decode_header, make_header
 
 def create_imap_service(imap_server, username, password):
     IMAP_SERVER = imap_server
@@ -6,4 +7,12 @@ def create_imap_service(imap_server, username, password):
     PASSWORD = password
     mail = imaplib.IMAP4_SSL(IMAP_SERVER)
     mail.login(EMAIL, PASSWORD)
-    return mail
\ No newline at end of file
+    return mail
+
+def decode_header_value(value):
+    if value is None:
+        return ""
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return str(value)
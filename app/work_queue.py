@@ -0,0 +1,441 @@
+import json
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from threading import Lock
+
+from app import settings
+from app.thread_index import reply_key
+
+try:
+    import redis
+except ImportError:  # optional, only needed for redis:// queue URLs
+    redis = None
+
+
+Job = namedtuple("Job", ["id", "kind", "key", "payload", "attempts"])
+
+# Seconds of waiting a job kind is credited with when claims pick the next
+# job. A prospect's reply is claimed ahead of pipelines enqueued up to an
+# hour before it, so a bulk import cannot hold it back, while pipelines
+# that have waited longer than that still get their turn.
+CLAIM_HEADSTART = {"reply": 3600}
+
+
+def retry_delay(attempts):
+    return min(300, 10 * 2 ** attempts)
+
+
+class WorkQueue(ABC):
+    """Durable queue of pipeline and reply jobs shared by API and worker processes.
+
+    Jobs are keyed by prospect. A claimed job is leased to one worker for
+    ``lease_seconds`` and must be renewed while it runs; no other job for
+    the same prospect is handed out until the lease is released or expires,
+    so each prospect's pipeline and replies run one at a time, on whichever
+    worker holds the lease. Jobs whose worker died are handed out again
+    once their lease expires, up to ``max_attempts`` times.
+    """
+
+    @abstractmethod
+    def enqueue(self, kind, key, payload=None, dedupe_key=None):
+        """Adds a job, returning False if ``dedupe_key`` was enqueued before."""
+
+    @abstractmethod
+    def claim(self, owner, lease_seconds):
+        """Leases the runnable job that has waited longest, counting
+        CLAIM_HEADSTART, to ``owner``, or returns None."""
+
+    @abstractmethod
+    def renew(self, jobs, owner, lease_seconds):
+        """Extends the leases ``owner`` holds on ``jobs``."""
+
+    @abstractmethod
+    def complete(self, job, owner):
+        """Marks a finished job done and releases its prospect."""
+
+    @abstractmethod
+    def fail(self, job, owner, error):
+        """Releases a failed job, to be retried later or given up on."""
+
+    def stats(self):
+        return {}
+
+    def clear(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """WorkQueue in a SQLite file, shared by processes on one machine."""
+
+    def __init__(self, path, max_attempts=3):
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(
+            path, check_same_thread=False, timeout=30, isolation_level=None
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                dedupe_key TEXT UNIQUE,
+                kind TEXT,
+                key TEXT,
+                payload TEXT,
+                status TEXT,
+                owner TEXT,
+                attempts INTEGER DEFAULT 0,
+                available_at REAL,
+                lease_expires REAL,
+                error TEXT,
+                created_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_runnable ON jobs (status, available_at);
+            CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status);
+            """
+        )
+        self.lock = Lock()
+
+    def enqueue(self, kind, key, payload=None, dedupe_key=None):
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO jobs (dedupe_key, kind, key, payload, status, "
+                "available_at, created_at) VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                (dedupe_key, kind, key, json.dumps(payload or {}), now, now),
+            )
+            return cursor.rowcount == 1
+
+    def claim(self, owner, lease_seconds):
+        now = time.time()
+        with self.lock:
+            # IMMEDIATE takes the write lock up front, so two processes can
+            # never select the same job.
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'lease expired' "
+                    "WHERE status = 'leased' AND lease_expires <= ? AND attempts >= ?",
+                    (now, self.max_attempts),
+                )
+                row = self.conn.execute(
+                    """
+                    SELECT id, kind, key, payload, attempts FROM jobs
+                    WHERE available_at <= ?
+                      AND (status = 'queued' OR (status = 'leased' AND lease_expires <= ?))
+                      AND key NOT IN (
+                          SELECT key FROM jobs WHERE status = 'leased' AND lease_expires > ?
+                      )
+                    ORDER BY available_at - CASE kind WHEN 'reply' THEN ? ELSE 0 END, id
+                    LIMIT 1
+                    """,
+                    (now, now, now, CLAIM_HEADSTART["reply"]),
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE jobs SET status = 'leased', owner = ?, lease_expires = ?, "
+                        "attempts = attempts + 1 WHERE id = ?",
+                        (owner, now + lease_seconds, row[0]),
+                    )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return Job(row[0], row[1], row[2], json.loads(row[3]), row[4] + 1)
+
+    def renew(self, jobs, owner, lease_seconds):
+        if not jobs:
+            return
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE jobs SET lease_expires = ? "
+                "WHERE id = ? AND owner = ? AND status = 'leased'",
+                [(time.time() + lease_seconds, job.id, owner) for job in jobs],
+            )
+
+    def complete(self, job, owner):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET status = 'done', payload = NULL "
+                "WHERE id = ? AND owner = ? AND status = 'leased'",
+                (job.id, owner),
+            )
+
+    def fail(self, job, owner, error):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+                "available_at = ?, error = ? WHERE id = ? AND owner = ? AND status = 'leased'",
+                (
+                    self.max_attempts,
+                    time.time() + retry_delay(job.attempts),
+                    str(error),
+                    job.id,
+                    owner,
+                ),
+            )
+
+    def stats(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        return {"backend": "sqlite", **dict(rows)}
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM jobs")
+
+    def close(self):
+        self.conn.close()
+
+
+# Redis keeps per-job hashes, a "ready" sorted set scored by when a job may
+# run less its kind's CLAIM_HEADSTART, a "leased" sorted set scored by lease
+# expiry and a "held" hash of prospect -> job id. The scripts run atomically
+# on the server.
+REDIS_CLAIM = """
+local p, now = ARGV[1], tonumber(ARGV[2])
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', p .. ':leased', '-inf', now)) do
+  local job = p .. ':job:' .. id
+  local key = redis.call('HGET', job, 'key')
+  redis.call('ZREM', p .. ':leased', id)
+  if redis.call('HGET', p .. ':held', key) == id then
+    redis.call('HDEL', p .. ':held', key)
+  end
+  if tonumber(redis.call('HGET', job, 'attempts')) >= tonumber(ARGV[5]) then
+    redis.call('HSET', job, 'status', 'failed', 'error', 'lease expired')
+    redis.call('INCR', p .. ':failed')
+  else
+    redis.call('HSET', job, 'status', 'queued', 'available_at', now)
+    redis.call('ZADD', p .. ':ready', now - tonumber(redis.call('HGET', job, 'headstart') or 0), id)
+  end
+end
+local ready = redis.call('ZRANGEBYSCORE', p .. ':ready', '-inf', now, 'LIMIT', 0, tonumber(ARGV[6]))
+for _, id in ipairs(ready) do
+  local job = p .. ':job:' .. id
+  local key = redis.call('HGET', job, 'key')
+  -- Jobs with a headstart can be scored before a retry delay has passed.
+  local available = tonumber(redis.call('HGET', job, 'available_at') or 0) <= now
+  if available and not redis.call('HGET', p .. ':held', key) then
+    redis.call('ZREM', p .. ':ready', id)
+    redis.call('HSET', p .. ':held', key, id)
+    redis.call('ZADD', p .. ':leased', tonumber(ARGV[3]), id)
+    local attempts = redis.call('HINCRBY', job, 'attempts', 1)
+    redis.call('HSET', job, 'status', 'leased', 'owner', ARGV[4])
+    return {id, redis.call('HGET', job, 'kind'), key, redis.call('HGET', job, 'payload'), attempts}
+  end
+end
+return false
+"""
+
+REDIS_ENQUEUE = """
+local p = ARGV[1]
+if ARGV[2] ~= '' and redis.call('SADD', p .. ':dedupe', ARGV[2]) == 0 then
+  return 0
+end
+local id = redis.call('INCR', p .. ':seq')
+redis.call('HSET', p .. ':job:' .. id, 'kind', ARGV[3], 'key', ARGV[4], 'payload', ARGV[5],
+  'attempts', 0, 'status', 'queued', 'available_at', ARGV[6], 'headstart', ARGV[7])
+redis.call('ZADD', p .. ':ready', tonumber(ARGV[6]) - tonumber(ARGV[7]), id)
+return id
+"""
+
+REDIS_FINISH = """
+local p, id, owner = ARGV[1], ARGV[2], ARGV[3]
+local job = p .. ':job:' .. id
+if redis.call('HGET', job, 'owner') ~= owner or redis.call('HGET', job, 'status') ~= 'leased' then
+  return 0
+end
+local key = redis.call('HGET', job, 'key')
+redis.call('ZREM', p .. ':leased', id)
+if redis.call('HGET', p .. ':held', key) == id then
+  redis.call('HDEL', p .. ':held', key)
+end
+if ARGV[4] == 'done' then
+  redis.call('DEL', job)
+  redis.call('INCR', p .. ':done')
+elseif tonumber(redis.call('HGET', job, 'attempts')) >= tonumber(ARGV[6]) then
+  redis.call('HSET', job, 'status', 'failed', 'error', ARGV[5])
+  redis.call('INCR', p .. ':failed')
+else
+  redis.call('HSET', job, 'status', 'queued', 'error', ARGV[5], 'available_at', ARGV[7])
+  redis.call('ZADD', p .. ':ready', tonumber(ARGV[7]) - tonumber(redis.call('HGET', job, 'headstart') or 0), id)
+end
+return 1
+"""
+
+REDIS_RENEW = """
+local p, owner, expires = ARGV[1], ARGV[2], tonumber(ARGV[3])
+for i = 4, #ARGV do
+  if redis.call('HGET', p .. ':job:' .. ARGV[i], 'owner') == owner then
+    redis.call('ZADD', p .. ':leased', 'XX', expires, ARGV[i])
+  end
+end
+return 1
+"""
+
+
+class RedisWorkQueue(WorkQueue):
+    """WorkQueue on a Redis server (or anything speaking its protocol and Lua), for multiple nodes."""
+
+    # How many ready jobs a claim looks at for one whose prospect is not leased.
+    CLAIM_SCAN = 100
+
+    def __init__(self, url, max_attempts=3, prefix="jazon:queue"):
+        if redis is None:
+            raise RuntimeError("redis:// work queues need the redis package installed")
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.max_attempts = max_attempts
+        self.prefix = prefix
+        self.claim_script = self.client.register_script(REDIS_CLAIM)
+        self.enqueue_script = self.client.register_script(REDIS_ENQUEUE)
+        self.finish_script = self.client.register_script(REDIS_FINISH)
+        self.renew_script = self.client.register_script(REDIS_RENEW)
+
+    def enqueue(self, kind, key, payload=None, dedupe_key=None):
+        job_id = self.enqueue_script(
+            args=[
+                self.prefix,
+                dedupe_key or "",
+                kind,
+                key,
+                json.dumps(payload or {}),
+                time.time(),
+                CLAIM_HEADSTART.get(kind, 0),
+            ]
+        )
+        return bool(job_id)
+
+    def claim(self, owner, lease_seconds):
+        now = time.time()
+        row = self.claim_script(
+            args=[
+                self.prefix,
+                now,
+                now + lease_seconds,
+                owner,
+                self.max_attempts,
+                self.CLAIM_SCAN,
+            ]
+        )
+        if not row:
+            return None
+        return Job(row[0], row[1], row[2], json.loads(row[3]), int(row[4]))
+
+    def renew(self, jobs, owner, lease_seconds):
+        if jobs:
+            self.renew_script(
+                args=[self.prefix, owner, time.time() + lease_seconds]
+                + [job.id for job in jobs]
+            )
+
+    def complete(self, job, owner):
+        self.finish_script(args=[self.prefix, job.id, owner, "done", "", 0, 0])
+
+    def fail(self, job, owner, error):
+        self.finish_script(
+            args=[
+                self.prefix,
+                job.id,
+                owner,
+                "failed",
+                str(error),
+                self.max_attempts,
+                time.time() + retry_delay(job.attempts),
+            ]
+        )
+
+    def stats(self):
+        return {
+            "backend": "redis",
+            "queued": self.client.zcard(f"{self.prefix}:ready"),
+            "leased": self.client.zcard(f"{self.prefix}:leased"),
+            "done": int(self.client.get(f"{self.prefix}:done") or 0),
+            "failed": int(self.client.get(f"{self.prefix}:failed") or 0),
+        }
+
+    def clear(self):
+        keys = list(self.client.scan_iter(f"{self.prefix}:*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def close(self):
+        self.client.close()
+
+
+class QueuedProspect:
+    """Inbox subscriber for a prospect whose pipeline runs on queue workers."""
+
+    __slots__ = ("email", "queue", "prompts")
+
+    def __init__(self, email, queue, prompts):
+        self.email = email
+        self.queue = queue
+        self.prompts = prompts
+
+    def process_email(self, email_message):
+        self.queue.enqueue(
+            "reply",
+            self.email,
+            {
+                "message": email_message.as_bytes().decode("latin-1"),
+                "prompts": dict(self.prompts),
+            },
+            dedupe_key=f"reply:{reply_key(email_message)}",
+        )
+
+
+class QueueRouter:
+    """Keeps the API process's thread index in step with pipelines run on queue workers.
+
+    Workers record subjects and sent Message-IDs in the shared job store; before
+    each inbox dispatch the router subscribes every pipeline updated since its
+    last sync, so replies are routed and enqueued like local ones.
+    """
+
+    # Job store writes are batched, so re-read a little before the last sync.
+    SYNC_OVERLAP = 5
+
+    def __init__(self, queue, job_store, prompts, sender_email):
+        self.queue = queue
+        self.job_store = job_store
+        self.prompts = prompts
+        self.sender_email = sender_email
+        self.since = 0.0
+
+    def sync(self, inbox):
+        for pipeline in self.job_store.pipelines_updated_since(self.since - self.SYNC_OVERLAP):
+            self.since = max(self.since, pipeline["updated_at"])
+            if not pipeline["subject"] or pipeline["stage"] in ("failed", "done"):
+                continue
+            inbox.subscribe(
+                pipeline["email"],
+                QueuedProspect(pipeline["email"], self.queue, self.prompts),
+                self.sender_email,
+                subject=pipeline["subject"],
+                sent_ids=pipeline["sent_message_ids"],
+            )
+
+
+def create_work_queue(url, max_attempts=3):
+    """Builds a work queue from a URL such as ``sqlite:///queue.db`` or
+    ``redis://localhost:6379/0``. Without one, pipelines run inside the API process."""
+    if not url or url == "none":
+        return None
+    if url.startswith("sqlite:///"):
+        return SQLiteWorkQueue(url[len("sqlite:///"):], max_attempts=max_attempts)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisWorkQueue(url, max_attempts=max_attempts)
+    raise ValueError(f"Unsupported work queue URL: {url}")
+
+
+work_queue = create_work_queue(
+    settings.work_queue_url, max_attempts=settings.work_queue_max_attempts
+)
@@ -0,0 +1,211 @@
+"""Queue worker process: ``python -m app.worker``.
+
+Run any number of these next to the API server, on one machine or many,
+with the same WORK_QUEUE_URL and JOB_STORE_URL. Each claims prospect jobs
+from the work queue and runs them on its own pipeline scheduler.
+"""
+import argparse
+import asyncio
+import email
+import os
+import socket
+import time
+from functools import partial
+from threading import Event, Lock, Thread
+
+from app import settings
+from app.agent import JaWorker
+from app.job_store import job_store
+from app.prompts import default_prompts
+from app.research_cache import research_cache
+from app.sales_index import sales_indexes
+from app.scheduler import pipeline_scheduler, run_blocking
+from app.smtp_pool import close_smtp_pools
+from app.work_queue import work_queue
+
+
+def create_worker(prompts, mailer=None):
+    """Builds a JaWorker from settings, for the API server and queue workers alike."""
+    sales_agent = JaWorker(
+        open_ai_key=settings.open_ai_key,
+        perplexity_api_key=settings.perplexity_key,
+        company_product_data_fp=settings.company_product_data_fp,
+        previous_sales_data_fp=settings.previous_sales_data_fp,
+        mailer=mailer,
+        draft_mail_agent_prompt=prompts["draft_email_agent_prompt"],
+        sales_agent_prompt=prompts["sales_agent_prompt"],
+        first_email_task_prompt=prompts["first_email_task_prompt"],
+        reply_email_task_prompt=prompts["reply_email_task_prompt"],
+        ddg_timeout=settings.ddg_timeout,
+        perplexity_timeout=settings.perplexity_timeout,
+        job_store=job_store,
+        log_buffer_size=settings.log_buffer_size,
+        send_mode=settings.send_mode,
+        compose_mode=settings.compose_mode,
+        reply_context_tokens=settings.reply_context_tokens,
+        sales_examples=settings.sales_examples,
+    )
+    sales_agent.configure_mail_service(
+        username=settings.email,
+        password=settings.password,
+        port=settings.port,
+        sender_email=settings.email,
+        imap_server=settings.imap_server,
+        smtp_server=settings.smtp_server,
+        smtp_max_sessions=settings.smtp_max_sessions,
+    )
+    return sales_agent
+
+
+def unanswered_replies(email_address):
+    """Replies routed to a prospect before a restart that were never answered."""
+    return [
+        email.message_from_bytes(message.encode("latin-1"))
+        for message in job_store.pending_replies(email_address)
+    ]
+
+
+def pipeline_priority(email_address):
+    """Pipelines that already sent their first email only pick the conversation
+    back up, so they run as follow-ups ahead of first touches."""
+    state = job_store.get_pipeline(email_address) or {}
+    return "follow_up" if state.get("subject") else "first_touch"
+
+
+async def run_prospect_pipeline(email_address, sales_agent):
+    try:
+        await run_blocking(sales_agent.init)
+        await sales_agent.run_pipeline(prospect_email=email_address)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        sales_agent.stage = "failed"
+        sales_agent.job_store.save_pipeline(email_address, stage="failed")
+        sales_agent.log(f"Pipeline failed: {e}", level="error")
+        raise
+
+
+class QueueWorker:
+    """Claims jobs from the work queue and runs them, renewing their leases.
+
+    Holds at most ``concurrency`` jobs at once. A worker that stops or dies
+    simply lets its leases expire, after which another worker picks the jobs
+    up and resumes each pipeline from the job store.
+    """
+
+    def __init__(
+        self,
+        queue,
+        worker_id=None,
+        concurrency=10,
+        lease_seconds=300,
+        poll_interval=1.0,
+    ):
+        self.queue = queue
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.held = {}
+        self.lock = Lock()
+        self.stopped = Event()
+        self.completed = 0
+        self.failed = 0
+
+    def run(self):
+        pipeline_scheduler.start()
+        Thread(target=self.heartbeat, daemon=True).start()
+        print(f"Worker {self.worker_id} consuming {self.queue.stats()}")
+        while not self.stopped.is_set():
+            with self.lock:
+                full = len(self.held) >= self.concurrency
+            job = None if full else self.queue.claim(self.worker_id, self.lease_seconds)
+            if job is None:
+                self.stopped.wait(self.poll_interval)
+                continue
+            with self.lock:
+                self.held[job.id] = job
+            priority = "reply" if job.kind == "reply" else pipeline_priority(job.key)
+            future = pipeline_scheduler.submit(
+                f"{job.kind}:{job.key}", partial(self.execute, job), priority=priority
+            )
+            future.add_done_callback(partial(self.finish, job))
+
+    def heartbeat(self):
+        while not self.stopped.wait(self.lease_seconds / 3):
+            with self.lock:
+                jobs = list(self.held.values())
+            try:
+                self.queue.renew(jobs, self.worker_id, self.lease_seconds)
+            except Exception as e:
+                print(f"Error renewing leases: {e}")
+
+    async def execute(self, job):
+        prompts = {**default_prompts, **job.payload.get("prompts", {})}
+        sales_agent = create_worker(prompts)
+        if job.kind == "pipeline":
+            await run_prospect_pipeline(job.key, sales_agent)
+        elif job.kind == "reply":
+            await run_blocking(sales_agent.init)
+            await sales_agent.resume_reply(
+                job.key, email.message_from_bytes(job.payload["message"].encode("latin-1"))
+            )
+        else:
+            raise ValueError(f"Unknown job kind: {job.kind}")
+
+    def finish(self, job, future):
+        with self.lock:
+            self.held.pop(job.id, None)
+        error = "cancelled" if future.cancelled() else future.exception()
+        try:
+            if error is None:
+                self.queue.complete(job, self.worker_id)
+                self.completed += 1
+            else:
+                self.queue.fail(job, self.worker_id, error)
+                self.failed += 1
+        except Exception as e:
+            print(f"Error finishing job {job.id}: {e}")
+
+    def stop(self, timeout=30):
+        """Stops claiming and waits up to ``timeout`` seconds for held jobs."""
+        self.stopped.set()
+        deadline = time.monotonic() + timeout
+        while self.held and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--id", help="worker id, defaults to host:pid")
+    parser.add_argument(
+        "--concurrency", type=int, default=settings.max_concurrent_pipelines
+    )
+    parser.add_argument(
+        "--lease", type=float, default=settings.work_queue_lease_seconds
+    )
+    args = parser.parse_args()
+    if work_queue is None:
+        raise SystemExit("Set WORK_QUEUE_URL to run queue workers")
+
+    sales_indexes.get(settings.previous_sales_data_fp)
+    worker = QueueWorker(
+        work_queue,
+        worker_id=args.id,
+        concurrency=args.concurrency,
+        lease_seconds=args.lease,
+    )
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+    finally:
+        pipeline_scheduler.stop()
+        research_cache.flush()
+        job_store.close()
+        work_queue.close()
+        close_smtp_pools()
+
+
+if __name__ == "__main__":
+    main()
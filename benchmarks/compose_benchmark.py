@@ -0,0 +1,154 @@
+"""Offline benchmark of the two-stage and single-pass email composers.
+
+Runs both compose modes over a fixed prospect set against a local stub model
+(no network, no API keys) and reports latency, token usage and how far the
+single-pass output drifts from the two-stage output.
+
+    python -m benchmarks.compose_benchmark --latency-per-token 0.002
+"""
+import argparse
+import asyncio
+import difflib
+import hashlib
+import os
+import statistics
+import time
+from types import SimpleNamespace
+
+for key, value in {
+    "PORT": "587",
+    "JOB_STORE_URL": "none",
+    "PREVIOUS_SALES_DATA_FP": "resources/previous_sales_convos.txt",
+}.items():
+    os.environ.setdefault(key, value)
+
+from app.agent import JaWorker  # noqa: E402
+from app.sales_index import SalesIndex  # noqa: E402
+
+PROSPECTS = [
+    ("jane@acme-analytics.com", "Acme Analytics sells self-serve BI dashboards to mid-market retailers. Jane is VP Marketing."),
+    ("raj@finlytics.io", "Finlytics builds fraud scoring APIs for neobanks. Raj is the co-founder and CTO."),
+    ("maria@greenroute.eu", "GreenRoute optimises last-mile delivery routes for EU grocers. Maria leads partnerships."),
+    ("tom@shipfast.dev", "ShipFast is a CI/CD platform for mobile teams. Tom runs growth."),
+    ("li@medsync.health", "MedSync syncs EHR records across clinics. Li is Head of Sales."),
+]
+
+
+def count_tokens(text):
+    return len(str(text).split())
+
+
+class StubModel:
+    """Deterministic stand-in for OpenAIModel that sleeps in proportion to tokens."""
+
+    def __init__(self, base_latency, latency_per_token):
+        self.base_latency = base_latency
+        self.latency_per_token = latency_per_token
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def generate(self, prompt):
+        digest = hashlib.sha256(prompt.encode()).hexdigest()
+        subject = f"Idea for your team ({digest[:6]})"
+        body = " ".join(prompt.split()[-60:])
+        completion = f"Subject: {subject}\n<p>Hi,</p>\n<p>{body}</p>\n<p>Best,<br>Jazon</p>"
+        prompt_tokens = count_tokens(prompt)
+        completion_tokens = count_tokens(completion)
+        time.sleep(
+            self.base_latency
+            + (prompt_tokens + completion_tokens) * self.latency_per_token
+        )
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        return completion
+
+
+class BenchWorker(JaWorker):
+    def __init__(self, compose_mode, model, sales_index):
+        super().__init__(
+            open_ai_key=None,
+            perplexity_api_key=None,
+            company_product_data_fp=None,
+            previous_sales_data_fp=None,
+            mailer=None,
+            draft_mail_agent_prompt="you are a expert research draft email creator",
+            sales_agent_prompt="you are a sales head manager",
+            first_email_task_prompt="create a email selling the product based on PROSPECT_INFO",
+            reply_email_task_prompt="reply to the prospect",
+            compose_mode=compose_mode,
+        )
+        self.model = model
+        self.open_ai_model_text = model
+        self.email_composer_agent = SimpleNamespace(prompt_persona=self.draft_mail_agent_prompt)
+        self.sales_expert_agent = SimpleNamespace(prompt_persona=self.sales_expert_agent_prompt)
+        self.sales_index = sales_index
+
+    async def run_task(self, **task_kwargs):
+        agent = task_kwargs.get("agent")
+        prompt = " ".join(
+            str(part)
+            for part in (
+                agent.prompt_persona if agent else "",
+                task_kwargs.get("instructions", ""),
+                task_kwargs.get("default_input", ""),
+            )
+        )
+        return await asyncio.to_thread(self.model.generate, prompt)
+
+
+async def run_mode(compose_mode, args, sales_index):
+    model = StubModel(args.base_latency, args.latency_per_token)
+    worker = BenchWorker(compose_mode, model, sales_index)
+    latencies = []
+    outputs = []
+    for email, research in PROSPECTS:
+        start = time.perf_counter()
+        outputs.append(
+            await worker.email_composer(
+                input=f" PROSPECT_INFO : {research} {email}",
+                instructions=worker.first_email_task_prompt,
+            )
+        )
+        latencies.append(time.perf_counter() - start)
+    return model, latencies, outputs
+
+
+def report(compose_mode, model, latencies):
+    print(f"{compose_mode}:")
+    print(f"  calls              {model.calls}")
+    print(f"  latency p50 / max  {statistics.median(latencies):.3f}s / {max(latencies):.3f}s")
+    print(f"  prompt tokens      {model.prompt_tokens}")
+    print(f"  completion tokens  {model.completion_tokens}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-latency", type=float, default=0.2)
+    parser.add_argument("--latency-per-token", type=float, default=0.001)
+    parser.add_argument("--show-diff", action="store_true")
+    args = parser.parse_args()
+
+    sales_index = SalesIndex.from_file(os.environ["PREVIOUS_SALES_DATA_FP"])
+
+    results = {}
+    for compose_mode in ("two_stage", "single_pass"):
+        results[compose_mode] = asyncio.run(run_mode(compose_mode, args, sales_index))
+        report(compose_mode, *results[compose_mode][:2])
+
+    print("output similarity (two_stage vs single_pass):")
+    for (email, _), before, after in zip(
+        PROSPECTS, results["two_stage"][2], results["single_pass"][2]
+    ):
+        ratio = difflib.SequenceMatcher(None, before, after).ratio()
+        print(f"  {email:28} {ratio:.2f}")
+        if args.show_diff:
+            for line in difflib.unified_diff(
+                before.splitlines(), after.splitlines(), "two_stage", "single_pass", lineterm=""
+            ):
+                print(f"    {line}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Import-time and cold-start benchmark of the Lambda agent.
+
+Measures, in fresh interpreters, how long ``app.lambda_agent`` and the heavy
+dependencies it defers take to import. It then times the first invocation of
+``lambda_handler`` in a new process (cold) against the invocations after it
+(warm). By default, model and agent construction, knowledge-base uploads and
+the LLM calls are replaced with stubs that sleep, so no network or API keys
+are needed.
+Pass --live to use the real models.
+
+    python -m benchmarks.lambda_cold_start --invocations 5 --init-latency 1.5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+ENV_DEFAULTS = {
+    "PORT": "587",
+    "JOB_STORE_URL": "none",
+    # The registry hashes both files, and the product PDF is not checked in.
+    "COMPANY_PRODUCT_DATA_FP": "resources/previous_sales_convos.txt",
+    "PREVIOUS_SALES_DATA_FP": "resources/previous_sales_convos.txt",
+}
+
+DEFERRED_MODULES = [
+    "lyzr_automata.agents.agent_base",
+    "lyzr_automata.ai_models.openai",
+    "lyzr_automata.ai_models.perplexity",
+    "lyzr_automata.memory.open_ai",
+    "lyzr_automata.tasks.task_base",
+    "duckduckgo_search",
+]
+
+IMPORT_SNIPPET = (
+    "import time; start = time.perf_counter(); import {module}; "
+    "print(time.perf_counter() - start)"
+)
+
+EVENT = {
+    "history_email_body": "<p>Hi Jane, would a 20 minute call next week work?</p>",
+    "current_email_body": "Sounds good, what does pricing look like for a team of 12?",
+}
+
+
+def child_env():
+    env = dict(os.environ)
+    for key, value in ENV_DEFAULTS.items():
+        env.setdefault(key, value)
+    return env
+
+
+def import_time(module, repeat):
+    timings = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET.format(module=module)],
+            capture_output=True,
+            text=True,
+            env=child_env(),
+        )
+        if result.returncode != 0:
+            return None
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return statistics.median(timings)
+
+
+def stub_out(lambda_agent, init_latency, llm_latency):
+    def build_models(open_ai_key, perplexity_api_key):
+        time.sleep(init_latency)
+        return SimpleNamespace(name="openai"), SimpleNamespace(name="perplexity")
+
+    def build_agents(draft_prompt, sales_prompt, product_memory, sales_memory):
+        time.sleep(init_latency)
+        return (
+            SimpleNamespace(prompt_persona=draft_prompt),
+            SimpleNamespace(prompt_persona=sales_prompt),
+        )
+
+    def upload_memory(file_path, model, ids_file):
+        time.sleep(init_latency)
+        return SimpleNamespace(file_path=file_path, ids_file=ids_file)
+
+    def run_task(self, **task_kwargs):
+        time.sleep(llm_latency)
+        return f"<p>{task_kwargs.get('name')}</p>"
+
+    lambda_agent.build_models = build_models
+    lambda_agent.build_agents = build_agents
+    # The registry itself stays real, so warm invocations reuse its models.
+    lambda_agent.memory_registry.memory_factory = upload_memory
+    lambda_agent.JaWorker.run_task = run_task
+
+
+def child(args):
+    start = time.perf_counter()
+    from app import lambda_agent
+
+    imported = time.perf_counter() - start
+    if not args.live:
+        stub_out(lambda_agent, args.init_latency, args.llm_latency)
+
+    invocations = []
+    for _ in range(args.invocations):
+        start = time.perf_counter()
+        lambda_agent.lambda_handler(EVENT, None)
+        invocations.append(time.perf_counter() - start)
+    print(json.dumps({"import": imported, "invocations": invocations}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invocations", type=int, default=5)
+    parser.add_argument("--import-repeat", type=int, default=3)
+    parser.add_argument("--init-latency", type=float, default=1.0)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--live", action="store_true")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    print("import time (fresh interpreter, median):")
+    for module in ["app.lambda_agent"] + DEFERRED_MODULES:
+        seconds = import_time(module, args.import_repeat)
+        timing = "not importable" if seconds is None else f"{seconds * 1000:8.1f}ms"
+        print(f"  {module:36} {timing}")
+
+    command = [
+        sys.executable, "-m", "benchmarks.lambda_cold_start", "--child",
+        "--invocations", str(args.invocations),
+        "--init-latency", str(args.init_latency),
+        "--llm-latency", str(args.llm_latency),
+    ] + (["--live"] if args.live else [])
+    result = subprocess.run(command, capture_output=True, text=True, env=child_env())
+    if result.returncode != 0:
+        print(result.stderr)
+        sys.exit(result.returncode)
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+
+    invocations = timings["invocations"]
+    print("lambda_handler (new process):")
+    print(f"  import app.lambda_agent   {timings['import'] * 1000:8.1f}ms")
+    print(f"  cold invocation           {invocations[0] * 1000:8.1f}ms")
+    if len(invocations) > 1:
+        warm = invocations[1:]
+        print(f"  warm invocation p50       {statistics.median(warm) * 1000:8.1f}ms")
+        print(f"  warm invocation max       {max(warm) * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
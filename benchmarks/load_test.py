@@ -0,0 +1,406 @@
+"""Offline end-to-end load test of the sales pipeline server.
+
+Starts the FastAPI app in-process against local stand-ins: fake OpenAI and
+Perplexity models with configurable latency, a stubbed DuckDuckGo search, a
+local IMAP server (with IDLE) and an SMTP sink. It then posts N prospects to
+/add-prospect/ concurrently. Every first email that reaches the sink is
+answered by a simulated prospect reply through the IMAP inbox, which drives
+the auto_reply flow. Reports throughput, per-stage p50/p95/p99, thread count
+and RSS. Nothing leaves the machine and no API keys are needed.
+
+    python -m benchmarks.load_test --prospects 200 --llm-latency 0.8 --replies 2
+
+Run it before and after every performance change to app/agent.py or
+app/server.py; --json writes the numbers to a file for comparison.
+"""
+import argparse
+import asyncio
+import email
+import imaplib
+import json
+import math
+import os
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid, parseaddr
+
+from benchmarks.stubs import FakeModel, IMAPStub, SMTPSink, fake_memory_model, free_port
+
+SENDER = "jazon@loadtest.local"
+PROSPECT_REPLY = "Thanks for reaching out. Could you share pricing for a team of 12 and a few times next week?"
+
+
+class Recorder:
+    """Collects per-stage durations from every thread of the run."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.samples[stage].append(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+
+recorder = Recorder()
+options = argparse.Namespace()
+models = []
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def setup_environment(imap_port, smtp_port, workdir):
+    os.environ.update(
+        {
+            "EMAIL": SENDER,
+            "PASSWORD": "loadtest",
+            "PORT": str(smtp_port),
+            "IMAP_SERVER": "127.0.0.1",
+            "SMTP_SERVER": "127.0.0.1",
+            "IMAP_CHECKPOINT_FP": os.path.join(workdir, "imap_checkpoint.json"),
+            "JOB_STORE_URL": options.job_store,
+            "SEND_MODE": "direct",
+            "LLM_CACHE_ENABLED": "false",
+            "RESEARCH_CACHE_FP": "",
+            "WORK_QUEUE_URL": (
+                f"sqlite:///{os.path.join(workdir, 'queue.db')}"
+                if options.queue_workers
+                else ""
+            ),
+        }
+    )
+    sales_history = "resources/previous_sales_convos.txt"
+    os.environ.setdefault("PREVIOUS_SALES_DATA_FP", sales_history)
+    if not os.path.exists(os.environ.get("COMPANY_PRODUCT_DATA_FP", "")):
+        os.environ["COMPANY_PRODUCT_DATA_FP"] = sales_history
+    os.environ["LOAD_TEST_IMAP_PORT"] = str(imap_port)
+
+
+def patch_server():
+    """Points the server at the local stand-ins and wraps stages with timers."""
+    from app import server, worker
+    from app.agent import JaWorker
+    from app.email_service import EmailMonitoringService
+    from app.memory_registry import memory_registry
+    from app.smtp_pool import PooledSMTP, SMTPConnectionPool, smtp_pools
+
+    class LoadTestWorker(JaWorker):
+        def init(self):
+            with recorder.time("init"):
+                super().init()
+
+        def create_models(self, open_ai_key, perplexity_api_key):
+            self.open_ai_model_text = FakeModel(
+                "openai", options.llm_latency, options.latency_per_token, options.jitter
+            )
+            self.perplexity_model_text = FakeModel(
+                "perplexity", options.llm_latency, options.latency_per_token, options.jitter
+            )
+            models.extend((self.open_ai_model_text, self.perplexity_model_text))
+
+        async def search_website(self, query):
+            with recorder.time("ddg"):
+                await asyncio.sleep(options.ddg_latency)
+                return [
+                    {"title": query, "href": f"https://{query}", "body": f"{query} home page"}
+                ]
+
+        async def research_task(self, email):
+            with recorder.time("research"):
+                return await super().research_task(email)
+
+        async def email_composer(self, input, instructions):
+            stage = "reply_compose" if self.stage == "reply" else "compose"
+            with recorder.time(stage):
+                return await super().email_composer(input, instructions)
+
+        async def deliver_email(self, *args, **kwargs):
+            with recorder.time("smtp_send"):
+                return await super().deliver_email(*args, **kwargs)
+
+    class LocalInbox(EmailMonitoringService):
+        def connect(self):
+            self.mail = imaplib.IMAP4(
+                self.imap_server, int(os.environ["LOAD_TEST_IMAP_PORT"])
+            )
+            self.mail.login(self.username, self.password)
+            self.mail.select("inbox")
+            self.supports_idle = "IDLE" in self.mail.capabilities
+            self.sync_state()
+
+        def fetch_emails(self):
+            with recorder.time("imap_fetch"):
+                return super().fetch_emails()
+
+    class LocalSMTPPool(SMTPConnectionPool):
+        def connect(self):
+            # The sink speaks plain SMTP without AUTH.
+            conn = PooledSMTP(self.host, self.port, timeout=self.timeout)
+            with self.lock:
+                self.connects += 1
+            return conn
+
+    from app import settings
+
+    worker.JaWorker = LoadTestWorker
+    server.EmailMonitoringService = LocalInbox
+    memory_registry.memory_factory = lambda file_path, model, ids_file: fake_memory_model(
+        file_path, model, ids_file, options.memory_latency
+    )
+    smtp_pools[(settings.smtp_server, settings.port, settings.email)] = LocalSMTPPool(
+        settings.smtp_server,
+        settings.port,
+        settings.email,
+        settings.password,
+        max_sessions=settings.smtp_max_sessions,
+    )
+    return server
+
+
+class ProspectSimulator:
+    """Plays every prospect: answers each first email or reply up to ``replies`` times."""
+
+    def __init__(self, mailbox, prospects, replies, reply_delay):
+        self.mailbox = mailbox
+        self.replies = replies
+        self.reply_delay = reply_delay
+        self.posted_at = {}
+        self.replied_at = {}
+        self.replies_sent = defaultdict(int)
+        self.first_touches = 0
+        self.answers = 0
+        self.expected = prospects * (1 + replies)
+        self.received = 0
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.finished_at = None
+
+    def on_message(self, raw):
+        now = time.perf_counter()
+        message = email.message_from_bytes(raw)
+        prospect = parseaddr(message["To"])[1]
+        with self.lock:
+            if message["In-Reply-To"]:
+                self.answers += 1
+                recorder.add("reply_round_trip", now - self.replied_at[prospect])
+            else:
+                self.first_touches += 1
+                recorder.add("first_touch", now - self.posted_at[prospect])
+            reply = self.replies_sent[prospect] < self.replies
+            if reply:
+                self.replies_sent[prospect] += 1
+            self.received += 1
+            if self.received >= self.expected:
+                self.finished_at = now
+                self.done.set()
+        if reply:
+            threading.Timer(self.reply_delay, self.reply, (prospect, message)).start()
+
+    def reply(self, prospect, message):
+        subject = message["Subject"]
+        quoted = re.sub(r"<[^>]+>", " ", message.get_payload(0).get_payload(decode=True).decode())
+        reply = EmailMessage()
+        reply["From"] = prospect
+        reply["To"] = SENDER
+        reply["Subject"] = subject if subject.lower().startswith("re:") else f"Re: {subject}"
+        reply["Date"] = formatdate(localtime=True)
+        reply["Message-ID"] = make_msgid(domain=prospect.split("@")[-1])
+        reply["In-Reply-To"] = message["Message-ID"]
+        reply["References"] = message["Message-ID"]
+        reply.set_content(
+            f"{PROSPECT_REPLY}\n\nOn {message['Date']}, {SENDER} wrote:\n"
+            + "\n".join(f"> {line}" for line in quoted.split("\n"))
+        )
+        with self.lock:
+            self.replied_at[prospect] = time.perf_counter()
+        self.mailbox.append(reply.as_bytes())
+
+
+def start_queue_workers(count):
+    """Runs ``count`` queue workers on threads of this process, sharing its scheduler."""
+    from app.work_queue import work_queue
+    from app.worker import QueueWorker
+
+    workers = [
+        QueueWorker(
+            work_queue,
+            worker_id=f"load-test-{i}",
+            concurrency=options.queue_concurrency,
+            poll_interval=0.05,
+        )
+        for i in range(count)
+    ]
+    for queue_worker in workers:
+        threading.Thread(target=queue_worker.run, daemon=True).start()
+    return workers
+
+
+def start_http(app):
+    import uvicorn
+
+    http_port = free_port()
+    config = uvicorn.Config(app, host="127.0.0.1", port=http_port, log_level="warning")
+    http = uvicorn.Server(config)
+    http.install_signal_handlers = lambda: None
+    threading.Thread(target=http.run, daemon=True).start()
+    while not http.started:
+        time.sleep(0.05)
+    return http, f"http://127.0.0.1:{http_port}"
+
+
+def add_prospect(base_url, simulator, prospect):
+    simulator.posted_at[prospect] = time.perf_counter()
+    request = urllib.request.Request(
+        f"{base_url}/add-prospect/?email={prospect}", data=b"", method="POST"
+    )
+    with recorder.time("http_add_prospect"):
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+
+
+def sample_resources(stop, peaks):
+    while not stop.wait(0.2):
+        peaks["threads"] = max(peaks["threads"], threading.active_count())
+        peaks["rss_mb"] = max(peaks["rss_mb"], rss_mb())
+
+
+def report(results):
+    print(f"prospects             {results['prospects']} ({results['completed']} first emails, {results['answers']} replies sent)")
+    print(f"smtp sink             {results['smtp_backend']}")
+    if results["queue"]:
+        print(f"work queue            {results['queue']}")
+    print(f"wall time             {results['wall_time']:.2f}s")
+    print(f"throughput            {results['prospects_per_sec']:.2f} prospects/s, {results['emails_per_sec']:.2f} emails/s")
+    print(f"llm calls             {results['llm_calls']}")
+    print(f"threads (peak/end)    {results['peak_threads']} / {results['threads']}")
+    print(f"rss MB (peak/end)     {results['peak_rss_mb']:.1f} / {results['rss_mb']:.1f}")
+    print(f"{'stage':22}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for stage, stats in results["stages"].items():
+        print(
+            f"{stage:22}{stats['n']:>6}"
+            + "".join(f"{stats[p] * 1000:>8.0f}ms" for p in ("p50", "p95", "p99"))
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--prospects", type=int, default=50)
+    parser.add_argument("--domains", type=int, default=10, help="prospects are spread over this many company domains")
+    parser.add_argument("--clients", type=int, default=10, help="concurrent /add-prospect/ callers")
+    parser.add_argument("--replies", type=int, default=1, help="prospect replies per thread")
+    parser.add_argument("--reply-delay", type=float, default=0.5)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--latency-per-token", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--ddg-latency", type=float, default=0.3)
+    parser.add_argument("--memory-latency", type=float, default=0.0)
+    parser.add_argument("--job-store", default="memory://")
+    parser.add_argument("--queue-workers", type=int, default=0, help="run pipelines through a SQLite work queue consumed by this many workers")
+    parser.add_argument("--queue-concurrency", type=int, default=10, help="jobs each queue worker holds at once")
+    parser.add_argument("--builtin-smtp", action="store_true", help="use the built-in SMTP sink even if aiosmtpd is installed")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep the server's own output")
+    parser.parse_args(namespace=options)
+
+    imap = IMAPStub()
+    simulator = ProspectSimulator(
+        imap.mailbox, options.prospects, options.replies, options.reply_delay
+    )
+    smtp = SMTPSink(simulator.on_message, use_aiosmtpd=not options.builtin_smtp)
+    workdir = tempfile.mkdtemp(prefix="jazon-load-")
+    setup_environment(imap.port, smtp.port, workdir)
+    server = patch_server()
+    http, base_url = start_http(server.app)
+    queue_workers = start_queue_workers(options.queue_workers)
+
+    prospects = [
+        f"prospect{i}@company{i % options.domains}.example" for i in range(options.prospects)
+    ]
+    peaks = {"threads": threading.active_count(), "rss_mb": rss_mb()}
+    stop_sampling = threading.Event()
+    threading.Thread(target=sample_resources, args=(stop_sampling, peaks), daemon=True).start()
+
+    start = time.perf_counter()
+    # lyzr prints every task's full output; keep it out of the report.
+    with open(os.devnull, "w") as devnull, redirect_stdout(
+        sys.stdout if options.verbose else devnull
+    ):
+        with ThreadPoolExecutor(max_workers=options.clients) as clients:
+            list(clients.map(lambda prospect: add_prospect(base_url, simulator, prospect), prospects))
+        finished = simulator.done.wait(options.timeout)
+    if not finished:
+        print(f"timed out after {options.timeout}s with {simulator.received}/{simulator.expected} emails received")
+    wall_time = (simulator.finished_at or time.perf_counter()) - start
+    stop_sampling.set()
+
+    llm_calls = sum(model.calls for model in models)
+    results = {
+        "prospects": options.prospects,
+        "completed": simulator.first_touches,
+        "answers": simulator.answers,
+        "smtp_backend": smtp.backend,
+        "queue": server.work_queue.stats() if server.work_queue is not None else None,
+        "wall_time": wall_time,
+        "prospects_per_sec": simulator.first_touches / wall_time,
+        "emails_per_sec": simulator.received / wall_time,
+        "llm_calls": llm_calls,
+        "threads": threading.active_count(),
+        "peak_threads": peaks["threads"],
+        "rss_mb": rss_mb(),
+        "peak_rss_mb": peaks["rss_mb"],
+        "stages": {
+            stage: {
+                "n": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+            }
+            for stage, values in sorted(recorder.samples.items())
+        },
+    }
+    report(results)
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    for queue_worker in queue_workers:
+        queue_worker.stopped.set()
+    http.should_exit = True
+    smtp.stop()
+    imap.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""Local stand-ins for the services a JaWorker talks to, for offline benchmarks.
+
+FakeModel and fake_memory_model take the place of lyzr's
+OpenAIModel/PerplexityModel and its file-retrieval memory model. FakeMailbox
+serves an in-memory inbox over IMAP (with IDLE) and SMTPSink accepts mail
+over SMTP, via aiosmtpd when it is installed.
+"""
+import hashlib
+import random
+import select
+import socket
+import socketserver
+import time
+from threading import Condition, Lock, Thread
+
+
+class FakeModel:
+    """Implements AIModel.generate_text with configurable latency and canned output."""
+
+    def __init__(self, name, base_latency=0.5, latency_per_token=0.0, jitter=0.2):
+        self.name = name
+        self.api_key = "fake"
+        self.parameters = {"model": f"fake-{name}"}
+        self.base_latency = base_latency
+        self.latency_per_token = latency_per_token
+        self.jitter = jitter
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.lock = Lock()
+
+    def generate_text(self, task_id=None, system_persona=None, prompt=None, messages=None):
+        prompt = f"{system_persona or ''} {prompt or ''}"
+        tokens = len(prompt) // 4
+        time.sleep(
+            self.base_latency
+            + tokens * self.latency_per_token
+            + random.uniform(0, self.jitter)
+        )
+        with self.lock:
+            self.calls += 1
+            self.prompt_tokens += tokens
+
+        tail = " ".join(prompt.split()[-40:])
+        if self.name == "perplexity":
+            return f"- Notes from the web: {tail}"
+        if "compile this information" in prompt:
+            # Without the marker, so prompts that quote the summary are not
+            # mistaken for another summary task.
+            return f"Summary: {tail.replace('compile this information', '')}"
+        # Composer output; the digest keeps every prospect's subject distinct.
+        digest = hashlib.sha256(prompt.encode()).hexdigest()[:8]
+        return (
+            f"Subject: Quick idea for your team ({digest})\n"
+            f"<p>Hi,</p><p>{tail}</p><p>Best,<br>Jazon</p>"
+        )
+
+    def generate_image(self, task_id=None, prompt=None, resource_box=None):
+        return None
+
+
+def fake_memory_model(file_path, model, ids_file, upload_latency=0.0):
+    """Stands in for the file-retrieval model: sleeps like the upload, then
+    answers from the model it wraps."""
+    time.sleep(upload_latency)
+    return model
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ThreadedServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handler, **attrs):
+        super().__init__(("127.0.0.1", 0), handler)
+        for name, value in attrs.items():
+            setattr(self, name, value)
+        self.port = self.server_address[1]
+
+    def start(self):
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class FakeMailbox:
+    """In-memory INBOX shared by every IMAP session of an IMAPStub."""
+
+    def __init__(self):
+        self.messages = []
+        self.changed = Condition()
+
+    def append(self, raw):
+        with self.changed:
+            self.messages.append((len(self.messages) + 1, raw))
+            self.changed.notify_all()
+
+    def __len__(self):
+        return len(self.messages)
+
+    def uids(self, sequence_set):
+        """Resolves an IMAP UID set such as ``"5:*"`` or ``"3:4,9"``."""
+        with self.changed:
+            highest = self.messages[-1][0] if self.messages else 0
+        if not highest:
+            return []
+        matched = set()
+        for part in sequence_set.split(","):
+            low, _, high = part.partition(":")
+            low = highest if low == "*" else int(low)
+            high = low if not high else highest if high == "*" else int(high)
+            matched.update(range(min(low, high), max(low, high) + 1))
+        return sorted(uid for uid in matched if uid <= highest)
+
+
+class IMAPHandler(socketserver.StreamRequestHandler):
+    """The subset of IMAP4rev1 that EmailMonitoringService uses, plus IDLE."""
+
+    def send(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        mailbox = self.server.mailbox
+        self.reported = 0
+        self.send("* OK [CAPABILITY IMAP4rev1 IDLE] load test IMAP ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.decode().split()
+            if len(parts) < 2:
+                continue
+            tag, command, args = parts[0], parts[1].upper(), parts[2:]
+            if command == "CAPABILITY":
+                self.send("* CAPABILITY IMAP4rev1 IDLE")
+            elif command in ("SELECT", "EXAMINE"):
+                self.report_exists(mailbox)
+                self.send("* OK [UIDVALIDITY 1] UIDs valid")
+            elif command == "UID" and args[0].upper() == "SEARCH":
+                uids = mailbox.uids(args[-1])
+                self.send("* SEARCH " + " ".join(map(str, uids)))
+            elif command == "UID" and args[0].upper() == "FETCH":
+                for uid in mailbox.uids(args[1]):
+                    raw = mailbox.messages[uid - 1][1]
+                    self.wfile.write(
+                        f"* {uid} FETCH (UID {uid} RFC822 {{{len(raw)}}}\r\n".encode()
+                        + raw
+                        + b")\r\n"
+                    )
+            elif command == "IDLE":
+                self.idle(mailbox)
+            elif command == "LOGOUT":
+                self.send("* BYE")
+                self.send(f"{tag} OK LOGOUT completed")
+                return
+            self.send(f"{tag} OK {command} completed")
+
+    def report_exists(self, mailbox):
+        # Like a real server, tell the session about mail it has not seen yet.
+        count = len(mailbox)
+        if count != self.reported or not count:
+            self.reported = count
+            self.send(f"* {count} EXISTS")
+
+    def idle(self, mailbox):
+        self.send("+ idling")
+        while True:
+            if len(mailbox) != self.reported:
+                self.report_exists(mailbox)
+            readable, _, _ = select.select([self.connection], [], [], 0.05)
+            if readable:
+                self.rfile.readline()  # DONE
+                return
+            with mailbox.changed:
+                if len(mailbox) == self.reported:
+                    mailbox.changed.wait(0.05)
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Minimal SMTP receiver used when aiosmtpd is not installed."""
+
+    def send(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.send("220 load test SMTP ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors="replace").strip().split(" ", 1)[0].upper()
+            if command == "EHLO":
+                self.send("250-localhost")
+                self.send("250 8BITMIME")
+            elif command == "DATA":
+                self.send("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b".\r\n", b".\n"):
+                        break
+                    lines.append(data[1:] if data.startswith(b"..") else data)
+                self.server.on_message(b"".join(lines))
+                self.send("250 OK queued")
+            elif command == "QUIT":
+                self.send("221 Bye")
+                return
+            else:
+                self.send("250 OK")
+
+
+class IMAPStub:
+    def __init__(self):
+        self.mailbox = FakeMailbox()
+        self.server = ThreadedServer(IMAPHandler, mailbox=self.mailbox).start()
+        self.port = self.server.port
+
+    def stop(self):
+        self.server.shutdown()
+
+
+class SMTPSink:
+    """Accepts every message and hands its raw bytes to ``on_message``."""
+
+    def __init__(self, on_message, use_aiosmtpd=True):
+        self.on_message = on_message
+        self.controller = None
+        if use_aiosmtpd:
+            try:
+                from aiosmtpd.controller import Controller
+            except ImportError:
+                Controller = None
+            if Controller is not None:
+                self.port = free_port()
+                self.controller = Controller(self, hostname="127.0.0.1", port=self.port)
+                self.controller.start()
+                self.backend = "aiosmtpd"
+                return
+        self.server = ThreadedServer(SMTPHandler, on_message=on_message).start()
+        self.port = self.server.port
+        self.backend = "builtin"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.on_message(envelope.original_content or envelope.content)
+        return "250 OK queued"
+
+    def stop(self):
+        if self.controller is not None:
+            self.controller.stop()
+        else:
+            self.server.shutdown()
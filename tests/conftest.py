@@ -0,0 +1,14 @@
+import os
+
+# Importing ``app`` reads its settings from the environment; keep tests off
+# the real job store, caches and mail servers.
+for key, value in {
+    "PORT": "587",
+    "JOB_STORE_URL": "none",
+    "WORK_QUEUE_URL": "",
+    "RESEARCH_CACHE_FP": "",
+    "LLM_CACHE_ENABLED": "false",
+    "COMPANY_PRODUCT_DATA_FP": "resources/previous_sales_convos.txt",
+    "PREVIOUS_SALES_DATA_FP": "resources/previous_sales_convos.txt",
+}.items():
+    os.environ.setdefault(key, value)
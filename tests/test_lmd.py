@@ -0,0 +1,126 @@
+import os
+import threading
+
+import pytest
+
+pytest.importorskip("boto3")
+from botocore.exceptions import ClientError
+
+os.environ.setdefault("Region", "us-east-1")
+os.environ.setdefault("MailS3Bucket", "incoming-mail")
+os.environ.setdefault("MailS3Prefix", "inbox")
+os.environ.setdefault("MailSender", "sales@example.com")
+
+from app import lmd
+
+
+def raw_email(message_id, sender="prospect@example.com", subject="Pricing"):
+    return (
+        f"From: {sender}\r\nSubject: {subject}\r\nMessage-ID: <{message_id}@mail>\r\n\r\nHello\r\n"
+    ).encode()
+
+
+class Body:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class FakeS3:
+    def __init__(self, objects):
+        self.objects = objects
+        self.keys = []
+        self.lock = threading.Lock()
+
+    def get_object(self, Bucket, Key):
+        with self.lock:
+            self.keys.append(Key)
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": "Not found"}}, "GetObject")
+        return {"Body": Body(self.objects[Key])}
+
+
+class FakeSES:
+    def __init__(self, reject=()):
+        self.reject = set(reject)
+        self.sent = []
+
+    def send_raw_email(self, Source, Destinations, RawMessage):
+        if Destinations[0] in self.reject:
+            raise ClientError({"Error": {"Code": "MessageRejected", "Message": "Rejected"}}, "SendRawEmail")
+        self.sent.append(Destinations[0])
+        return {"MessageId": f"reply-{len(self.sent)}"}
+
+
+def record(message_id):
+    return {"ses": {"mail": {"messageId": message_id}}}
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    s3 = FakeS3(
+        {
+            "inbox/a": raw_email("a", sender="a@example.com"),
+            "inbox/b": raw_email("b", sender="b@example.com"),
+            "inbox/c": raw_email("c", sender="c@example.com"),
+        }
+    )
+    ses = FakeSES()
+    monkeypatch.setattr(lmd, "client_s3", s3)
+    monkeypatch.setattr(lmd, "client_ses", ses)
+    return s3, ses
+
+
+def test_replies_to_every_record_in_a_batch(clients):
+    s3, ses = clients
+    result = lmd.lambda_handler({"Records": [record("a"), record("b"), record("c")]}, None)
+
+    assert result == {"batchItemFailures": []}
+    assert sorted(s3.keys) == ["inbox/a", "inbox/b", "inbox/c"]
+    assert sorted(ses.sent) == ["a@example.com", "b@example.com", "c@example.com"]
+
+
+def test_reports_only_failed_records(clients):
+    s3, ses = clients
+    ses.reject.add("b@example.com")
+    event = {"Records": [record("a"), record("b"), record("missing"), record("c")]}
+
+    result = lmd.lambda_handler(event, None)
+
+    assert result == {"batchItemFailures": [{"itemIdentifier": "b"}, {"itemIdentifier": "missing"}]}
+    assert sorted(ses.sent) == ["a@example.com", "c@example.com"]
+
+
+def test_malformed_record_does_not_fail_the_batch(clients):
+    s3, ses = clients
+    event = {"Records": [record("a"), {"ses": {"mail": {}}}, None, record("b")]}
+
+    result = lmd.lambda_handler(event, None)
+
+    assert result == {"batchItemFailures": []}
+    assert sorted(ses.sent) == ["a@example.com", "b@example.com"]
+
+
+def test_duplicate_message_ids_are_answered_once(clients):
+    s3, ses = clients
+    result = lmd.lambda_handler({"Records": [record("a"), record("a"), record("b")]}, None)
+
+    assert result == {"batchItemFailures": []}
+    assert sorted(s3.keys) == ["inbox/a", "inbox/b"]
+    assert sorted(ses.sent) == ["a@example.com", "b@example.com"]
+
+
+def test_clients_are_reused_across_invocations(clients, monkeypatch):
+    s3, ses = clients
+
+    def no_new_clients(*args, **kwargs):
+        raise AssertionError("boto3 client created during an invocation")
+
+    monkeypatch.setattr(lmd.boto3, "client", no_new_clients)
+    lmd.lambda_handler({"Records": [record("a")]}, None)
+    lmd.lambda_handler({"Records": [record("b")]}, None)
+
+    assert lmd.client_s3 is s3 and lmd.client_ses is ses
+    assert sorted(ses.sent) == ["a@example.com", "b@example.com"]
@@ -0,0 +1,125 @@
+import asyncio
+import time
+from concurrent.futures import wait
+from threading import Event
+
+import pytest
+
+from app.scheduler import PipelineScheduler
+
+
+@pytest.fixture
+def scheduler_factory():
+    schedulers = []
+
+    def build(**kwargs):
+        scheduler = PipelineScheduler(**kwargs)
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield build
+    for scheduler in schedulers:
+        scheduler.stop()
+
+
+def job(started, name, seconds):
+    async def run():
+        # Runs on the scheduler loop, so appends are ordered and race-free.
+        started.append(name)
+        await asyncio.sleep(seconds)
+
+    return run
+
+
+def submit_together(scheduler, jobs):
+    """Submits ``(key, factory, priority)`` jobs from the scheduler loop, so all
+    are queued before any of them can finish."""
+
+    async def submit():
+        return [scheduler.submit(*args) for args in jobs]
+
+    scheduler.start()
+    return asyncio.run_coroutine_threadsafe(submit(), scheduler.loop).result(timeout=10)
+
+
+def test_replies_overtake_a_bulk_import_however_long_it_waited(scheduler_factory):
+    # Aging is near-instant, so every first touch is as aged as it can get.
+    scheduler = scheduler_factory(max_concurrency=10, aging_seconds=0.001)
+    started = []
+    first_touches = submit_together(
+        scheduler,
+        [(f"first:{i}", job(started, "first_touch", 0.02), "first_touch") for i in range(400)],
+    )
+    time.sleep(0.1)
+    replies = submit_together(
+        scheduler, [(f"reply:{i}", job(started, "reply", 0.01), "reply") for i in range(20)]
+    )
+
+    done, not_done = wait(first_touches + replies, timeout=30)
+
+    assert not not_done
+    first_reply = started.index("reply")
+    last_reply = max(i for i, name in enumerate(started) if name == "reply")
+    # Every slot freed once the replies arrived went to a reply.
+    assert "first_touch" not in started[first_reply:last_reply]
+    assert started.count("first_touch") == 400
+    assert scheduler.stats()["classes"]["reply"]["started"] == 20
+
+
+def test_aged_first_touch_is_not_starved_by_follow_ups(scheduler_factory):
+    scheduler = scheduler_factory(max_concurrency=1, aging_seconds=0.05)
+    started = []
+    finished = Event()
+
+    def follow_up(remaining):
+        async def run():
+            started.append("follow_up")
+            # A steady stream: the next follow-up always arrives fresh.
+            if remaining:
+                scheduler.submit(f"follow:{remaining}", follow_up(remaining - 1), priority="follow_up")
+            await asyncio.sleep(0.01)
+            if not remaining:
+                finished.set()
+
+        return run
+
+    scheduler.submit("follow:first", follow_up(30), priority="follow_up")
+    first_touch = scheduler.submit("first", job(started, "first_touch", 0.01), priority="first_touch")
+
+    assert finished.wait(timeout=30)
+    first_touch.result(timeout=30)
+    # Raised to the follow-ups' class, it wins on having waited longer.
+    assert started.index("first_touch") < 10
+
+
+def test_aged_first_touch_runs_ahead_of_a_later_follow_up_backlog(scheduler_factory):
+    scheduler = scheduler_factory(max_concurrency=1, aging_seconds=0.05)
+    started = []
+    blocker = scheduler.submit("blocker", job(started, "blocker", 0.1), priority="reply")
+    first_touch = scheduler.submit("first", job(started, "first_touch", 0.01), priority="first_touch")
+    follow_ups = [
+        scheduler.submit(f"follow:{i}", job(started, "follow_up", 0.005), priority="follow_up")
+        for i in range(60)
+    ]
+
+    done, not_done = wait([blocker, first_touch] + follow_ups, timeout=30)
+
+    assert not not_done
+    # The follow-ups age too, but not past the first touch that waited longer.
+    assert started[:2] == ["blocker", "first_touch"]
+
+
+def test_aging_lifts_a_job_by_one_class_at_most(scheduler_factory):
+    scheduler = scheduler_factory(max_concurrency=1, aging_seconds=0.01)
+    started = []
+    blocker = scheduler.submit("blocker", job(started, "blocker", 0.1), priority="reply")
+    follow_up = scheduler.submit("follow", job(started, "follow_up", 0.01), priority="follow_up")
+    first_touch = scheduler.submit("first", job(started, "first_touch", 0.01), priority="first_touch")
+    reply = scheduler.submit("reply", job(started, "reply", 0.01), priority="reply")
+
+    done, not_done = wait([blocker, first_touch, follow_up, reply], timeout=30)
+
+    assert not not_done
+    # Both waited longer than the reply, but only rise to the follow-ups' class,
+    # where the one that waited longest goes first.
+    assert started == ["blocker", "reply", "follow_up", "first_touch"]